@@ -0,0 +1,95 @@
+import gzip
+import json
+import time
+import random
+import argparse
+
+from json_decoder import available_backends, get_decoder, loads as full_loads
+
+# Синтетическая запись works, близкая по структуре и объему к записям OpenAlex
+def make_synthetic_work(n):
+    words = ["graph", "neural", "network", "protein", "climate", "model", "quantum", "data", "analysis", "learning"]
+    return {
+        "id": f"https://openalex.org/W{n}",
+        "doi": f"https://doi.org/10.1000/{n}",
+        "title": " ".join(random.choice(words) for _ in range(12)),
+        "publication_year": random.randint(1990, 2025),
+        "type": "article",
+        "cited_by_count": random.randint(0, 500),
+        "abstract_inverted_index": {w: sorted(random.sample(range(300), 8)) for w in words * 3},
+        "primary_location": {"source": {"id": f"https://openalex.org/S{n % 997}", "publisher": "Publisher"}},
+        "authorships": [{"author": {"id": f"https://openalex.org/A{n * 7 + i}", "display_name": "Name Surname"},
+                         "institutions": [{"id": f"https://openalex.org/I{i}", "display_name": "University"}]}
+                        for i in range(6)],
+        "concepts": [{"id": f"https://openalex.org/C{i}", "score": random.random(), "level": i % 4} for i in range(10)],
+        "counts_by_year": [{"year": 2025 - i, "cited_by_count": i} for i in range(10)],
+        "referenced_works": [f"https://openalex.org/W{random.randint(1, 10 ** 9)}" for _ in range(30)]
+    }
+
+# Загрузка строк для замера: из файла .jsonl.gz или синтетических записей
+def load_lines(path, limit):
+    if path:
+        lines = []
+        with gzip.open(path, 'rb') as f:
+            for line in f:
+                lines.append(line)
+                if len(lines) >= limit:
+                    break
+        return lines
+    random.seed(0)
+    return [json.dumps(make_synthetic_work(n)).encode('utf-8') for n in range(limit)]
+
+# Замер скорости декодирования одним декодером
+def bench_backend(name, lines, repeat):
+    _, loads = get_decoder(name)
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for line in lines:
+            loads(line)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+# Замер разбора works целиком и через проекцию WorkView (вместе с extract_work)
+def bench_works_view(lines, repeat):
+    from works_view import decode_work, view_enabled
+    from process_works import extract_work
+    if not view_enabled():
+        print("Проекция works недоступна: установите msgspec")
+        return
+    results = {}
+    for name, decode in (("полный", full_loads), ("проекция", decode_work)):
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for line in lines:
+                extract_work(decode(line))
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        results[name] = best
+    print(f"\n{'разбор works':<12} {'записей/с':>12}")
+    for name, elapsed in results.items():
+        print(f"{name:<12} {len(lines) / elapsed:>12,.0f}")
+    print(f"Ускорение проекции: {results['полный'] / results['проекция']:.2f}x")
+
+def main():
+    parser = argparse.ArgumentParser(description='Сравнение скорости декодеров JSON на записях OpenAlex')
+    parser.add_argument('path', nargs='?', help='Файл .jsonl.gz (по умолчанию синтетические записи works)')
+    parser.add_argument('--records', type=int, default=20000, help='Количество записей для замера')
+    parser.add_argument('--repeat', type=int, default=3, help='Количество повторов (берется лучший результат)')
+    parser.add_argument('--works-view', action='store_true', help='Сравнить полный разбор works с проекцией WorkView')
+    args = parser.parse_args()
+
+    lines = load_lines(args.path, args.records)
+    total_mb = sum(len(line) for line in lines) / (1024 * 1024)
+    print(f"Записей: {len(lines)}, объем: {total_mb:.1f} МБ")
+    print(f"{'декодер':<10} {'записей/с':>12} {'МБ/с':>8}")
+    for name in available_backends():
+        elapsed = bench_backend(name, lines, args.repeat)
+        print(f"{name:<10} {len(lines) / elapsed:>12,.0f} {total_mb / elapsed:>8.1f}")
+    if args.works_view:
+        bench_works_view(lines, args.repeat)
+
+if __name__ == "__main__":
+    main()
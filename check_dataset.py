@@ -1,9 +1,12 @@
 import os
+import numpy as np
 import pandas as pd
 import logging
 import json
 import time
 from pathlib import Path
+from table_writers import PARTITION_COLUMN
+from id_codec import encode_ids
 
 # Настройка логирования
 logging.basicConfig(
@@ -19,10 +22,40 @@ logger = logging.getLogger("checker")
 # Директории для данных
 OUTPUT_DIR = "output"
 
-# Функция для расчета размера файла в МБ
+# Функция для расчета размера файла (или каталога таблицы Parquet) в МБ
 def get_file_size_mb(file_path):
+    if os.path.isdir(file_path):
+        return sum(os.path.getsize(os.path.join(root, name))
+                   for root, _, names in os.walk(file_path) for name in names) / (1024 * 1024)
     return os.path.getsize(file_path) / (1024 * 1024)
 
+# Выходные таблицы: CSV, Parquet и каталоги Parquet с разбиением по году
+def list_output_tables():
+    tables = {}
+    for file_name in sorted(os.listdir(OUTPUT_DIR)):
+        file_path = os.path.join(OUTPUT_DIR, file_name)
+        if file_name.endswith('.csv') or file_name.endswith('.parquet'):
+            tables[file_name] = file_path
+        elif os.path.isdir(file_path) and any(name.startswith(f"{PARTITION_COLUMN}=") for name in os.listdir(file_path)):
+            tables[file_name] = file_path
+    return tables
+
+# Загрузка таблицы в DataFrame
+def read_table(file_path):
+    if file_path.endswith('.csv'):
+        return pd.read_csv(file_path)
+    if os.path.isdir(file_path):
+        # Тип колонки разбиения задается явно, иначе pyarrow не объединит каталоги с пустым годом
+        import pyarrow as pa
+        import pyarrow.dataset as ds
+        partitioning = ds.partitioning(pa.schema([(PARTITION_COLUMN, pa.int32())]), flavor='hive')
+        return pd.read_parquet(file_path, partitioning=partitioning)
+    return pd.read_parquet(file_path)
+
+# Имя таблицы без расширения
+def table_name(file_name):
+    return os.path.splitext(file_name)[0]
+
 # Функция для проверки объема данных
 def check_dataset_size():
     logger.info("Проверка объема данных...")
@@ -30,26 +63,23 @@ def check_dataset_size():
     total_size_mb = 0
     file_stats = []
     
-    # Проверка всех CSV-файлов в выходной директории
-    for file_name in os.listdir(OUTPUT_DIR):
-        if file_name.endswith('.csv'):
-            file_path = os.path.join(OUTPUT_DIR, file_name)
-            
-            # Расчет размера файла
-            size_mb = get_file_size_mb(file_path)
-            total_size_mb += size_mb
-            
-            # Подсчет количества строк
-            df = pd.read_csv(file_path)
-            row_count = len(df)
-            
-            file_stats.append({
-                'file_name': file_name,
-                'size_mb': size_mb,
-                'row_count': row_count
-            })
-            
-            logger.info(f"Файл: {file_name}, Размер: {size_mb:.2f} МБ, Строк: {row_count}")
+    # Проверка всех таблиц в выходной директории
+    for file_name, file_path in list_output_tables().items():
+        # Расчет размера файла
+        size_mb = get_file_size_mb(file_path)
+        total_size_mb += size_mb
+        
+        # Подсчет количества строк
+        df = read_table(file_path)
+        row_count = len(df)
+        
+        file_stats.append({
+            'file_name': file_name,
+            'size_mb': size_mb,
+            'row_count': row_count
+        })
+        
+        logger.info(f"Файл: {file_name}, Размер: {size_mb:.2f} МБ, Строк: {row_count}")
     
     logger.info(f"Общий размер датасета: {total_size_mb:.2f} МБ ({total_size_mb/1024:.2f} ГБ)")
     
@@ -67,33 +97,34 @@ def check_dataset_size():
 def check_dataset_consistency():
     logger.info("Проверка связности данных...")
     
-    # Загрузка всех CSV-файлов
+    # Загрузка всех таблиц
     dfs = {}
-    for file_name in os.listdir(OUTPUT_DIR):
-        if file_name.endswith('.csv'):
-            file_path = os.path.join(OUTPUT_DIR, file_name)
-            dfs[file_name[:-4]] = pd.read_csv(file_path)
+    for file_name, file_path in list_output_tables().items():
+        dfs[table_name(file_name)] = read_table(file_path)
     
     consistency_issues = []
     
+    # ID сравниваются по кодам id_codec (отсортированные массивы int64), поэтому
+    # полные URI в таблицах связей совпадают с короткими ID в таблицах сущностей
+    
     # Проверка связей между работами и авторами
     if 'works' in dfs and 'author_work' in dfs and 'authors' in dfs:
         # Проверка, что все work_id в author_work существуют в works
-        work_ids_in_works = set(dfs['works']['id'])
-        work_ids_in_author_work = set(dfs['author_work']['work_id'])
-        missing_work_ids = work_ids_in_author_work - work_ids_in_works
+        work_ids_in_works = encode_ids(dfs['works']['id'])
+        work_ids_in_author_work = encode_ids(dfs['author_work']['work_id'])
+        missing_work_ids = np.setdiff1d(work_ids_in_author_work, work_ids_in_works)
         
-        if missing_work_ids:
+        if len(missing_work_ids):
             issue = f"Найдены {len(missing_work_ids)} ID работ в author_work, которых нет в works"
             consistency_issues.append(issue)
             logger.warning(issue)
         
         # Проверка, что все author_id в author_work существуют в authors
-        author_ids_in_authors = set(dfs['authors']['id'])
-        author_ids_in_author_work = set(dfs['author_work']['author_id'])
-        missing_author_ids = author_ids_in_author_work - author_ids_in_authors
+        author_ids_in_authors = encode_ids(dfs['authors']['id'])
+        author_ids_in_author_work = encode_ids(dfs['author_work']['author_id'])
+        missing_author_ids = np.setdiff1d(author_ids_in_author_work, author_ids_in_authors)
         
-        if missing_author_ids:
+        if len(missing_author_ids):
             issue = f"Найдены {len(missing_author_ids)} ID авторов в author_work, которых нет в authors"
             consistency_issues.append(issue)
             logger.warning(issue)
@@ -101,21 +132,21 @@ def check_dataset_consistency():
     # Проверка связей между работами и концепциями
     if 'works' in dfs and 'work_concept' in dfs and 'concepts' in dfs:
         # Проверка, что все work_id в work_concept существуют в works
-        work_ids_in_works = set(dfs['works']['id'])
-        work_ids_in_work_concept = set(dfs['work_concept']['work_id'])
-        missing_work_ids = work_ids_in_work_concept - work_ids_in_works
+        work_ids_in_works = encode_ids(dfs['works']['id'])
+        work_ids_in_work_concept = encode_ids(dfs['work_concept']['work_id'])
+        missing_work_ids = np.setdiff1d(work_ids_in_work_concept, work_ids_in_works)
         
-        if missing_work_ids:
+        if len(missing_work_ids):
             issue = f"Найдены {len(missing_work_ids)} ID работ в work_concept, которых нет в works"
             consistency_issues.append(issue)
             logger.warning(issue)
         
         # Проверка, что все concept_id в work_concept существуют в concepts
-        concept_ids_in_concepts = set(dfs['concepts']['id'])
-        concept_ids_in_work_concept = set(dfs['work_concept']['concept_id'])
-        missing_concept_ids = concept_ids_in_work_concept - concept_ids_in_concepts
+        concept_ids_in_concepts = encode_ids(dfs['concepts']['id'])
+        concept_ids_in_work_concept = encode_ids(dfs['work_concept']['concept_id'])
+        missing_concept_ids = np.setdiff1d(concept_ids_in_work_concept, concept_ids_in_concepts)
         
-        if missing_concept_ids:
+        if len(missing_concept_ids):
             issue = f"Найдены {len(missing_concept_ids)} ID концепций в work_concept, которых нет в concepts"
             consistency_issues.append(issue)
             logger.warning(issue)
@@ -123,21 +154,21 @@ def check_dataset_consistency():
     # Проверка связей между работами и источниками
     if 'works' in dfs and 'work_source' in dfs and 'sources' in dfs:
         # Проверка, что все work_id в work_source существуют в works
-        work_ids_in_works = set(dfs['works']['id'])
-        work_ids_in_work_source = set(dfs['work_source']['work_id'])
-        missing_work_ids = work_ids_in_work_source - work_ids_in_works
+        work_ids_in_works = encode_ids(dfs['works']['id'])
+        work_ids_in_work_source = encode_ids(dfs['work_source']['work_id'])
+        missing_work_ids = np.setdiff1d(work_ids_in_work_source, work_ids_in_works)
         
-        if missing_work_ids:
+        if len(missing_work_ids):
             issue = f"Найдены {len(missing_work_ids)} ID работ в work_source, которых нет в works"
             consistency_issues.append(issue)
             logger.warning(issue)
         
         # Проверка, что все source_id в work_source существуют в sources
-        source_ids_in_sources = set(dfs['sources']['id'])
-        source_ids_in_work_source = set(dfs['work_source']['source_id'])
-        missing_source_ids = source_ids_in_work_source - source_ids_in_sources
+        source_ids_in_sources = encode_ids(dfs['sources']['id'])
+        source_ids_in_work_source = encode_ids(dfs['work_source']['source_id'])
+        missing_source_ids = np.setdiff1d(source_ids_in_work_source, source_ids_in_sources)
         
-        if missing_source_ids:
+        if len(missing_source_ids):
             issue = f"Найдены {len(missing_source_ids)} ID источников в work_source, которых нет в sources"
             consistency_issues.append(issue)
             logger.warning(issue)
@@ -145,21 +176,21 @@ def check_dataset_consistency():
     # Проверка связей между авторами и организациями
     if 'authors' in dfs and 'author_institution' in dfs and 'institutions' in dfs:
         # Проверка, что все author_id в author_institution существуют в authors
-        author_ids_in_authors = set(dfs['authors']['id'])
-        author_ids_in_author_institution = set(dfs['author_institution']['author_id'])
-        missing_author_ids = author_ids_in_author_institution - author_ids_in_authors
+        author_ids_in_authors = encode_ids(dfs['authors']['id'])
+        author_ids_in_author_institution = encode_ids(dfs['author_institution']['author_id'])
+        missing_author_ids = np.setdiff1d(author_ids_in_author_institution, author_ids_in_authors)
         
-        if missing_author_ids:
+        if len(missing_author_ids):
             issue = f"Найдены {len(missing_author_ids)} ID авторов в author_institution, которых нет в authors"
             consistency_issues.append(issue)
             logger.warning(issue)
         
         # Проверка, что все institution_id в author_institution существуют в institutions
-        institution_ids_in_institutions = set(dfs['institutions']['id'])
-        institution_ids_in_author_institution = set(dfs['author_institution']['institution_id'])
-        missing_institution_ids = institution_ids_in_author_institution - institution_ids_in_institutions
+        institution_ids_in_institutions = encode_ids(dfs['institutions']['id'])
+        institution_ids_in_author_institution = encode_ids(dfs['author_institution']['institution_id'])
+        missing_institution_ids = np.setdiff1d(institution_ids_in_author_institution, institution_ids_in_institutions)
         
-        if missing_institution_ids:
+        if len(missing_institution_ids):
             issue = f"Найдены {len(missing_institution_ids)} ID организаций в author_institution, которых нет в institutions"
             consistency_issues.append(issue)
             logger.warning(issue)
@@ -167,32 +198,52 @@ def check_dataset_consistency():
     # Проверка связей между концепциями и их предками
     if 'concepts' in dfs and 'concept_ancestor' in dfs:
         # Проверка, что все concept_id в concept_ancestor существуют в concepts
-        concept_ids_in_concepts = set(dfs['concepts']['id'])
-        concept_ids_in_concept_ancestor = set(dfs['concept_ancestor']['concept_id'])
-        missing_concept_ids = concept_ids_in_concept_ancestor - concept_ids_in_concepts
+        concept_ids_in_concepts = encode_ids(dfs['concepts']['id'])
+        concept_ids_in_concept_ancestor = encode_ids(dfs['concept_ancestor']['concept_id'])
+        missing_concept_ids = np.setdiff1d(concept_ids_in_concept_ancestor, concept_ids_in_concepts)
         
-        if missing_concept_ids:
+        if len(missing_concept_ids):
             issue = f"Найдены {len(missing_concept_ids)} ID концепций в concept_ancestor, которых нет в concepts"
             consistency_issues.append(issue)
             logger.warning(issue)
         
         # Проверка, что все ancestor_id в concept_ancestor существуют в concepts
-        ancestor_ids_in_concept_ancestor = set(dfs['concept_ancestor']['ancestor_id'])
-        missing_ancestor_ids = ancestor_ids_in_concept_ancestor - concept_ids_in_concepts
+        ancestor_ids_in_concept_ancestor = encode_ids(dfs['concept_ancestor']['ancestor_id'])
+        missing_ancestor_ids = np.setdiff1d(ancestor_ids_in_concept_ancestor, concept_ids_in_concepts)
         
-        if missing_ancestor_ids:
+        if len(missing_ancestor_ids):
             issue = f"Найдены {len(missing_ancestor_ids)} ID предков в concept_ancestor, которых нет в concepts"
             consistency_issues.append(issue)
             logger.warning(issue)
     
+    # Проверка замыкания концепций по предкам
+    if 'concepts' in dfs and 'concept_closure' in dfs:
+        concept_ids_in_concepts = encode_ids(dfs['concepts']['id'])
+        concept_ids_in_concept_closure = encode_ids(dfs['concept_closure']['concept_id'])
+        missing_concept_ids = np.setdiff1d(concept_ids_in_concept_closure, concept_ids_in_concepts)
+        
+        if len(missing_concept_ids):
+            issue = f"Найдены {len(missing_concept_ids)} ID концепций в concept_closure, которых нет в concepts"
+            consistency_issues.append(issue)
+            logger.warning(issue)
+        
+        # Проверка, что все ancestor_id в concept_closure существуют в concepts
+        ancestor_ids_in_concept_closure = encode_ids(dfs['concept_closure']['ancestor_id'])
+        missing_ancestor_ids = np.setdiff1d(ancestor_ids_in_concept_closure, concept_ids_in_concepts)
+        
+        if len(missing_ancestor_ids):
+            issue = f"Найдены {len(missing_ancestor_ids)} ID предков в concept_closure, которых нет в concepts"
+            consistency_issues.append(issue)
+            logger.warning(issue)
+    
     # Проверка связей между источниками и издателями
     if 'sources' in dfs and 'source_publisher' in dfs and 'publishers' in dfs:
         # Проверка, что все source_id в source_publisher существуют в sources
-        source_ids_in_sources = set(dfs['sources']['id'])
-        source_ids_in_source_publisher = set(dfs['source_publisher']['source_id'])
-        missing_source_ids = source_ids_in_source_publisher - source_ids_in_sources
+        source_ids_in_sources = encode_ids(dfs['sources']['id'])
+        source_ids_in_source_publisher = encode_ids(dfs['source_publisher']['source_id'])
+        missing_source_ids = np.setdiff1d(source_ids_in_source_publisher, source_ids_in_sources)
         
-        if missing_source_ids:
+        if len(missing_source_ids):
             issue = f"Найдены {len(missing_source_ids)} ID источников в source_publisher, которых нет в sources"
             consistency_issues.append(issue)
             logger.warning(issue)
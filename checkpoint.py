@@ -0,0 +1,242 @@
+import os
+import json
+import time
+import shutil
+import logging
+from array import array
+
+import table_writers
+from table_writers import open_table_writer
+from id_codec import IdSet
+
+logger = logging.getLogger("checkpoint")
+
+# Продолжать прерванную обработку с последней контрольной точки (--resume)
+RESUME = False
+
+# Интервал между контрольными точками в секундах (0 - не сохранять)
+CHECKPOINT_SECONDS = 300
+
+# Каталог контрольных точек внутри выходной директории
+CHECKPOINT_DIR_NAME = ".checkpoint"
+
+def checkpoint_dir(output_dir):
+    return os.path.join(output_dir, CHECKPOINT_DIR_NAME)
+
+# Удаление всех контрольных точек (новый запуск или обработка завершена)
+def clear_checkpoints(output_dir):
+    shutil.rmtree(checkpoint_dir(output_dir), ignore_errors=True)
+
+# Запись файла целиком с переименованием: при сбое остается прежняя версия
+def _write_atomic(path, data):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+# Контрольная точка одного этапа обработки
+class Checkpoint:
+    """Состояние этапа stage ('works' или имя сущности) в <output>/.checkpoint/<stage>.json.
+
+    Хранит входной файл и число строк, прочитанных из него, размер в байтах
+    и число строк каждой выходной таблицы после последней записанной записи,
+    счетчики этапа и файл с накопленными множествами ID (<stage>.<номер>.ids,
+    коды id_codec). settings - параметры, от которых зависит результат: если
+    они изменились, контрольная точка не используется. Поддерживается только
+    CSV: при продолжении таблицы обрезаются до сохраненного размера и
+    дописываются, поэтому результат совпадает с непрерывным запуском побайтно.
+    """
+
+    def __init__(self, output_dir, stage, settings):
+        self.output_dir = output_dir
+        self.dir = checkpoint_dir(output_dir)
+        self.stage = stage
+        self.path = os.path.join(self.dir, f"{stage}.json")
+        self.settings = settings
+        self.enabled = table_writers.OUTPUT_FORMAT == 'csv'
+        self.restored = self._load() if RESUME and self.enabled else None
+        if self.restored is None:
+            self.clear()
+        self.sequence = self.restored.get('sequence', 0) if self.restored else 0
+        self.ids_file = self.restored.get('ids_file') if self.restored else None
+        self.file = None
+        self.line = 0
+        self.saved_at = time.time()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            logger.info(f"Контрольной точки {self.stage} нет, этап выполняется с начала")
+            return None
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                state = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Не удалось прочитать контрольную точку {self.stage}, этап выполняется с начала: {str(e)}")
+            return None
+        if state.get('settings') != self.settings:
+            logger.warning(f"Параметры этапа {self.stage} изменились после контрольной точки, этап выполняется с начала")
+            return None
+        for table, (size, _) in state.get('tables', {}).items():
+            path = os.path.join(self.output_dir, f"{table}.csv")
+            if not os.path.exists(path) or os.path.getsize(path) < size:
+                logger.warning(f"Файл {table}.csv короче, чем в контрольной точке {self.stage}, этап выполняется с начала")
+                return None
+        if state.get('done'):
+            logger.info(f"Этап {self.stage} завершен до прерывания")
+        else:
+            logger.info(f"Продолжение этапа {self.stage} с контрольной точки {state['saved_at']}: "
+                        f"файл {state['file']}, строка {state['line']}")
+        return state
+
+    # Удаление контрольной точки этапа
+    def clear(self):
+        if os.path.isdir(self.dir):
+            for name in os.listdir(self.dir):
+                if name.startswith(f"{self.stage}."):
+                    self._remove(name)
+
+    def _remove(self, name):
+        path = os.path.join(self.dir, name)
+        if os.path.exists(path):
+            os.remove(path)
+
+    # Этап завершен до прерывания
+    def completed(self):
+        return self.restored is not None and self.restored.get('done', False)
+
+    # Этап продолжается с контрольной точки
+    @property
+    def resumed(self):
+        return self.restored is not None and not self.restored.get('done', False)
+
+    # Итог завершенного этапа (как его передали в complete)
+    def report(self):
+        return self.restored.get('report')
+
+    # Счетчики этапа на момент контрольной точки
+    def counters(self):
+        return self.restored['counters']
+
+    # Множества ID на момент контрольной точки: IdSet для кодов, set для строк
+    def id_sets(self):
+        id_sets = {key: set(values) for key, values in self.restored['names'].items()}
+        with open(os.path.join(self.dir, self.restored['ids_file']), 'rb') as f:
+            for key, (offset, count) in self.restored['ids'].items():
+                f.seek(offset)
+                codes = array('q')
+                codes.fromfile(f, count)
+                id_sets[key] = IdSet.from_sorted(codes)
+        return id_sets
+
+    # Писатели таблиц этапа: с позиции контрольной точки или заново
+    def open_writers(self, tables):
+        offsets = self.restored['tables'] if self.resumed else {}
+        return {table: open_table_writer(self.output_dir, table, resume=offsets.get(table)) for table in tables}
+
+    # Номер строки файла, с которой продолжается чтение (None - файл обработан до контрольной точки)
+    def start_line(self, file_name):
+        if not self.resumed or self.restored['file'] is None:
+            return 0
+        position, restored = self._position(file_name), self._position(self.restored['file'])
+        if position > restored:
+            return 0
+        if position < restored or self.restored['line'] is None:
+            return None
+        return self.restored['line']
+
+    # Место файла в порядке чтения: по списку settings['files'], если он есть, иначе по имени
+    def _position(self, file_name):
+        files = self.settings.get('files') or []
+        return (files.index(file_name), '') if file_name in files else (len(files), file_name)
+
+    # Строки файла после позиции контрольной точки с отсчетом прочитанных (None - файл пропускается)
+    def lines(self, file_name, lines):
+        """Позиция - число строк, полученных из lines, поэтому отсчет совпадает
+        при любом способе чтения файла, если строки идут в том же порядке.
+        """
+        start = self.start_line(file_name)
+        if start is None:
+            return None
+        if start:
+            logger.info(f"Файл {file_name}: пропуск {start} строк, прочитанных до контрольной точки")
+        self.file = file_name
+        self.line = start
+        return self._counted(lines, start)
+
+    def _counted(self, lines, start):
+        for position, line in enumerate(lines):
+            if position < start:
+                continue
+            self.line = position + 1
+            yield line
+
+    # Файл прочитан целиком (параллельный разбор works)
+    def file_done(self, file_name):
+        self.file = file_name
+        self.line = None
+
+    # Пора сохранить контрольную точку
+    def due(self):
+        return self.enabled and CHECKPOINT_SECONDS > 0 and time.time() - self.saved_at >= CHECKPOINT_SECONDS
+
+    # Сохранение контрольной точки после последней записанной записи
+    def save(self, writers, id_sets, counters):
+        """writers - писатели таблиц этапа, id_sets - {имя: IdSet или set строк},
+        counters - значения для JSON, которые этап восстанавливает сам.
+        """
+        start_time = time.time()
+        os.makedirs(self.dir, exist_ok=True)
+        tables = {}
+        for table, writer in writers.items():
+            writer.sync()
+            tables[table] = [writer.bytes_written, writer.rows]
+
+        # Множества ID - в новый файл: прежний остается, пока не записано состояние
+        self.sequence += 1
+        ids_file = f"{self.stage}.{self.sequence}.ids"
+        ids = {}
+        names = {}
+        with open(os.path.join(self.dir, ids_file), 'wb') as f:
+            for key, values in id_sets.items():
+                if isinstance(values, set):
+                    names[key] = sorted(values)
+                    continue
+                codes = array('q', values.codes())
+                ids[key] = [f.tell(), len(codes)]
+                codes.tofile(f)
+            f.flush()
+            os.fsync(f.fileno())
+
+        state = {
+            'stage': self.stage,
+            'settings': self.settings,
+            'sequence': self.sequence,
+            'saved_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'file': self.file,
+            'line': self.line,
+            'tables': tables,
+            'ids_file': ids_file,
+            'ids': ids,
+            'names': names,
+            'counters': counters
+        }
+        _write_atomic(self.path, json.dumps(state, ensure_ascii=False).encode('utf-8'))
+        if self.ids_file and self.ids_file != ids_file:
+            self._remove(self.ids_file)
+        self.ids_file = ids_file
+        self.saved_at = time.time()
+        logger.info(f"Контрольная точка {self.stage}: файл {self.file}, строка {self.line}, "
+                    f"сохранена за {self.saved_at - start_time:.2f} секунд")
+
+    # Отметка о завершении этапа: при продолжении он пропускается
+    def complete(self, report=None):
+        if not self.enabled:
+            return
+        os.makedirs(self.dir, exist_ok=True)
+        state = {'stage': self.stage, 'settings': self.settings, 'done': True, 'report': report}
+        _write_atomic(self.path, json.dumps(state, ensure_ascii=False).encode('utf-8'))
+        if self.ids_file:
+            self._remove(self.ids_file)
+            self.ids_file = None
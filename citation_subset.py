@@ -0,0 +1,246 @@
+import os
+import json
+import time
+import logging
+from array import array
+
+from tqdm import tqdm
+
+from input_reader import iter_lines, skip_lines
+from works_view import decode_work
+from id_codec import IdSet, BloomFilter, encode_id, decode_id, peek_id, difference_codes
+from entity_index import open_id_index
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+logger = logging.getLogger("citation_subset")
+
+# Количество шагов расширения выбранных публикаций по цитированиям (0 - режим выключен)
+CITATION_HOPS = 0
+
+# Направление расширения: 'references' (цитируемые), 'cited_by' (цитирующие) или 'both'
+CITATION_DIRECTION = 'references'
+
+# Количество исходных публикаций (None - 10% от MAX_WORKS)
+SEED_WORKS = None
+
+# Отчет о подмножестве в выходной директории
+SUBSET_REPORT_FILE = "citation_subset.json"
+
+# Подмножество публикаций, замкнутое по цитированиям
+class CitationSubset:
+    """Выбранные публикации (IdSet), публикации последнего шага и ID, на которые они ссылаются.
+
+    dump_ids - ID всех публикаций локальных частей (индекс ID data/index/works/ids.bin):
+    ссылки на публикации, которых нет в дампе, сразу считаются висячими и не ищутся.
+    take(work) записывает публикацию в таблицы, кроме work_citation, и возвращает
+    строки ее записи (process_works.extract_work) или None, если ее нельзя взять.
+    Ссылки запоминаются кодами и записываются после сборки (write_citations).
+    """
+
+    def __init__(self, dump_ids, budget, take, direction):
+        self.dump_ids = dump_ids
+        self.budget = budget
+        self.take = take
+        self.references = direction in ('references', 'both')
+        self.cited_by = direction in ('cited_by', 'both')
+        self.selected = IdSet()
+        self.frontier = IdSet()
+        self.wanted = IdSet()
+        self.citing = array('q')
+        self.cited = array('q')
+        self.years = {}
+        self.hops = []
+
+    # Достигнут бюджет публикаций
+    def full(self):
+        return len(self.selected) >= self.budget
+
+    # Добавление публикации: запись в таблицы и ссылки для следующего шага
+    def add(self, code, work):
+        record = self.take(work)
+        if record is None:
+            return False
+        self.selected.add(code)
+        self.frontier.add(code)
+        self.years[code] = record['work']['publication_year']
+        for row in record['work_citation']:
+            cited = encode_id(row['cited_id'])
+            if cited is None:
+                continue
+            self.citing.append(code)
+            self.cited.append(cited)
+            if self.references and cited in self.dump_ids:
+                self.wanted.add(cited)
+        return True
+
+    # Исходные публикации: первые seeds записей в порядке файлов
+    def add_seeds(self, sources, seeds):
+        for file_name, lines in sources:
+            for line in tqdm(lines, desc=f"Исходные публикации {file_name}"):
+                if len(self.selected) >= seeds:
+                    return
+                try:
+                    work = decode_work(line)
+                    code = encode_id(work.get('id'))
+                    if code is not None and code not in self.selected:
+                        self.add(code, work)
+                except Exception as e:
+                    logger.error(f"Ошибка при обработке записи: {str(e)}")
+
+    # Один шаг расширения: один потоковый проход по частям
+    def expand(self, sources, hop):
+        """Берет публикации, на которые ссылаются публикации прошлого шага
+        (references), и публикации, которые ссылаются на них (cited_by).
+        Строки, чей ID из начала строки не нужен, при расширении только по
+        references не разбираются. Возвращает число добавленных публикаций.
+        """
+        start_time = time.time()
+        frontier, wanted = self.frontier, self.wanted
+        self.frontier, self.wanted = IdSet(), IdSet()
+        bloom = BloomFilter(frontier.codes()) if self.cited_by else None
+        pending = len(difference_codes(wanted, self.selected)) if len(wanted) else 0
+        added = 0
+        logger.info(f"Шаг {hop}: публикаций прошлого шага {len(frontier)}, ссылок на публикации из дампа вне подмножества {pending}")
+
+        for file_name, lines in sources:
+            if self.full() or (not self.cited_by and pending == 0):
+                break
+            for line in tqdm(lines, desc=f"Шаг {hop}: {file_name}"):
+                if self.full() or (not self.cited_by and pending == 0):
+                    break
+                try:
+                    code = peek_id(line)
+                    if code is not None:
+                        if code in self.selected:
+                            continue
+                        if not self.cited_by and code not in wanted:
+                            continue
+                    work = decode_work(line)
+                    if code is None:
+                        code = encode_id(work.get('id'))
+                        if code is None or code in self.selected:
+                            continue
+                    if code in wanted:
+                        if self.add(code, work):
+                            added += 1
+                            pending -= 1
+                    elif self.cited_by and self._cites(work, bloom, frontier):
+                        if self.add(code, work):
+                            added += 1
+                except Exception as e:
+                    logger.error(f"Ошибка при обработке записи: {str(e)}")
+
+        elapsed = time.time() - start_time
+        self.hops.append({'hop': hop, 'frontier': len(frontier), 'wanted': len(wanted), 'added': added,
+                          'selected': len(self.selected), 'seconds': round(elapsed, 2)})
+        logger.info(f"Шаг {hop}: добавлено {added} публикаций, всего {len(self.selected)}, {elapsed:.2f} секунд")
+        return added
+
+    # Ссылается ли публикация на публикацию прошлого шага (фильтр Блума, затем точная проверка)
+    @staticmethod
+    def _cites(work, bloom, frontier):
+        for cited_id in work.get('referenced_works') or []:
+            cited = encode_id(cited_id)
+            if cited is not None and cited in bloom and cited in frontier:
+                return True
+        return False
+
+    # Ссылки, цитируемая публикация которых выбрана
+    def in_subset(self):
+        if np is not None:
+            cited = np.frombuffer(self.cited, dtype=np.int64) if self.cited else np.empty(0, dtype=np.int64)
+            return np.isin(cited, np.frombuffer(self.selected.codes(), dtype=np.int64))
+        return [cited in self.selected for cited in self.cited]
+
+    # Запись в work_citation только ссылок внутри подмножества; возвращает число записанных
+    def write_citations(self, writer):
+        written = 0
+        for citing, cited, inside in zip(self.citing, self.cited, self.in_subset()):
+            if inside:
+                writer.write({'citing_id': decode_id(citing, uri=True), 'cited_id': decode_id(cited, uri=True)},
+                             partition=self.years[citing])
+                written += 1
+        return written
+
+    # Число ссылок внутри подмножества и висячих ссылок
+    def edge_report(self):
+        """in_subset - цитируемая публикация выбрана (только эти ссылки записываются);
+        outside_subset - есть в дампе, но не выбрана (бюджет или число шагов);
+        absent_from_dump - нет в локальных частях. Висячие ссылки отбрасываются.
+        """
+        if np is not None:
+            cited = np.frombuffer(self.cited, dtype=np.int64) if self.cited else np.empty(0, dtype=np.int64)
+            in_subset = self.in_subset()
+            in_dump = np.isin(cited, np.asarray(self.dump_ids.codes(), dtype=np.int64))
+            counts = (int(in_subset.sum()), int((in_dump & ~in_subset).sum()), int((~in_dump).sum()))
+        else:
+            counts = [0, 0, 0]
+            for cited in self.cited:
+                counts[0 if cited in self.selected else 1 if cited in self.dump_ids else 2] += 1
+        edges = len(self.cited)
+        return {
+            'edges': edges,
+            'in_subset': counts[0],
+            'outside_subset': counts[1],
+            'absent_from_dump': counts[2],
+            'in_subset_share': round(counts[0] / edges, 4) if edges else 0.0
+        }
+
+# Строки частей works для одного прохода (без устаревших версий из skip)
+def _iter_sources(works_dir, files, skip):
+    for file_name in files:
+        yield file_name, skip_lines(iter_lines(os.path.join(works_dir, file_name)), skip.get(file_name, ()))
+
+# Сборка подмножества публикаций, замкнутого по цитированиям
+def build_citation_subset(data_dir, output_dir, files, max_works, take, citation_writer, skip=None):
+    """Берет исходные публикации и расширяет их на CITATION_HOPS шагов по
+    цитированиям в направлении CITATION_DIRECTION, пока всего публикаций
+    не больше max_works. Каждый шаг - один потоковый проход по частям works.
+    В citation_writer записываются только ссылки внутри подмножества. Отчет о ссылках сохраняется в SUBSET_REPORT_FILE. skip - номера строк
+    устаревших версий каждой части (см. process_works.DEDUP_WORKS).
+    Возвращает число публикаций.
+    """
+    skip = skip or {}
+    start_time = time.time()
+    works_dir = os.path.join(data_dir, "works")
+    dump_ids = open_id_index(data_dir, "works", files)
+    seeds = min(max_works, SEED_WORKS or max(1, max_works // 10))
+    logger.info(f"Подмножество по цитированиям: {seeds} исходных публикаций, до {CITATION_HOPS} шагов ({CITATION_DIRECTION}), бюджет {max_works}")
+    logger.info(f"Публикаций в локальных частях: {len(dump_ids)}")
+
+    subset = CitationSubset(dump_ids, max_works, take, CITATION_DIRECTION)
+    subset.add_seeds(_iter_sources(works_dir, files, skip), seeds)
+    logger.info(f"Исходных публикаций: {len(subset.selected)}")
+
+    for hop in range(1, CITATION_HOPS + 1):
+        if subset.full():
+            logger.info(f"Достигнут бюджет публикаций: {max_works}")
+            break
+        if not subset.expand(_iter_sources(works_dir, files, skip), hop):
+            logger.info(f"Шаг {hop} не добавил публикаций, расширение завершено")
+            break
+
+    dropped = len(subset.cited) - subset.write_citations(citation_writer)
+    logger.info(f"Висячих ссылок отброшено: {dropped}")
+
+    report = {
+        'direction': CITATION_DIRECTION,
+        'hops': CITATION_HOPS,
+        'budget': max_works,
+        'seeds': seeds,
+        'selected': len(subset.selected),
+        'steps': subset.hops,
+        'citations': dict(subset.edge_report(), dropped=dropped),
+        'processing_time_seconds': round(time.time() - start_time, 2)
+    }
+    citations = report['citations']
+    logger.info(f"Ссылок: {citations['edges']}, внутри подмножества: {citations['in_subset']}, "
+                f"висячих (есть в дампе): {citations['outside_subset']}, висячих (нет в дампе): {citations['absent_from_dump']}")
+    with open(os.path.join(output_dir, SUBSET_REPORT_FILE), 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    logger.info(f"Отчет о подмножестве сохранен в {SUBSET_REPORT_FILE}")
+    return len(subset.selected)
@@ -1,8 +1,15 @@
 import os
+import json
+import hashlib
 import requests
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlparse
+from requests.adapters import HTTPAdapter
 from tqdm import tqdm
 import time
+from openalex_manifest import fetch_entity_manifest, parse_manifest_entries, save_download_plan
 
 # Настройка логирования
 logging.basicConfig(
@@ -32,7 +39,10 @@ VALID_DATES = [
     "updated_date=2025-05-24"
 ]
 
-# Подмножества данных для загрузки (сущность: максимальное количество файлов для проверки)
+# Строить план загрузки по манифестам OpenAlex (иначе перебор частей HEAD-запросами)
+USE_MANIFEST = True
+
+# Подмножества данных для загрузки (сущность: максимальное количество частей на дату)
 ENTITIES = {
     "works": 1,      # Только part_000.gz
     "authors": 5,    # Проверяем до part_004.gz
@@ -42,6 +52,21 @@ ENTITIES = {
     "publishers": 1  # Только part_000.gz
 }
 
+# Параметры параллельной загрузки
+DOWNLOAD_WORKERS = 8            # Размер пула потоков загрузки
+MAX_CONNECTIONS_PER_HOST = 8    # Максимум одновременных соединений к одному хосту
+CHUNK_SIZE = 1024 * 1024        # Размер блока при потоковой записи файла
+
+# Локальный манифест загруженных файлов (URL, ETag, размер, MD5)
+DOWNLOAD_MANIFEST_PATH = "data/download_manifest.json"
+
+# Пересчитывать MD5 уже загруженных файлов при проверке актуальности
+VERIFY_CHECKSUMS = False
+
+# Семафоры для ограничения числа соединений к каждому хосту
+_host_semaphores = {}
+_host_semaphores_lock = threading.Lock()
+
 # Создаем директории для хранения данных
 def create_directories():
     os.makedirs("data", exist_ok=True)
@@ -50,43 +75,217 @@ def create_directories():
         os.makedirs(f"data/{entity}", exist_ok=True)
     logger.info("Директории для данных созданы")
 
-# Проверка существования файла на сервере
-def check_file_exists(url):
+# Создание HTTP-сессии с пулом keep-alive соединений
+def create_session(pool_size=DOWNLOAD_WORKERS):
+    """Создает requests.Session, переиспользующую соединения между запросами."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+# Семафор, ограничивающий число одновременных соединений к хосту из url
+def get_host_semaphore(url):
+    host = urlparse(url).netloc
+    with _host_semaphores_lock:
+        if host not in _host_semaphores:
+            _host_semaphores[host] = threading.BoundedSemaphore(MAX_CONNECTIONS_PER_HOST)
+        return _host_semaphores[host]
+
+# Получение метаданных файла на сервере (ETag и размер) или None, если файла нет
+def get_remote_info(url, session=None):
+    http = session or requests
     try:
-        response = requests.head(url, timeout=5)
-        return response.status_code == 200
+        with get_host_semaphore(url):
+            response = http.head(url, timeout=5)
+        if response.status_code != 200:
+            return None
+        return {
+            'etag': response.headers.get('ETag'),
+            'content_length': int(response.headers.get('Content-Length', 0))
+        }
     except Exception:
+        return None
+
+# Проверка существования файла на сервере
+def check_file_exists(url, session=None):
+    return get_remote_info(url, session=session) is not None
+
+# Локальный манифест загрузок: url, ETag, размер и контрольная сумма каждого файла
+class DownloadManifest:
+    def __init__(self, path=DOWNLOAD_MANIFEST_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self.entries = {}
+        if os.path.exists(path):
+            try:
+                with open(path, "r") as f:
+                    self.entries = json.load(f)
+            except Exception as e:
+                logger.warning(f"Не удалось прочитать манифест загрузок {path}: {str(e)}")
+
+    def get(self, output_path):
+        with self._lock:
+            return self.entries.get(output_path)
+
+    def update(self, output_path, entry):
+        with self._lock:
+            self.entries[output_path] = entry
+            # Атомарная запись, чтобы прерванный процесс не испортил манифест
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(self.entries, f, indent=2, sort_keys=True)
+            os.replace(tmp_path, self.path)
+
+# Подсчет MD5 локального файла (используется для сверки с ETag S3)
+def file_md5(path, hasher=None):
+    hasher = hasher or hashlib.md5()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(CHUNK_SIZE), b''):
+            hasher.update(block)
+    return hasher
+
+# ETag S3 совпадает с MD5 содержимого только для файлов, загруженных одной частью
+def etag_md5(etag):
+    value = (etag or '').strip('"')
+    if len(value) == 32 and all(c in '0123456789abcdef' for c in value.lower()):
+        return value.lower()
+    return None
+
+# Проверка, что локальный файл соответствует записи манифеста и удаленной версии
+def is_up_to_date(url, output_path, remote, entry):
+    if not entry or not entry.get('complete') or not os.path.exists(output_path):
+        return False
+    if entry.get('url') != url or entry.get('etag') != remote['etag']:
+        return False
+    if entry.get('content_length') != remote['content_length']:
+        return False
+    if os.path.getsize(output_path) != remote['content_length']:
         return False
+    if VERIFY_CHECKSUMS and entry.get('md5') != file_md5(output_path).hexdigest():
+        return False
+    return True
+
+# Общий индикатор прогресса для нескольких параллельных загрузок
+class AggregateProgress:
+    def __init__(self, desc="Загрузка"):
+        self._lock = threading.Lock()
+        self._pbar = tqdm(total=0, unit='B', unit_scale=True, desc=desc)
+
+    def add_total(self, size):
+        with self._lock:
+            self._pbar.total += size
+            self._pbar.refresh()
+
+    def update(self, size):
+        with self._lock:
+            self._pbar.update(size)
 
-# Загрузка файла с повторными попытками
-def download_file(url, output_path, max_retries=3):
+    def close(self):
+        self._pbar.close()
+
+# Загрузка файла с повторными попытками и докачкой через HTTP Range
+def download_file(url, output_path, max_retries=3, session=None, progress=None, remote=None, manifest=None):
+    http = session or requests
+    part_path = output_path + ".part"
+    expected_etag = remote['etag'] if remote else None
+    expected_size = remote['content_length'] if remote else 0
+    
+    # Незавершенную загрузку продолжаем, только если удаленный файл не изменился
+    entry = manifest.get(output_path) if manifest else None
+    if os.path.exists(part_path) and not (entry and not entry.get('complete')
+                                          and entry.get('url') == url and entry.get('etag') == expected_etag):
+        os.remove(part_path)
+    if manifest:
+        manifest.update(output_path, {
+            'url': url,
+            'etag': expected_etag,
+            'content_length': expected_size,
+            'complete': False
+        })
+    
     for attempt in range(max_retries):
         try:
-            response = requests.get(url, stream=True)
-            response.raise_for_status()
+            offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+            # Файл уже докачан целиком (сбой до переименования): запрос с Range вернул бы 416
+            if expected_size and offset >= expected_size:
+                logger.info(f"Файл {output_path} уже загружен полностью, проверка")
+            else:
+                headers = {}
+                if offset:
+                    headers['Range'] = f"bytes={offset}-"
+                    if expected_etag:
+                        headers['If-Range'] = expected_etag
             
-            # Получаем размер файла
-            total_size = int(response.headers.get('content-length', 0))
+                with get_host_semaphore(url):
+                    response = http.get(url, stream=True, timeout=60, headers=headers)
+                    response.raise_for_status()
+                
+                    # Сервер мог проигнорировать Range: тогда начинаем файл заново
+                    if offset and response.status_code != 206:
+                        logger.info(f"Сервер не поддержал докачку {url}, загрузка с начала")
+                        offset = 0
+                    elif offset:
+                        logger.info(f"Докачка {url} с байта {offset}")
+                
+                    # Получаем размер оставшейся части файла
+                    total_size = int(response.headers.get('content-length', 0))
+                
+                    # Загружаем файл: в общий индикатор прогресса или в собственный
+                    if progress is not None:
+                        progress.add_total(total_size)
+                        pbar = None
+                    else:
+                        pbar = tqdm(
+                            total=total_size, 
+                            unit='B', 
+                            unit_scale=True, 
+                            desc=os.path.basename(output_path)
+                        )
+                    bar = progress if progress is not None else pbar
+                    written = 0
+                    try:
+                        with open(part_path, 'ab' if offset else 'wb') as f:
+                            for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                                if chunk:
+                                    f.write(chunk)
+                                    written += len(chunk)
+                                    bar.update(len(chunk))
+                    finally:
+                        if pbar is not None:
+                            pbar.close()
+                        elif written < total_size:
+                            # Убираем из общего объема недогруженную часть
+                            progress.add_total(written - total_size)
             
-            # Загружаем файл с индикатором прогресса
-            with open(output_path, 'wb') as f:
-                with tqdm(
-                    total=total_size, 
-                    unit='B', 
-                    unit_scale=True, 
-                    desc=os.path.basename(output_path)
-                ) as pbar:
-                    for chunk in response.iter_content(chunk_size=8192):
-                        if chunk:
-                            f.write(chunk)
-                            pbar.update(len(chunk))
+            # Проверяем размер и контрольную сумму загруженного файла
+            size = os.path.getsize(part_path)
+            if size == 0 or (expected_size and size != expected_size):
+                logger.warning(f"Размер файла {output_path} ({size}) не совпадает с ожидаемым ({expected_size}), попытка {attempt+1}/{max_retries}")
+                if size > expected_size:
+                    os.remove(part_path)
+                time.sleep(2)
+                continue
             
-            # Проверяем размер загруженного файла
-            if os.path.getsize(output_path) > 0:
-                return True
-            else:
-                logger.warning(f"Загруженный файл пуст: {output_path}, попытка {attempt+1}/{max_retries}")
+            md5 = file_md5(part_path).hexdigest()
+            expected_md5 = etag_md5(expected_etag)
+            if expected_md5 and md5 != expected_md5:
+                logger.warning(f"Контрольная сумма {output_path} не совпадает с ETag, попытка {attempt+1}/{max_retries}")
+                os.remove(part_path)
                 time.sleep(2)
+                continue
+            
+            os.replace(part_path, output_path)
+            if manifest:
+                manifest.update(output_path, {
+                    'url': url,
+                    'etag': expected_etag,
+                    'content_length': size,
+                    'md5': md5,
+                    'complete': True,
+                    'downloaded_at': time.strftime('%Y-%m-%d %H:%M:%S')
+                })
+            return True
         except Exception as e:
             logger.error(f"Ошибка при загрузке {url}: {str(e)}, попытка {attempt+1}/{max_retries}")
             time.sleep(2)
@@ -94,55 +293,167 @@ def download_file(url, output_path, max_retries=3):
     logger.error(f"Не удалось загрузить {url} после {max_retries} попыток")
     return False
 
+# Локальный путь для части сущности
+def get_output_path(entity, date, part_num):
+    # Для works сохраняем префикс updated_date_ в имени файла
+    if entity == "works":
+        output_filename = f"updated_date_{date.split('=')[1]}_part_{part_num:03d}.jsonl.gz"
+    else:
+        output_filename = f"{date.split('=')[1]}_part_{part_num:03d}.jsonl.gz"
+    return f"data/{entity}/{output_filename}"
+
+# Формирование списка задач перебором дат и номеров частей (без манифеста)
+def build_probe_tasks(entity, max_parts):
+    tasks = []
+    # Для каждой сущности проверяем все даты
+    for date in VALID_DATES:
+        # Для каждой даты проверяем наличие файлов part_000.gz, part_001.gz и т.д.
+        for part_num in range(max_parts):
+            filename = f"{entity}/{date}/part_{part_num:03d}.gz"
+            tasks.append({
+                'entity': entity,
+                'filename': filename,
+                'url': BASE_URL + filename,
+                'output_path': get_output_path(entity, date, part_num)
+            })
+    return tasks
+
+# Формирование точного плана загрузки по манифестам OpenAlex
+def build_download_plan(session=None, entities=None):
+    """Строит план загрузки: для каждой сущности список частей с url, путем и размером.
+
+    entities переопределяет ENTITIES (значение None снимает лимит частей на дату).
+    Для сущностей, манифест которых недоступен, план не строится и загрузчик
+    возвращается к перебору частей через HEAD-запросы.
+    """
+    plan = {'created_at': time.strftime('%Y-%m-%d %H:%M:%S'), 'entities': {}}
+    for entity, max_parts in (entities or ENTITIES).items():
+        manifest = fetch_entity_manifest(entity, BASE_URL, session=session)
+        if manifest is None:
+            continue
+        
+        parts = parse_manifest_entries(manifest, BASE_URL)
+        available_dates = sorted({p['date'] for p in parts})
+        selected = [p for p in parts if p['date'] in VALID_DATES]
+        if not selected and available_dates:
+            logger.warning(f"Для '{entity}' нет частей с датами из VALID_DATES. Доступны даты: {available_dates[0]} .. {available_dates[-1]}")
+        
+        # Явно сообщаем о частях, не попавших в план из-за лимита ENTITIES
+        if max_parts is None:
+            max_parts = max([p['part'] for p in selected], default=-1) + 1
+        over_limit = [p for p in selected if p['part'] >= max_parts]
+        if over_limit:
+            logger.info(f"Для '{entity}' пропущено {len(over_limit)} частей сверх лимита {max_parts} на дату")
+        
+        plan['entities'][entity] = [{
+            'entity': entity,
+            'filename': f"{entity}/{p['date']}/part_{p['part']:03d}.gz",
+            'url': p['url'],
+            'output_path': get_output_path(entity, p['date'], p['part']),
+            'updated_date': p['date'].split('=')[1],
+            'part': p['part'],
+            'content_length': p['content_length'],
+            'record_count': p['record_count']
+        } for p in selected if p['part'] < max_parts]
+        
+        total_bytes = sum(item['content_length'] or 0 for item in plan['entities'][entity])
+        logger.info(f"План для '{entity}': {len(plan['entities'][entity])} частей, {total_bytes / (1024 * 1024):.1f} МБ")
+    return plan
+
+# Формирование списка задач загрузки: из плана или перебором частей
+def build_download_tasks(plan=None, exclude=()):
+    tasks = []
+    entities_in_plan = plan['entities'] if plan else {}
+    for entity, max_parts in ENTITIES.items():
+        if entity in exclude:
+            continue
+        if entity in entities_in_plan:
+            tasks.extend(entities_in_plan[entity])
+        else:
+            tasks.extend(build_probe_tasks(entity, max_parts))
+    return tasks
+
+# Проверка и загрузка одного файла (выполняется в потоке пула)
+def fetch_task(task, session, progress, manifest):
+    url = task['url']
+    output_path = task['output_path']
+    
+    # Проверяем существование файла
+    remote = get_remote_info(url, session=session)
+    if remote is None:
+        logger.info(f"Файл не существует: {url}")
+        return None
+    
+    logger.info(f"Найден файл {url}")
+    
+    # Пропускаем файлы, которые не изменились с прошлой загрузки
+    if is_up_to_date(url, output_path, remote, manifest.get(output_path)):
+        logger.info(f"Файл не изменился, загрузка пропущена: {output_path}")
+        return 'skipped'
+    
+    logger.info(f"Загрузка {url} -> {output_path}")
+    
+    success = download_file(url, output_path, session=session, progress=progress,
+                            remote=remote, manifest=manifest)
+    if success:
+        logger.info(f"Успешно загружен файл {task['filename']}")
+    return success
+
 # Основная функция загрузки данных
-def download_data():
+def download_data(workers=None, use_manifest=None, plan=None, exclude=()):
+    workers = workers or DOWNLOAD_WORKERS
+    use_manifest = USE_MANIFEST if use_manifest is None else use_manifest
     create_directories()
     
     downloaded_files = 0
     failed_files = 0
+    skipped_files = 0
+    entity_downloaded = {entity: 0 for entity in ENTITIES}
     
     logger.info(f"Начало загрузки данных из OpenAlex S3")
     
-    # Загружаем данные для каждой сущности
-    for entity, max_parts in ENTITIES.items():
-        logger.info(f"Обработка сущности '{entity}'")
-        entity_downloaded = 0
-        
-        # Для каждой сущности проверяем все даты
-        for date in VALID_DATES:
-            # Для каждой даты проверяем наличие файлов part_000.gz, part_001.gz и т.д.
-            for part_num in range(max_parts):
-                # Для works используем часть пути из date
-                if entity == "works":
-                    filename = f"{entity}/{date}/part_{part_num:03d}.gz"
-                    output_filename = f"updated_date_{date.split('=')[1]}_part_{part_num:03d}.jsonl.gz"
-                else:
-                    # Для других сущностей используем полный путь с датой
-                    filename = f"{entity}/{date}/part_{part_num:03d}.gz"
-                    output_filename = f"{date.split('=')[1]}_part_{part_num:03d}.jsonl.gz"
-                
-                url = BASE_URL + filename
-                output_path = f"data/{entity}/{output_filename}"
+    manifest = DownloadManifest()
+    session = create_session(pool_size=max(workers, MAX_CONNECTIONS_PER_HOST))
+    
+    # Строим план по манифестам OpenAlex вместо перебора частей HEAD-запросами
+    # (готовый план, например от планировщика объема, используется как есть)
+    if plan is None and use_manifest:
+        plan = build_download_plan(session=session)
+        save_download_plan(plan)
+    
+    # Исключенные сущности (например, works в потоковом режиме) не загружаются
+    tasks = build_download_tasks(plan, exclude=exclude)
+    logger.info(f"Задач загрузки: {len(tasks)}, потоков: {workers}, соединений на хост: {MAX_CONNECTIONS_PER_HOST}")
+    progress = AggregateProgress(desc="Загрузка OpenAlex S3")
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(fetch_task, task, session, progress, manifest): task for task in tasks}
+            for future in as_completed(futures):
+                task = futures[future]
+                try:
+                    success = future.result()
+                except Exception as e:
+                    logger.error(f"Ошибка при загрузке {task['url']}: {str(e)}")
+                    success = False
                 
-                # Проверяем существование файла
-                if check_file_exists(url):
-                    logger.info(f"Найден файл {url}")
-                    logger.info(f"Загрузка {url} -> {output_path}")
-                    
-                    success = download_file(url, output_path)
-                    if success:
-                        downloaded_files += 1
-                        entity_downloaded += 1
-                        logger.info(f"Успешно загружен файл {entity}/{date}/part_{part_num:03d}.gz")
-                    else:
-                        failed_files += 1
+                if success is None:
+                    continue
+                if success == 'skipped':
+                    skipped_files += 1
+                elif success:
+                    downloaded_files += 1
+                    entity_downloaded[task['entity']] += 1
                 else:
-                    logger.info(f"Файл не существует: {url}")
-        
-        logger.info(f"Загружено {entity_downloaded} файлов для сущности '{entity}'")
+                    failed_files += 1
+    finally:
+        progress.close()
+        session.close()
+    
+    for entity, count in entity_downloaded.items():
+        logger.info(f"Загружено {count} файлов для сущности '{entity}'")
     
-    logger.info(f"Загрузка завершена. Успешно: {downloaded_files}, Ошибок: {failed_files}")
+    logger.info(f"Загрузка завершена. Успешно: {downloaded_files}, Без изменений: {skipped_files}, Ошибок: {failed_files}")
     return downloaded_files, failed_files
 
 if __name__ == "__main__":
-    download_data() 
\ No newline at end of file
+    download_data()
@@ -0,0 +1,624 @@
+import os
+import time
+import shutil
+import logging
+from array import array
+from itertools import islice
+
+from tqdm import tqdm
+
+from openalex_manifest import get_plan_entries
+from json_decoder import loads
+from input_reader import iter_lines
+from table_writers import open_table_writer, CsvTableWriter, TABLE_COLUMNS
+from id_codec import IdSet, encode_id, decode_id, peek_id, difference_codes
+from entity_index import open_entity_index
+
+logger = logging.getLogger("entity_engine")
+
+# Пропускать записи без полного разбора JSON, если ID в начале строки не входит в нужное множество
+PREFILTER_IDS = True
+
+# Прекращать чтение файлов сущности, как только найдены все запрошенные ID.
+# Части тогда читаются от новых к старым (scan_order), чтобы первой встречалась
+# самая свежая версия записи; старые копии в пропущенных частях не пишутся
+STOP_WHEN_ALL_FOUND = True
+
+# Связь записи сущности с другими сущностями (дочерняя таблица из двух колонок)
+class RelationSpec:
+    """Строки таблицы table: (ключ записи, значение из поля field).
+
+    field - список объектов (берется item_key каждого) или одно значение.
+    ids=True - значения являются ID OpenAlex и записываются в короткой форме.
+    target - ключ множества в entity_ids, которым фильтруются значения.
+    parents=True - значения являются ID предков той же сущности (предки
+    концепций), по ним строится граф для замыкания (см. EntityGraph).
+    """
+
+    def __init__(self, table, field, item_key=None, ids=True, target=None, parents=False):
+        self.table = table
+        self.field = field
+        self.item_key = item_key
+        self.ids = ids
+        self.target = target
+        self.parents = parents
+        self.columns = TABLE_COLUMNS[table]
+
+    # Значения связи для записи
+    def extract(self, record, entity_ids):
+        values = record.get(self.field)
+        if not values:
+            return
+        if not isinstance(values, list):
+            values = [values]
+        target = entity_ids.get(self.target, ()) if self.target else None
+        for item in values:
+            if self.item_key:
+                if not isinstance(item, dict):
+                    continue
+                item = item.get(self.item_key)
+            if self.ids:
+                code = encode_id(item)
+                if code is None or (target is not None and code not in target):
+                    continue
+                yield decode_id(code)
+            elif item and (target is None or item in target):
+                yield item
+
+# Описание типа сущности для движка
+class EntitySpec:
+    """name - каталог данных (data/<name>) и имя в отчетах, table - основная таблица.
+
+    columns - (колонка, поле записи или функция от записи, значение по умолчанию);
+    колонка с полем key_field получает ключ записи. ids_key - множество
+    запрошенных ключей в entity_ids: коды ID (key_field='id') или строки
+    (например, имена издателей, key_field='display_name').
+    closure_table - таблица транзитивного замыкания по связи с parents=True:
+    такая сущность загружается в граф целиком (run_closure_scan), и в
+    таблицы попадают запрошенные записи вместе со всеми предками.
+    """
+
+    def __init__(self, name, table, ids_key, columns, key_field='id', relations=(), label=None,
+                 closure_table=None):
+        self.name = name
+        self.table = table
+        self.ids_key = ids_key
+        self.columns = columns
+        self.key_field = key_field
+        self.relations = tuple(relations)
+        self.label = label or name
+        self.by_name = key_field != 'id'
+        self.closure_table = closure_table
+        self.tables = (table,) + tuple(relation.table for relation in self.relations)
+        if closure_table:
+            self.tables += (closure_table,)
+        self.splittable = closure_table is None
+
+    # Ключ записи для проверки принадлежности и значение для колонки key_field
+    def key(self, record):
+        if self.by_name:
+            name = record.get(self.key_field)
+            return name, name
+        code = encode_id(record.get(self.key_field))
+        return code, decode_id(code) if code is not None else None
+
+    # Строка основной таблицы
+    def row(self, record, key_value):
+        row = {}
+        for column, field, default in self.columns:
+            if field == self.key_field:
+                row[column] = key_value
+            elif callable(field):
+                row[column] = field(record)
+            else:
+                row[column] = record.get(field, default)
+        return row
+
+# Учет запрошенных ID, которые еще не встретились при чтении файлов
+class RemainingIds:
+    """Запрошенные ID (IdSet или множество имен издателей) и уже найденные из них.
+
+    Найденные коды хранятся в IdSet, поэтому память на учет - 8 байт на ID.
+    Множество запрошенных ID может расти во время чтения (предки концепций).
+    """
+
+    def __init__(self, ids):
+        self.ids = ids
+        self.found = set() if isinstance(ids, set) else IdSet()
+        self.stopped_by_limit = False
+        # False - чтение не останавливается, даже если все ID найдены (чтение по индексу)
+        self.stop = True
+
+    def mark(self, value):
+        self.found.add(value)
+
+    def __len__(self):
+        return len(self.ids) - len(self.found)
+
+    # Все запрошенные ID найдены
+    def done(self):
+        return self.stop and STOP_WHEN_ALL_FOUND and len(self) <= 0
+
+    # Ненайденные ID в строковом виде
+    def missing(self):
+        if isinstance(self.ids, set):
+            return sorted(self.ids - self.found)
+        return [decode_id(code) for code in difference_codes(self.ids, self.found).tolist()]
+
+    # Итог сканирования для missing_entities.json
+    def report(self):
+        missing = self.missing()
+        return {
+            'requested': len(self.ids),
+            'found': len(self.found),
+            'missing_count': len(missing),
+            'stopped_by_limit': self.stopped_by_limit,
+            'missing': missing
+        }
+
+# Строки, которые нужно разобрать полностью
+def prefilter_lines(lines, ids, stats):
+    """Отбрасывает строки, у которых ID из начала строки (id_codec.peek_id) не входит в ids.
+
+    Строки, где ID прочитать не удалось (другой порядок полей и т.п.),
+    передаются дальше и проверяются после полного разбора. Число
+    отброшенных строк накапливается в stats['skipped'].
+    """
+    for line in lines:
+        if PREFILTER_IDS:
+            code = peek_id(line)
+            if code is not None and code not in ids:
+                stats['skipped'] += 1
+                continue
+        yield line
+
+# Строки файла до момента, когда найдены все запрошенные ID
+def until_all_found(lines, remaining):
+    for line in lines:
+        if remaining.done():
+            return
+        yield line
+
+# Первые n ID множества в строковом виде (для отладочного вывода)
+def sample_ids(ids, n):
+    values = ids.strings() if hasattr(ids, 'strings') else ids
+    return list(islice(values, n))
+
+# Части дампа сущности в порядке чтения (шаблон YYYY-MM-DD_part_*.jsonl.gz)
+def list_entity_files(entity_dir):
+    return sorted([f for f in os.listdir(entity_dir) if f.endswith(".jsonl.gz") and "_part_" in f])
+
+# Порядок чтения частей сущности
+def scan_order(files, use_index=False):
+    """С остановкой после нахождения всех ID части читаются от новых к старым,
+    иначе осталась бы самая старая копия записи. Индекс отдает блоки в порядке
+    дампа, поэтому с ним порядок прямой, а чтение не останавливается.
+    """
+    return files[::-1] if STOP_WHEN_ALL_FOUND and not use_index else files
+
+# Источники строк сущности: (имя файла, строки, ожидаемое число записей)
+def entity_sources(entity, files, ids, plan_entries, data_dir, use_index=False):
+    """С use_index строки берутся из индекса: читаются только блоки с
+    запрошенными ID в том же порядке, что и при полном чтении файлов.
+    """
+    if use_index and files:
+        try:
+            index = open_entity_index(data_dir, entity, files)
+        except Exception as e:
+            logger.error(f"Не удалось открыть индекс {entity}, файлы будут прочитаны целиком: {str(e)}")
+            index = None
+        if index is not None:
+            yield from index.iter_sources(ids)
+            return
+    for file_name in files:
+        file_path = os.path.join(data_dir, entity, file_name)
+        logger.info(f"Обработка файла: {file_path}")
+        yield file_name, iter_lines(file_path), plan_entries.get(file_name, {}).get('record_count')
+
+# Сканирование строк одного типа сущностей
+class EntityScan:
+    """Состояние сканирования: множества ID, писатели таблиц и счетчики.
+
+    С record_parts=True для каждой найденной записи запоминаются ее ключ,
+    смещения в таблицах и накопленные счетчики после нее (для слияния частей,
+    см. merge_entity_parts).
+    checkpoint - checkpoint.Checkpoint: счетчики и найденные ID
+    восстанавливаются из нее, а после записанных записей сохраняются новые.
+    """
+
+    def __init__(self, spec, entity_ids, writers, limit=None, record_parts=False, checkpoint=None):
+        self.spec = spec
+        self.entity_ids = entity_ids
+        self.ids = entity_ids[spec.ids_key]
+        self.writers = writers
+        self.limit = limit
+        self.remaining = RemainingIds(self.ids)
+        self.limit_reached = False
+        self.total = 0
+        self.matched = 0
+        self.prefiltered = {'skipped': 0}
+        self.relations = {relation.table: 0 for relation in spec.relations}
+        self.samples = {relation.table: [] for relation in spec.relations}
+        self.keys = ([] if spec.by_name else array('q')) if record_parts else None
+        self.bounds = {table: array('q') for table in spec.tables}
+        self.rows = {table: array('q') for table in spec.tables}
+        self.marks = {name: array('q') for name in ('total', 'skipped', *self.relations)}
+        self.checkpoint = checkpoint
+        if checkpoint is not None and checkpoint.resumed:
+            self.restore(checkpoint)
+
+    # Счетчики сканирования для контрольной точки
+    def counters(self):
+        return {'total': self.total, 'matched': self.matched, 'skipped': self.prefiltered['skipped'],
+                'relations': self.relations, 'samples': self.samples}
+
+    # Продолжение сканирования с контрольной точки
+    def restore(self, checkpoint):
+        counters = checkpoint.counters()
+        self.total = counters['total']
+        self.matched = counters['matched']
+        self.prefiltered['skipped'] = counters['skipped']
+        self.relations = counters['relations']
+        self.samples = counters['samples']
+        self.remaining.found = checkpoint.id_sets()['found']
+
+    def scan(self, lines):
+        lines = until_all_found(lines, self.remaining)
+        if not self.spec.by_name:
+            lines = prefilter_lines(lines, self.ids, self.prefiltered)
+        for line in lines:
+            try:
+                record = loads(line)
+                key, key_value = self.spec.key(record)
+                self.total += 1
+                if key is None or key not in self.ids:
+                    continue
+                self.remaining.mark(key)
+                self.write(record, key_value)
+                if self.keys is not None:
+                    self.keys.append(key)
+                    for table in self.spec.tables:
+                        self.bounds[table].append(self.writers[table].tell())
+                        self.rows[table].append(self.writers[table].rows)
+                    self.marks['total'].append(self.total + self.prefiltered['skipped'])
+                    self.marks['skipped'].append(self.prefiltered['skipped'])
+                    for table, count in self.relations.items():
+                        self.marks[table].append(count)
+
+                # Проверка ограничения на количество записей
+                if self.limit is not None and self.writers[self.spec.table].rows >= self.limit:
+                    self.limit_reached = True
+                    self.remaining.stopped_by_limit = True
+                    logger.info(f"Достигнуто ограничение на количество {self.spec.label}: {self.limit}")
+                    return
+            except Exception as e:
+                logger.error(f"Ошибка при обработке записи {self.spec.name}: {str(e)}")
+                continue
+
+            # Контрольная точка после записанной записи
+            if self.checkpoint is not None and self.checkpoint.due():
+                self.checkpoint.save(self.writers, {'found': self.remaining.found}, self.counters())
+
+    # Запись найденной сущности и ее связей
+    def write(self, record, key_value):
+        values = {relation.table: relation.extract(record, self.entity_ids) for relation in self.spec.relations}
+        self.write_entry(self.spec.row(record, key_value), key_value, values)
+
+    # Запись готовой строки основной таблицы и значений связей {таблица: значения}
+    def write_entry(self, row, key_value, values):
+        self.matched += 1
+        self.writers[self.spec.table].write(row)
+
+        # Отладочная информация для первых 5 записей
+        if self.matched <= 5:
+            logger.info(f"Запись {self.spec.name} {self.matched}, ID: {key_value}")
+
+        for relation in self.spec.relations:
+            for value in values[relation.table]:
+                row = {relation.columns[0]: key_value, relation.columns[1]: value}
+                self.writers[relation.table].write(row)
+                self.relations[relation.table] += 1
+                if len(self.samples[relation.table]) < 3:
+                    self.samples[relation.table].append(row)
+
+    # Итог разбора части для слияния в основном процессе
+    def part_result(self):
+        return {'keys': self.keys, 'bounds': self.bounds, 'rows': self.rows, 'marks': self.marks,
+                'total': self.total + self.prefiltered['skipped'], 'skipped': self.prefiltered['skipped'],
+                'matched': self.matched, 'relations': self.relations, 'samples': self.samples}
+
+# Граф сущности с иерархией, загруженный из дампа за одно чтение
+class EntityGraph:
+    """Записи в порядке дампа: коды, строки основной таблицы, значения связей
+    и коды предков (array('q')). Подходит для небольших дампов (концепции):
+    замыкание по предкам считается в памяти, без повторного чтения файлов.
+    """
+
+    def __init__(self, spec, entity_ids):
+        self.spec = spec
+        self.entity_ids = entity_ids
+        self.parent_table = next(relation.table for relation in spec.relations if relation.parents)
+        self.positions = {}
+        self.codes = array('q')
+        self.rows = []
+        self.values = []
+        self.parents = []
+        self._direct = {}
+        self.total = 0
+
+    # Добавление записи дампа (повторные ID пропускаются)
+    def add(self, record):
+        code, key_value = self.spec.key(record)
+        self.total += 1
+        if code is None or code in self.positions:
+            return
+        values = {relation.table: list(relation.extract(record, self.entity_ids)) for relation in self.spec.relations}
+        self.positions[code] = len(self.codes)
+        self.codes.append(code)
+        self.rows.append(self.spec.row(record, key_value))
+        self.values.append(values)
+        self.parents.append(array('q', (encode_id(value) for value in values[self.parent_table])))
+
+    def __len__(self):
+        return len(self.codes)
+
+    # Запрошенные коды вместе со всеми предками (IdSet)
+    def closure(self, ids):
+        seen = set()
+        stack = list(ids)
+        while stack:
+            code = stack.pop()
+            if code in seen:
+                continue
+            seen.add(code)
+            position = self.positions.get(code)
+            if position is not None:
+                stack.extend(self.parents[position])
+        return IdSet.from_sorted(array('q', sorted(seen)))
+
+    # Прямые предки: предки записи, которые не являются предками других ее предков
+    def direct_parents(self, position):
+        direct = self._direct.get(position)
+        if direct is None:
+            parents = self.parents[position]
+            implied = set()
+            for parent in parents:
+                parent_position = self.positions.get(parent)
+                if parent_position is not None:
+                    implied.update(code for code in self.parents[parent_position] if code != parent)
+            # При циклах в данных оставляем исходный список, чтобы не потерять предков
+            direct = [parent for parent in parents if parent not in implied] or list(parents)
+            self._direct[position] = direct
+        return direct
+
+    # Предки записи с глубиной - кратчайшим числом шагов по прямым предкам (сама запись - 0)
+    def depths(self, code):
+        depths = {code: 0}
+        frontier = [code]
+        depth = 0
+        while frontier:
+            depth += 1
+            next_frontier = []
+            for current in frontier:
+                position = self.positions.get(current)
+                if position is None:
+                    continue
+                for parent in self.direct_parents(position):
+                    if parent not in depths:
+                        depths[parent] = depth
+                        next_frontier.append(parent)
+            frontier = next_frontier
+        return depths
+
+# Итоговая статистика сканирования
+def log_scan_stats(spec, total, skipped, matched, relations, samples, elapsed):
+    logger.info(f"Всего {spec.label} обработано: {total}, соответствует фильтру: {matched}")
+    if not spec.by_name:
+        logger.info(f"Отброшено по ID без разбора JSON: {skipped}")
+    for table, count in relations.items():
+        logger.info(f"Найдено {count} связей {table}, примеры: {samples[table]}")
+    rate = total / elapsed if elapsed > 0 else 0
+    logger.info(f"Время обработки {spec.label}: {elapsed:.2f} секунд ({rate:.0f} записей/с)")
+
+# Сохранение таблиц сущности
+def close_writers(spec, writers):
+    for table in spec.tables:
+        writers[table].close()
+        logger.info(f"Сохранено {writers[table].rows} строк в {os.path.basename(writers[table].path)}")
+
+# Обработка одного типа сущностей: чтение частей, фильтрация и запись таблиц
+def run_entity_scan(spec, entity_ids, data_dir, output_dir, limit=None, use_index=False, checkpoint=None):
+    """Возвращает RemainingIds с найденными и ненайденными ключами.
+
+    checkpoint - checkpoint.Checkpoint: сканирование продолжается с нее и
+    периодически сохраняет новые (кроме сущностей с closure_table, которые
+    читаются в граф целиком).
+    """
+    if spec.closure_table:
+        return run_closure_scan(spec, entity_ids, data_dir, output_dir, limit)
+    start_time = time.time()
+    ids = entity_ids[spec.ids_key]
+    entity_dir = os.path.join(data_dir, spec.name)
+
+    # Проверяем, существует ли директория сущности
+    if not os.path.exists(entity_dir):
+        logger.error(f"Директория {entity_dir} не найдена. Убедитесь, что данные были загружены.")
+        return RemainingIds(ids)
+
+    files = scan_order(list_entity_files(entity_dir), use_index)
+    logger.info(f"Начало обработки {spec.label}")
+    logger.info(f"Найдено {len(files)} файлов {spec.label}")
+    logger.info(f"Примеры ID из {spec.ids_key}: {sample_ids(ids, 5)}")
+
+    # Строки записываются на диск по мере обработки
+    if checkpoint is not None:
+        writers = checkpoint.open_writers(spec.tables)
+    else:
+        writers = {table: open_table_writer(output_dir, table) for table in spec.tables}
+    scan = EntityScan(spec, entity_ids, writers, limit, checkpoint=checkpoint)
+    scan.remaining.stop = not use_index
+
+    # Ожидаемое количество записей в каждом файле берем из плана загрузки
+    plan_entries = get_plan_entries(spec.name)
+
+    try:
+        for file_name, lines, total in entity_sources(spec.name, files, ids, plan_entries, data_dir, use_index):
+            if checkpoint is not None:
+                lines = checkpoint.lines(file_name, lines)
+                if lines is None:
+                    continue
+            scan.scan(tqdm(lines, desc=f"Обработка {file_name}", total=total))
+            if scan.limit_reached:
+                break
+
+            # Если все запрошенные ID найдены, остальные файлы не читаем
+            if scan.remaining.done():
+                logger.info(f"Найдены все запрошенные записи {spec.label} ({len(scan.remaining.found)}), пропущено файлов: {len(files) - files.index(file_name) - 1}")
+                break
+    finally:
+        close_writers(spec, writers)
+
+    log_scan_stats(spec, scan.total + scan.prefiltered['skipped'], scan.prefiltered['skipped'], scan.matched,
+                   scan.relations, scan.samples, time.time() - start_time)
+    return scan.remaining
+
+# Обработка сущности с иерархией: граф из всего дампа, замыкание по предкам и запись таблиц
+def run_closure_scan(spec, entity_ids, data_dir, output_dir, limit=None):
+    """Дамп читается один раз целиком (без предфильтра и индекса), поэтому в
+    таблицы попадают все предки запрошенных записей, в каком бы месте дампа
+    они ни встретились. Записи пишутся в порядке дампа; таблица closure_table
+    содержит для каждой записанной записи ее саму (глубина 0) и всех предков
+    с глубиной. Возвращает RemainingIds по запрошенным ID вместе с предками.
+    """
+    start_time = time.time()
+    ids = entity_ids[spec.ids_key]
+    entity_dir = os.path.join(data_dir, spec.name)
+
+    if not os.path.exists(entity_dir):
+        logger.error(f"Директория {entity_dir} не найдена. Убедитесь, что данные были загружены.")
+        return RemainingIds(ids)
+
+    files = list_entity_files(entity_dir)
+    logger.info(f"Начало обработки {spec.label}")
+    logger.info(f"Загрузка графа {spec.label} из {len(files)} файлов")
+
+    graph = EntityGraph(spec, entity_ids)
+    plan_entries = get_plan_entries(spec.name)
+    for file_name, lines, total in entity_sources(spec.name, files, ids, plan_entries, data_dir):
+        for line in tqdm(lines, desc=f"Обработка {file_name}", total=total):
+            try:
+                graph.add(loads(line))
+            except Exception as e:
+                logger.error(f"Ошибка при обработке записи {spec.name}: {str(e)}")
+
+    closure = graph.closure(ids)
+    logger.info(f"Граф {spec.label}: {len(graph)} записей, загружен за {time.time() - start_time:.2f} секунд")
+    logger.info(f"Запрошено {spec.label}: {len(ids)}, вместе с предками: {len(closure)}")
+
+    writers = {table: open_table_writer(output_dir, table) for table in spec.tables}
+    scan = EntityScan(spec, dict(entity_ids, **{spec.ids_key: closure}), writers, limit)
+    scan.total = graph.total
+    key_column, ancestor_column, depth_column = TABLE_COLUMNS[spec.closure_table]
+    closure_rows = 0
+    try:
+        for position, code in enumerate(graph.codes):
+            if code not in closure:
+                continue
+            key_value = decode_id(code)
+            scan.remaining.mark(code)
+            scan.write_entry(graph.rows[position], key_value, graph.values[position])
+            for ancestor, depth in graph.depths(code).items():
+                writers[spec.closure_table].write({key_column: key_value, ancestor_column: decode_id(ancestor),
+                                                   depth_column: depth})
+                closure_rows += 1
+
+            if limit is not None and writers[spec.table].rows >= limit:
+                scan.remaining.stopped_by_limit = True
+                logger.info(f"Достигнуто ограничение на количество {spec.label}: {limit}")
+                break
+    finally:
+        close_writers(spec, writers)
+
+    logger.info(f"Найдено {closure_rows} строк {spec.closure_table}")
+    log_scan_stats(spec, scan.total, 0, scan.matched, scan.relations, scan.samples, time.time() - start_time)
+    return scan.remaining
+
+# Разбор одной части сущности в процессе пула (частичные CSV без заголовка)
+def scan_entity_part(spec, entity_ids, data_dir, file_name, partial_dir, limit=None):
+    """keys[i] - ключ i-й найденной записи, bounds[table][i] - смещение в байтах
+    в частичном файле после нее. По ним при слиянии берутся ровно те записи,
+    которые записала бы последовательная обработка.
+    """
+    os.makedirs(partial_dir, exist_ok=True)
+    # Частичные результаты всегда пишутся в CSV: так их можно слить по смещениям в байтах
+    writers = {table: CsvTableWriter(os.path.join(partial_dir, f"{table}.csv"), TABLE_COLUMNS[table], header=False)
+               for table in spec.tables}
+    scan = EntityScan(spec, entity_ids, writers, limit, record_parts=True)
+    try:
+        scan.scan(iter_lines(os.path.join(data_dir, spec.name, file_name)))
+    finally:
+        for writer in writers.values():
+            writer.close()
+    result = scan.part_result()
+    result.update({'file': file_name, 'dir': partial_dir})
+    return result
+
+# Счетчики части до k-й записи включительно ({'total', 'skipped', таблица связи: число})
+def _part_counts(partial, k):
+    if k == len(partial['keys']):
+        return {'total': partial['total'], 'skipped': partial['skipped'], **partial['relations']}
+    return {name: marks[k - 1] if k else 0 for name, marks in partial['marks'].items()}
+
+# Слияние частей, разобранных в пуле, строго в порядке файлов
+def merge_entity_parts(spec, entity_ids, files, results, output_dir, limit=None):
+    """results - результаты scan_entity_part (объекты с get(), например AsyncResult) в порядке files.
+
+    Из каждой части берутся записи до момента, когда найдены все ключи или
+    достигнут limit, поэтому результат совпадает с последовательной обработкой.
+    """
+    start_time = time.time()
+    remaining = RemainingIds(entity_ids[spec.ids_key])
+    writers = {table: open_table_writer(output_dir, table) for table in spec.tables}
+    total = skipped = matched = 0
+    relations = {relation.table: 0 for relation in spec.relations}
+    samples = {relation.table: [] for relation in spec.relations}
+
+    try:
+        for position, (file_name, result) in enumerate(tqdm(zip(files, results), total=len(files), desc=f"Обработка файлов {spec.label}")):
+            if remaining.done():
+                logger.info(f"Найдены все запрошенные записи {spec.label} ({len(remaining.found)}), пропущено файлов: {len(files) - position}")
+                break
+            partial = result.get()
+
+            # Записи части до момента, когда найдены все ключи или достигнуто ограничение
+            k = 0
+            for key in partial['keys']:
+                if remaining.done() or (limit is not None and writers[spec.table].rows + k >= limit):
+                    break
+                remaining.mark(key)
+                k += 1
+            for table in spec.tables:
+                end = partial['bounds'][table][k - 1] if k else 0
+                end_rows = partial['rows'][table][k - 1] if k else 0
+                writers[table].copy_from(os.path.join(partial['dir'], f"{table}.csv"), end, end_rows)
+
+            # Счетчики берутся до последней взятой записи, если часть взята не целиком
+            counts = _part_counts(partial, k)
+            total += counts['total']
+            skipped += counts['skipped']
+            matched += k
+            for table in relations:
+                relations[table] += counts[table]
+                samples[table] = (samples[table] + partial['samples'][table][:counts[table]])[:3]
+            shutil.rmtree(partial['dir'], ignore_errors=True)
+            logger.info(f"Файл {file_name}: взято {k} записей {spec.name}")
+
+            if limit is not None and writers[spec.table].rows >= limit:
+                remaining.stopped_by_limit = True
+                logger.info(f"Достигнуто ограничение на количество {spec.label}: {limit}")
+                break
+    finally:
+        close_writers(spec, writers)
+
+    log_scan_stats(spec, total, skipped, matched, relations, samples, time.time() - start_time)
+    return remaining
@@ -0,0 +1,101 @@
+import os
+import sys
+import json
+import mmap
+import struct
+from array import array
+
+from id_codec import IdSet, RoaringIdSet
+
+# Имя файла передачи ID связанных сущностей от process_works к process_entities
+ENTITY_IDS_FILE = "entity_ids.bin"
+
+# Старый формат (JSON со списками URI), читается, если двоичного файла нет
+LEGACY_ENTITY_IDS_FILE = "entity_ids.json"
+
+# Сжимать множества ID roaring-битовыми картами (нужен pyroaring); иначе - массивы int64 для mmap
+ENTITY_IDS_ROARING = False
+
+# Сигнатура файла и выравнивание секций
+MAGIC = b"SOAIDS1\n"
+ALIGNMENT = 8
+
+# Ключи множеств ID (коды id_codec); publisher_names хранятся в заголовке строками
+ID_KEYS = ('author_ids', 'concept_ids', 'institution_ids', 'source_ids')
+
+# Сохранение множеств ID в двоичный файл
+def save_entity_ids(path, id_sets, publisher_names, roaring=None):
+    """Записывает файл: сигнатура, длина заголовка, JSON-заголовок и секции с кодами.
+
+    Секция int64 - отсортированные коды little-endian, которые читаются через
+    mmap без копирования; секция roaring - сериализованная pyroaring.BitMap64.
+    """
+    roaring = ENTITY_IDS_ROARING if roaring is None else roaring
+    sections = {}
+    payloads = []
+    offset = 0
+    for key in ID_KEYS:
+        id_set = id_sets[key]
+        if roaring:
+            roaring_set = id_set if isinstance(id_set, RoaringIdSet) else RoaringIdSet(id_set.codes())
+            data = roaring_set.serialize()
+            encoding = 'roaring'
+        else:
+            codes = array('q', id_set.codes())
+            if sys.byteorder != 'little':
+                codes.byteswap()
+            data = codes.tobytes()
+            encoding = 'int64'
+        sections[key] = {'encoding': encoding, 'offset': offset, 'length': len(data), 'count': len(id_set)}
+        payloads.append(data)
+        offset += _padded(len(data))
+
+    header = json.dumps({
+        'sections': sections,
+        'publisher_names': sorted(publisher_names)
+    }, ensure_ascii=False).encode('utf-8')
+    header += b' ' * (_padded(len(header)) - len(header))
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(struct.pack('<Q', len(header)))
+        f.write(header)
+        for data in payloads:
+            f.write(data)
+            f.write(b'\0' * (_padded(len(data)) - len(data)))
+    os.replace(tmp_path, path)
+
+def _padded(length):
+    return (length + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+# Загрузка множеств ID из двоичного файла
+def load_entity_ids_file(path):
+    """Возвращает словарь как в process_works: IdSet/RoaringIdSet для ID и set для издателей.
+
+    Секции int64 отображаются в память (mmap) и используются без копирования,
+    поэтому загрузка не зависит от числа ID, а страницы файла разделяются
+    между процессами через кэш ОС.
+    """
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} не является файлом ID сущностей")
+        header_length, = struct.unpack('<Q', f.read(8))
+        header = json.loads(f.read(header_length))
+        data_start = len(MAGIC) + 8 + header_length
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(f.fileno()).st_size > data_start else b''
+
+    entity_ids = {}
+    for key, section in header['sections'].items():
+        start = data_start + section['offset']
+        data = memoryview(buffer)[start:start + section['length']]
+        if section['encoding'] == 'roaring':
+            entity_ids[key] = RoaringIdSet.deserialize(data)
+        elif sys.byteorder == 'little':
+            entity_ids[key] = IdSet.from_sorted(data.cast('q'))
+        else:
+            codes = array('q', data.tobytes())
+            codes.byteswap()
+            entity_ids[key] = IdSet.from_sorted(codes)
+    entity_ids['publisher_names'] = set(header['publisher_names'])
+    return entity_ids
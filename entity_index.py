@@ -0,0 +1,559 @@
+import os
+import sys
+import json
+import mmap
+import zlib
+import shutil
+import struct
+import hashlib
+import logging
+from array import array
+from bisect import bisect_left, bisect_right
+
+from tqdm import tqdm
+
+from json_decoder import loads
+from input_reader import iter_lines, decompressobj
+from id_codec import IdSet, encode_id, peek_id
+from download_data import DownloadManifest
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+logger = logging.getLogger("entity_index")
+
+# Каталог индексов внутри каталога данных: <DATA_DIR>/index/<сущность>/
+INDEX_DIR_NAME = "index"
+
+# Файл индекса сущности (ID -> блок) внутри каталога индекса
+INDEX_FILE = "index.bin"
+
+# Файл индекса ID (только отсортированные коды записей частей, без блоков)
+ID_INDEX_FILE = "ids.bin"
+
+# Файл индекса устаревших версий (номера строк записей, у которых есть более новая версия)
+SUPERSEDED_INDEX_FILE = "superseded.bin"
+
+# Количество пар (код, номер строки) в памяти, после которого они сбрасываются в корзины на диске
+DEDUP_SPILL_RECORDS = 8_000_000
+
+# Количество корзин на диске (по старшим битам хеша кода)
+DEDUP_SPILL_BUCKETS = 64
+
+# Нечетная константа умножения для хеша кода при распределении по корзинам
+_BUCKET_MULTIPLIER = 0x9E3779B97F4A7C15
+
+# Размер блока до сжатия: за одно обращение распаковывается не больше этого объема
+INDEX_BLOCK_SIZE = 64 * 1024
+
+# Уровень сжатия блоков (zlib, 1 - быстрее, 9 - компактнее)
+INDEX_COMPRESSION_LEVEL = 6
+
+# Сигнатура файла индекса и выравнивание секций
+MAGIC = b"SOAIDX1\n"
+ALIGNMENT = 8
+
+# Сущности, которые ищутся не по ID, а по имени (ключ - хеш display_name)
+NAME_KEYED_ENTITIES = ('publishers',)
+
+# Ключ записи по имени: 64-битный хеш строки
+def name_key(name):
+    digest = hashlib.blake2b(name.encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'little', signed=True)
+
+# Ключ записи для индекса: код ID или хеш имени (None, если ключ не найден)
+def record_key(entity, line):
+    if entity in NAME_KEYED_ENTITIES:
+        try:
+            name = loads(line).get('display_name')
+        except Exception:
+            return None
+        return name_key(name) if isinstance(name, str) else None
+    code = peek_id(line)
+    if code is not None:
+        return code
+    try:
+        return encode_id(loads(line).get('id'))
+    except Exception:
+        return None
+
+# Ключи запрошенных записей: коды IdSet или хеши имен издателей
+def request_keys(entity, ids):
+    if entity in NAME_KEYED_ENTITIES:
+        return sorted(name_key(name) for name in ids if isinstance(name, str))
+    return ids.codes()
+
+# Отпечаток части дампа: размер, время изменения и запись манифеста загрузок
+def file_fingerprint(path, manifest):
+    stat = os.stat(path)
+    entry = manifest.get(path) or {}
+    return {
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+        'etag': entry.get('etag'),
+        'md5': entry.get('md5')
+    }
+
+def _padded(length):
+    return (length + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+def _index_dir(data_dir, entity):
+    return os.path.join(data_dir, INDEX_DIR_NAME, entity)
+
+# Построение индекса сущности по частям дампа
+def build_entity_index(data_dir, entity, files):
+    """Пересжимает части в файлы из независимых gzip-членов по INDEX_BLOCK_SIZE и записывает index.bin.
+
+    Каждый блок - целые строки исходной части, поэтому его можно распаковать
+    отдельно, зная смещение и длину. Конкатенация блоков - обычный .jsonl.gz.
+    index.bin: отсортированные ключи записей, номер блока для каждого ключа,
+    таблица блоков (файл, смещение, длина, число записей) и отпечатки частей.
+    """
+    entity_dir = os.path.join(data_dir, entity)
+    index_dir = _index_dir(data_dir, entity)
+    tmp_dir = index_dir + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    manifest = DownloadManifest()
+
+    keys = array('q')
+    key_blocks = array('i')
+    block_files = array('i')
+    block_offsets = array('q')
+    block_lengths = array('q')
+    block_records = array('i')
+    unkeyed_blocks = []
+    file_entries = []
+
+    logger.info(f"Построение индекса {entity}: {len(files)} файлов")
+    for file_no, file_name in enumerate(files):
+        path = os.path.join(entity_dir, file_name)
+        blocks_name = file_name.replace(".jsonl.gz", ".blocks.gz")
+        offset = 0
+        with open(os.path.join(tmp_dir, blocks_name), 'wb') as out:
+            batch = []
+            batch_size = 0
+
+            def write_block():
+                nonlocal offset
+                block_no = len(block_offsets)
+                unkeyed = False
+                for line in batch:
+                    key = record_key(entity, line)
+                    if key is None:
+                        unkeyed = True
+                    else:
+                        keys.append(key)
+                        key_blocks.append(block_no)
+                if unkeyed:
+                    unkeyed_blocks.append(block_no)
+                compressor = zlib.compressobj(INDEX_COMPRESSION_LEVEL, zlib.DEFLATED, 31)
+                data = compressor.compress(b'\n'.join(batch) + b'\n') + compressor.flush()
+                out.write(data)
+                block_files.append(file_no)
+                block_offsets.append(offset)
+                block_lengths.append(len(data))
+                block_records.append(len(batch))
+                offset += len(data)
+
+            for line in tqdm(iter_lines(path), desc=f"Индексирование {file_name}"):
+                batch.append(line)
+                batch_size += len(line) + 1
+                if batch_size >= INDEX_BLOCK_SIZE:
+                    write_block()
+                    batch = []
+                    batch_size = 0
+            if batch:
+                write_block()
+        file_entries.append({
+            'name': file_name,
+            'blocks_file': blocks_name,
+            'fingerprint': file_fingerprint(path, manifest)
+        })
+
+    # Сортировка ключей вместе с номерами блоков (порядок блоков для равных ключей сохраняется)
+    if np is not None and keys:
+        order = np.argsort(np.frombuffer(keys, dtype=np.int64), kind='stable')
+        keys = array('q', np.frombuffer(keys, dtype=np.int64)[order].tobytes())
+        key_blocks = array('i', np.frombuffer(key_blocks, dtype=np.int32)[order].tobytes())
+    else:
+        pairs = sorted(zip(keys, key_blocks))
+        keys = array('q', (key for key, _ in pairs))
+        key_blocks = array('i', (block for _, block in pairs))
+
+    sections = [('keys', keys), ('key_blocks', key_blocks), ('block_files', block_files),
+                ('block_offsets', block_offsets), ('block_lengths', block_lengths),
+                ('block_records', block_records), ('unkeyed_blocks', array('i', unkeyed_blocks))]
+    _write_index_file(os.path.join(tmp_dir, INDEX_FILE), {'entity': entity, 'files': file_entries}, sections)
+
+    shutil.rmtree(index_dir, ignore_errors=True)
+    os.replace(tmp_dir, index_dir)
+    size_mb = sum(os.path.getsize(os.path.join(index_dir, name)) for name in os.listdir(index_dir)) / (1024 * 1024)
+    logger.info(f"Индекс {entity} построен: {len(keys)} записей, {len(block_offsets)} блоков, {size_mb:.1f} МБ")
+
+# Запись index.bin: сигнатура, длина заголовка, JSON-заголовок и выровненные секции little-endian
+def _write_index_file(path, header, sections):
+    payloads = []
+    offset = 0
+    header['sections'] = {}
+    for name, values in sections:
+        if sys.byteorder != 'little':
+            values = array(values.typecode, values)
+            values.byteswap()
+        data = values.tobytes()
+        header['sections'][name] = {'typecode': values.typecode, 'offset': offset, 'length': len(data)}
+        payloads.append(data)
+        offset += _padded(len(data))
+    header_bytes = json.dumps(header, ensure_ascii=False).encode('utf-8')
+    header_bytes += b' ' * (_padded(len(header_bytes)) - len(header_bytes))
+    with open(path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(struct.pack('<Q', len(header_bytes)))
+        f.write(header_bytes)
+        for data in payloads:
+            f.write(data)
+            f.write(b'\0' * (_padded(len(data)) - len(data)))
+
+# Чтение файла индекса: JSON-заголовок и секции, отображенные в память
+def _read_index_file(path):
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} не является индексом сущностей")
+        header_length, = struct.unpack('<Q', f.read(8))
+        header = json.loads(f.read(header_length))
+        data_start = len(MAGIC) + 8 + header_length
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(f.fileno()).st_size > data_start else b''
+    sections = {}
+    for name, section in header['sections'].items():
+        start = data_start + section['offset']
+        data = memoryview(buffer)[start:start + section['length']]
+        if sys.byteorder == 'little':
+            values = data.cast(section['typecode'])
+        else:
+            values = array(section['typecode'], data.tobytes())
+            values.byteswap()
+        sections[name] = values
+    return header, sections
+
+# Совпадают ли части, записанные в индексе, с текущими частями дампа
+def _files_current(data_dir, entity, entries, files):
+    if [entry['name'] for entry in entries] != list(files):
+        return False
+    manifest = DownloadManifest()
+    for entry in entries:
+        path = os.path.join(data_dir, entity, entry['name'])
+        if not os.path.exists(path) or file_fingerprint(path, manifest) != entry['fingerprint']:
+            return False
+    return True
+
+# Индекс сущности, открытый для чтения
+class EntityIndex:
+    """Секции index.bin отображаются в память; записи читаются по блокам."""
+
+    def __init__(self, data_dir, entity):
+        self.data_dir = data_dir
+        self.entity = entity
+        self.directory = _index_dir(data_dir, entity)
+        self.header, sections = _read_index_file(os.path.join(self.directory, INDEX_FILE))
+        self.files = self.header['files']
+        for name, values in sections.items():
+            setattr(self, name, values)
+
+    # Совпадает ли индекс с текущими частями дампа
+    def is_current(self, files):
+        return _files_current(self.data_dir, self.entity, self.files, files)
+
+    # Номера блоков (по возрастанию), в которых есть записи с данными ключами
+    def blocks_for(self, keys):
+        blocks = set(self.unkeyed_blocks)
+        if np is not None:
+            index_keys = np.asarray(self.keys, dtype=np.int64)
+            requested = np.asarray(keys, dtype=np.int64)
+            left = np.searchsorted(index_keys, requested, side='left')
+            right = np.searchsorted(index_keys, requested, side='right')
+            key_blocks = np.asarray(self.key_blocks, dtype=np.int32)
+            blocks.update(key_blocks[left[left < right]].tolist())
+            # Ключи, которые встречаются в нескольких записях (повторы в разных частях)
+            repeated = right - left > 1
+            for start, end in zip(left[repeated].tolist(), right[repeated].tolist()):
+                blocks.update(key_blocks[start:end].tolist())
+        else:
+            for key in keys:
+                start = bisect_left(self.keys, key)
+                end = bisect_right(self.keys, key, start)
+                blocks.update(self.key_blocks[start:end])
+        return sorted(blocks)
+
+    # Строки одного блока
+    def read_block(self, block_no, handle):
+        handle.seek(self.block_offsets[block_no])
+        data = handle.read(self.block_lengths[block_no])
+        lines = decompressobj().decompress(data).split(b'\n')
+        return [line for line in lines if line]
+
+    # Источники строк для сканирования: (имя части, строки нужных блоков, число записей в них)
+    def iter_sources(self, ids):
+        """Порядок строк совпадает с полным чтением частей.
+
+        Если множество ids растет во время чтения (предки концепций), блоки
+        пересчитываются и читаются те из них, что идут после текущего, как и
+        при полном чтении.
+        """
+        state = {'position': -1, 'size': None, 'blocks': [], 'next': 0}
+
+        # Следующий нужный блок после текущей позиции (None, если блоков больше нет)
+        def next_block():
+            if state['size'] != len(ids):
+                state['size'] = len(ids)
+                state['blocks'] = self.blocks_for(request_keys(self.entity, ids))
+                state['next'] = bisect_right(state['blocks'], state['position'])
+            if state['next'] < len(state['blocks']):
+                return state['blocks'][state['next']]
+            return None
+
+        # Пропуск блоков до block_no включительно
+        def skip_to(block_no):
+            state['position'] = max(state['position'], block_no)
+            state['next'] = bisect_right(state['blocks'], state['position'])
+
+        def file_lines(file_no, last_block, handle):
+            while True:
+                block_no = next_block()
+                if block_no is None or block_no > last_block:
+                    return
+                skip_to(block_no)
+                yield from self.read_block(block_no, handle)
+
+        while True:
+            block_no = next_block()
+            if block_no is None:
+                return
+            file_no = self.block_files[block_no]
+            last_block = bisect_right(self.block_files, file_no) - 1
+            end = bisect_right(state['blocks'], last_block)
+            total = sum(self.block_records[block] for block in state['blocks'][state['next']:end])
+            entry = self.files[file_no]
+            logger.info(f"Чтение {entry['name']} по индексу: {end - state['next']} блоков, {total} записей")
+            with open(os.path.join(self.directory, entry['blocks_file']), 'rb') as handle:
+                yield entry['name'], file_lines(file_no, last_block, handle), total
+            # Оставшиеся блоки этой части пропускаются, если обработчик остановился раньше
+            skip_to(last_block)
+
+# Открытие индекса сущности; при отсутствии или устаревании он строится заново
+def open_entity_index(data_dir, entity, files, build=True):
+    index_path = os.path.join(_index_dir(data_dir, entity), INDEX_FILE)
+    if os.path.exists(index_path):
+        try:
+            index = EntityIndex(data_dir, entity)
+            if index.is_current(files):
+                return index
+            logger.info(f"Индекс {entity} устарел: изменились части дампа или манифест загрузок")
+        except Exception as e:
+            logger.warning(f"Не удалось прочитать индекс {entity}: {str(e)}")
+    if not build:
+        return None
+    build_entity_index(data_dir, entity, files)
+    return EntityIndex(data_dir, entity)
+
+# Построение индекса ID: отсортированные коды всех записей частей
+def build_id_index(data_dir, entity, files):
+    """Один проход по частям без разбора JSON (ID читается из начала строки).
+
+    В отличие от index.bin, части не пересжимаются, поэтому индекс ID можно
+    строить и для works: он занимает 8 байт на запись.
+    """
+    entity_dir = os.path.join(data_dir, entity)
+    index_dir = _index_dir(data_dir, entity)
+    os.makedirs(index_dir, exist_ok=True)
+    manifest = DownloadManifest()
+    codes = array('q')
+    file_entries = []
+    for file_name in files:
+        path = os.path.join(entity_dir, file_name)
+        for line in tqdm(iter_lines(path), desc=f"Индексирование ID {file_name}"):
+            code = record_key(entity, line)
+            if code is not None:
+                codes.append(code)
+        file_entries.append({'name': file_name, 'fingerprint': file_fingerprint(path, manifest)})
+
+    if np is not None:
+        codes = array('q', np.unique(np.frombuffer(codes, dtype=np.int64)).tobytes())
+    else:
+        codes = array('q', sorted(set(codes)))
+    tmp_path = os.path.join(index_dir, ID_INDEX_FILE + ".tmp")
+    _write_index_file(tmp_path, {'entity': entity, 'files': file_entries}, [('codes', codes)])
+    os.replace(tmp_path, os.path.join(index_dir, ID_INDEX_FILE))
+    logger.info(f"Индекс ID {entity} построен: {len(codes)} записей, {len(codes) * 8 / (1024 * 1024):.1f} МБ")
+
+# Множество ID всех записей частей (IdSet поверх отображенного в память индекса ID)
+def open_id_index(data_dir, entity, files, build=True):
+    index_path = os.path.join(_index_dir(data_dir, entity), ID_INDEX_FILE)
+    if os.path.exists(index_path):
+        try:
+            header, sections = _read_index_file(index_path)
+            if _files_current(data_dir, entity, header['files'], files):
+                return IdSet.from_sorted(sections['codes'])
+            logger.info(f"Индекс ID {entity} устарел: изменились части дампа или манифест загрузок")
+        except Exception as e:
+            logger.warning(f"Не удалось прочитать индекс ID {entity}: {str(e)}")
+    if not build:
+        return None
+    build_id_index(data_dir, entity, files)
+    header, sections = _read_index_file(index_path)
+    return IdSet.from_sorted(sections['codes'])
+
+# Номера строк, у которых есть более новая версия того же кода (в группе кода новее строка с большим номером)
+def _superseded_positions(codes, positions):
+    order = np.lexsort((positions, codes))
+    codes = codes[order]
+    positions = positions[order]
+    return positions[:-1][codes[:-1] == codes[1:]]
+
+# Поиск устаревших версий записей: (начала частей, номера устаревших строк, число строк)
+def find_superseded(data_dir, entity, files):
+    """Один проход по частям без разбора JSON: для каждой строки запоминается
+    пара (код ID, сквозной номер строки). Части идут по возрастанию даты
+    (updated_date_YYYY-MM-DD), поэтому самая новая версия записи - последняя
+    строка с этим кодом; остальные строки считаются устаревшими.
+
+    Пары копятся в памяти до DEDUP_SPILL_RECORDS и затем раскладываются по
+    DEDUP_SPILL_BUCKETS файлам-корзинам на диске по хешу кода, так что все
+    версии одного кода попадают в одну корзину. Корзины обрабатываются по
+    одной, поэтому память не зависит от числа записей. Без numpy все пары
+    обрабатываются в памяти.
+    """
+    entity_dir = os.path.join(data_dir, entity)
+    index_dir = _index_dir(data_dir, entity)
+    spill_dir = os.path.join(index_dir, ".spill")
+    shutil.rmtree(spill_dir, ignore_errors=True)
+    os.makedirs(index_dir, exist_ok=True)
+    codes = array('q')
+    positions = array('q')
+    file_starts = array('q')
+    latest = {}
+    spilled = 0
+    bucket_bits = max(1, (DEDUP_SPILL_BUCKETS - 1).bit_length())
+
+    # Сброс накопленных пар в корзины на диске
+    def spill():
+        nonlocal codes, positions, spilled
+        os.makedirs(spill_dir, exist_ok=True)
+        pairs = np.empty((len(codes), 2), dtype=np.int64)
+        pairs[:, 0] = np.frombuffer(codes, dtype=np.int64)
+        pairs[:, 1] = np.frombuffer(positions, dtype=np.int64)
+        buckets = (pairs[:, 0].astype(np.uint64) * np.uint64(_BUCKET_MULTIPLIER)) >> np.uint64(64 - bucket_bits)
+        for bucket in np.unique(buckets).tolist():
+            with open(os.path.join(spill_dir, f"{bucket}.bin"), 'ab') as f:
+                pairs[buckets == bucket].tofile(f)
+        spilled += len(codes)
+        codes = array('q')
+        positions = array('q')
+
+    position = 0
+    try:
+        for file_name in files:
+            path = os.path.join(entity_dir, file_name)
+            file_starts.append(position)
+            for line in tqdm(iter_lines(path), desc=f"Поиск повторов {file_name}"):
+                code = record_key(entity, line)
+                if code is not None:
+                    if np is None:
+                        previous = latest.get(code)
+                        if previous is not None:
+                            positions.append(previous)
+                        latest[code] = position
+                    else:
+                        codes.append(code)
+                        positions.append(position)
+                        if len(codes) >= DEDUP_SPILL_RECORDS:
+                            spill()
+                position += 1
+
+        if np is None:
+            superseded = array('q', sorted(positions))
+        else:
+            if spilled:
+                if codes:
+                    spill()
+                parts = []
+                for bucket_file in sorted(os.listdir(spill_dir)):
+                    pairs = np.fromfile(os.path.join(spill_dir, bucket_file), dtype=np.int64).reshape(-1, 2)
+                    parts.append(_superseded_positions(pairs[:, 0], pairs[:, 1]))
+                found = np.sort(np.concatenate(parts)) if parts else np.empty(0, dtype=np.int64)
+            elif codes:
+                found = np.sort(_superseded_positions(np.frombuffer(codes, dtype=np.int64),
+                                                      np.frombuffer(positions, dtype=np.int64)))
+            else:
+                found = np.empty(0, dtype=np.int64)
+            superseded = array('q', found.tobytes())
+    finally:
+        shutil.rmtree(spill_dir, ignore_errors=True)
+
+    logger.info(f"Устаревшие версии {entity}: {position} записей, устаревших {len(superseded)}"
+                f"{f', сброшено на диск {spilled} пар' if spilled else ''}")
+    return file_starts, superseded, position
+
+# Номера устаревших строк каждой части: {имя части: номера строк по возрастанию}
+def split_superseded(files, file_starts, superseded, records):
+    starts = list(file_starts) + [records]
+    skip = {}
+    for file_no, file_name in enumerate(files):
+        begin = bisect_left(superseded, starts[file_no])
+        end = bisect_left(superseded, starts[file_no + 1])
+        skip[file_name] = array('q', (position - starts[file_no] for position in superseded[begin:end]))
+    return skip
+
+# Устаревшие версии только среди данных частей, без сохранения индекса
+def superseded_lines(data_dir, entity, files):
+    return split_superseded(files, *find_superseded(data_dir, entity, files))
+
+# Построение индекса устаревших версий записей (data/index/<сущность>/superseded.bin)
+def build_superseded_index(data_dir, entity, files):
+    file_starts, superseded, records = find_superseded(data_dir, entity, files)
+    manifest = DownloadManifest()
+    file_entries = [{'name': file_name, 'fingerprint': file_fingerprint(os.path.join(data_dir, entity, file_name), manifest)}
+                    for file_name in files]
+    index_dir = _index_dir(data_dir, entity)
+    tmp_path = os.path.join(index_dir, SUPERSEDED_INDEX_FILE + ".tmp")
+    _write_index_file(tmp_path, {'entity': entity, 'files': file_entries, 'records': records},
+                      [('file_starts', file_starts), ('superseded', superseded)])
+    os.replace(tmp_path, os.path.join(index_dir, SUPERSEDED_INDEX_FILE))
+    logger.info(f"Индекс устаревших версий {entity} сохранен в {SUPERSEDED_INDEX_FILE}")
+
+# Номера устаревших строк каждой части: {имя части: номера строк по возрастанию}
+def open_superseded_index(data_dir, entity, files, build=True):
+    """Номера считаются так же, как строки iter_lines, и передаются в input_reader.skip_lines."""
+    index_path = os.path.join(_index_dir(data_dir, entity), SUPERSEDED_INDEX_FILE)
+    header = sections = None
+    if os.path.exists(index_path):
+        try:
+            header, sections = _read_index_file(index_path)
+            if not _files_current(data_dir, entity, header['files'], files):
+                logger.info(f"Индекс устаревших версий {entity} устарел: изменились части дампа или манифест загрузок")
+                header = None
+        except Exception as e:
+            logger.warning(f"Не удалось прочитать индекс устаревших версий {entity}: {str(e)}")
+            header = None
+    if header is None:
+        if not build:
+            return None
+        build_superseded_index(data_dir, entity, files)
+        header, sections = _read_index_file(index_path)
+
+    return split_superseded([entry['name'] for entry in header['files']], sections['file_starts'],
+                            sections['superseded'], header['records'])
+
+# Построение индексов для всех загруженных сущностей
+def build_all_indexes(data_dir="data"):
+    for entity in ('authors', 'institutions', 'concepts', 'sources', 'publishers'):
+        entity_dir = os.path.join(data_dir, entity)
+        if not os.path.exists(entity_dir):
+            continue
+        files = sorted(f for f in os.listdir(entity_dir) if f.endswith(".jsonl.gz") and "_part_" in f)
+        open_entity_index(data_dir, entity, files)
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    build_all_indexes()
@@ -0,0 +1,288 @@
+import re
+import string
+from bisect import bisect_left
+from array import array
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Префикс канонических URI сущностей OpenAlex
+ID_PREFIX = "https://openalex.org/"
+
+# Число бит под номер сущности: старший байт кода - буква типа (W, A, I, C, S, P ...)
+NUMBER_BITS = 56
+NUMBER_MASK = (1 << NUMBER_BITS) - 1
+
+# Количество новых кодов, после которого они переносятся в отсортированный массив IdSet
+COMPACT_THRESHOLD = 1_000_000
+
+# Размер массива IdSet, начиная с которого перед бинарным поиском проверяется битовый фильтр
+FILTER_MIN_SIZE = 1024
+
+# Старшие биты кода для каждой буквы типа
+_TYPE_BITS = {letter: ord(letter) << NUMBER_BITS for letter in string.ascii_uppercase}
+
+# Кодирование ID OpenAlex (URI или короткая форма W123) в одно 64-битное целое
+def encode_id(value):
+    """Возвращает код ID или None, если значение не похоже на ID OpenAlex."""
+    try:
+        short = value[value.rfind('/') + 1:]
+        number = int(short[1:])
+        if number < 0 or number > NUMBER_MASK:
+            return None
+        return _TYPE_BITS[short[0]] | number
+    except (AttributeError, TypeError, ValueError, KeyError, IndexError):
+        return None
+
+# Строковая форма кода: короткая (W123) или полный URI
+def decode_id(code, uri=False):
+    short = f"{chr(code >> NUMBER_BITS)}{code & NUMBER_MASK}"
+    return ID_PREFIX + short if uri else short
+
+# Буква типа сущности по коду
+def entity_type(code):
+    return chr(code >> NUMBER_BITS)
+
+# ID в начале строки JSON: {"id": "https://openalex.org/A123", ...
+_LEADING_ID = re.compile(rb'\s*\{\s*"id"\s*:\s*"(?:https://openalex\.org/)?([A-Z])([0-9]{1,16})"')
+
+# Код ID записи, прочитанный из начала строки JSON (bytes) без разбора
+def peek_id(line):
+    """Возвращает код или None, если строка начинается не с канонического "id"."""
+    match = _LEADING_ID.match(line)
+    if match is None:
+        return None
+    number = int(match.group(2))
+    if number > NUMBER_MASK:
+        return None
+    return (match.group(1)[0] << NUMBER_BITS) | number
+
+# Код для значения: строка кодируется, целое число считается готовым кодом
+def _to_code(value):
+    if isinstance(value, str):
+        return encode_id(value)
+    if value is None:
+        return None
+    return int(value)
+
+# Кодирование последовательности ID в массив (некорректные ID пропускаются)
+def encode_ids(values):
+    codes = array('q', (code for code in map(encode_id, values) if code is not None))
+    if np is not None:
+        return np.frombuffer(codes, dtype=np.int64) if codes else np.empty(0, dtype=np.int64)
+    return codes
+
+# Коды множества ids, которых нет в other (по возрастанию)
+def difference_codes(ids, other):
+    if np is not None:
+        return np.setdiff1d(np.frombuffer(ids.codes(), dtype=np.int64),
+                            np.frombuffer(other.codes(), dtype=np.int64), assume_unique=True)
+    return array('q', (code for code in ids.codes() if code not in other))
+
+# Множество ID в виде отсортированного массива 64-битных кодов
+class IdSet:
+    """Компактное множество ID OpenAlex.
+
+    Коды хранятся в отсортированном array('q') (8 байт на ID), проверка
+    принадлежности - битовым фильтром и бинарным поиском. Новые коды сначала попадают в обычное
+    множество и переносятся в массив пачками (слиянием через numpy, если он
+    установлен), поэтому add() можно чередовать с проверками без пересортировки
+    на каждом шаге.
+    """
+
+    def __init__(self, values=()):
+        self._sorted = array('q')
+        self._filter = None
+        self._pending = set()
+        self.invalid = 0
+        self.update(values)
+
+    # Множество поверх готового отсортированного буфера кодов без копирования (например, memoryview из mmap)
+    @classmethod
+    def from_sorted(cls, codes):
+        id_set = cls()
+        id_set._sorted = codes
+        id_set._filter = None
+        return id_set
+
+    # Добавление ID (строки или уже готового кода)
+    def add(self, value):
+        code = _to_code(value)
+        if code is None:
+            self.invalid += 1
+            return
+        if code in self._pending or self._contains_sorted(code):
+            return
+        self._pending.add(code)
+        if len(self._pending) >= COMPACT_THRESHOLD:
+            self.compact()
+
+    def update(self, values):
+        for value in values:
+            self.add(value)
+
+    # Перенос новых кодов в отсортированный массив
+    def compact(self):
+        if not self._pending:
+            return
+        if np is not None:
+            pending = np.fromiter(self._pending, dtype=np.int64, count=len(self._pending))
+            merged = np.union1d(np.frombuffer(self._sorted, dtype=np.int64), pending)
+            self._sorted = array('q')
+            self._sorted.frombytes(merged.tobytes())
+        else:
+            self._sorted = array('q', sorted(set(self._sorted) | self._pending))
+        self._filter = None
+        self._pending = set()
+
+    # Битовый фильтр по младшим битам номера (~8 бит на ID): большинство
+    # отсутствующих кодов отсеивается без бинарного поиска
+    def _build_filter(self):
+        bits = max(3, (len(self._sorted) * 8 - 1).bit_length())
+        mask = (1 << bits) - 1
+        if np is not None:
+            positions = np.frombuffer(self._sorted, dtype=np.int64) & mask
+            table = np.zeros(1 << (bits - 3), dtype=np.uint8)
+            np.bitwise_or.at(table, positions >> 3, np.left_shift(1, positions & 7).astype(np.uint8))
+            table = table.tobytes()
+        else:
+            table = bytearray(1 << (bits - 3))
+            for code in self._sorted:
+                position = code & mask
+                table[position >> 3] |= 1 << (position & 7)
+            table = bytes(table)
+        self._filter = (table, mask)
+
+    def _contains_sorted(self, code):
+        sorted_codes = self._sorted
+        if len(sorted_codes) >= FILTER_MIN_SIZE:
+            if self._filter is None:
+                self._build_filter()
+            table, mask = self._filter
+            position = code & mask
+            if not table[position >> 3] >> (position & 7) & 1:
+                return False
+        index = bisect_left(sorted_codes, code)
+        return index < len(sorted_codes) and sorted_codes[index] == code
+
+    def __contains__(self, value):
+        code = _to_code(value)
+        if code is None:
+            return False
+        return code in self._pending or self._contains_sorted(code)
+
+    def __len__(self):
+        return len(self._sorted) + len(self._pending)
+
+    # Коды в порядке возрастания (array('q'))
+    def codes(self):
+        self.compact()
+        return self._sorted
+
+    def __iter__(self):
+        return iter(self.codes())
+
+    # Строковые ID (короткие или URI) - только для вывода
+    def strings(self, uri=False):
+        return (decode_id(code, uri=uri) for code in self)
+
+    def __repr__(self):
+        return f"IdSet({len(self)} ID)"
+
+# Константы умножения для хешей фильтра Блума (нечетные 64-битные)
+_BLOOM_MULTIPLIERS = (0x9E3779B97F4A7C15, 0xC2B2AE3D27D4EB4F)
+_MASK64 = (1 << 64) - 1
+
+# Фильтр Блума по кодам ID
+class BloomFilter:
+    """Проверка принадлежности без ложных отрицаний: при bits_per_id=10 и 7
+    хешах ложных срабатываний не больше ~1%. Позиции кода получаются из двух
+    хешей умножением (h1 + i*h2), размер битового массива - степень двойки.
+    Положительный ответ нужно подтверждать точной проверкой (IdSet).
+    """
+
+    def __init__(self, codes, bits_per_id=10, hashes=7):
+        self.bits = max(6, (max(len(codes), 1) * bits_per_id - 1).bit_length())
+        self.shift = 64 - self.bits
+        self.hashes = hashes
+        if np is not None:
+            values = np.asarray(codes, dtype=np.int64).astype(np.uint64)
+            table = np.zeros(1 << (self.bits - 3), dtype=np.uint8)
+            h1 = values * np.uint64(_BLOOM_MULTIPLIERS[0])
+            h2 = values * np.uint64(_BLOOM_MULTIPLIERS[1]) | np.uint64(1)
+            for i in range(hashes):
+                positions = (h1 + np.uint64(i) * h2) >> np.uint64(self.shift)
+                np.bitwise_or.at(table, positions >> np.uint64(3),
+                                 np.left_shift(1, (positions & np.uint64(7)).astype(np.uint8)).astype(np.uint8))
+            self._table = table.tobytes()
+        else:
+            table = bytearray(1 << (self.bits - 3))
+            for code in codes:
+                for position in self._positions(code):
+                    table[position >> 3] |= 1 << (position & 7)
+            self._table = bytes(table)
+
+    def _positions(self, code):
+        h1 = (code * _BLOOM_MULTIPLIERS[0]) & _MASK64
+        h2 = (code * _BLOOM_MULTIPLIERS[1]) & _MASK64 | 1
+        for i in range(self.hashes):
+            yield ((h1 + i * h2) & _MASK64) >> self.shift
+
+    def __contains__(self, code):
+        table = self._table
+        for position in self._positions(code):
+            if not table[position >> 3] >> (position & 7) & 1:
+                return False
+        return True
+
+# Множество ID на основе сжатой roaring-битовой карты (пакет pyroaring)
+class RoaringIdSet:
+    """Тот же интерфейс, что у IdSet, но коды хранятся в pyroaring.BitMap64."""
+
+    def __init__(self, values=(), bitmap=None):
+        from pyroaring import BitMap64
+        self._bitmap = bitmap if bitmap is not None else BitMap64()
+        self.invalid = 0
+        self.update(values)
+
+    def add(self, value):
+        code = _to_code(value)
+        if code is None:
+            self.invalid += 1
+            return
+        self._bitmap.add(code)
+
+    def update(self, values):
+        for value in values:
+            self.add(value)
+
+    def __contains__(self, value):
+        code = _to_code(value)
+        return code is not None and code in self._bitmap
+
+    def __len__(self):
+        return len(self._bitmap)
+
+    def codes(self):
+        return array('q', self._bitmap)
+
+    def __iter__(self):
+        return iter(self._bitmap)
+
+    def strings(self, uri=False):
+        return (decode_id(code, uri=uri) for code in self)
+
+    # Сериализованная битовая карта
+    def serialize(self):
+        self._bitmap.run_optimize()
+        return self._bitmap.serialize()
+
+    @classmethod
+    def deserialize(cls, data):
+        from pyroaring import BitMap64
+        return cls(bitmap=BitMap64.deserialize(data))
+
+    def __repr__(self):
+        return f"RoaringIdSet({len(self)} ID)"
@@ -0,0 +1,362 @@
+import os
+import sys
+import csv
+import json
+import time
+import shutil
+import logging
+from array import array
+from collections import Counter
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+import table_writers
+import process_works
+import process_entities
+import citation_subset
+import work_filter as work_filters
+import work_sample
+from input_reader import iter_lines, skip_lines
+from table_writers import CsvTableWriter, TABLE_COLUMNS
+from id_codec import IdSet, peek_id, difference_codes
+from entity_index import file_fingerprint, superseded_lines
+from entity_ids_file import load_entity_ids_file, save_entity_ids, ENTITY_IDS_FILE
+from entity_engine import run_entity_scan
+from download_data import DownloadManifest
+
+logger = logging.getLogger("incremental")
+
+# Файл состояния: части works, уже учтенные в output/, и история запусков
+INCREMENTAL_STATE_FILE = "incremental_state.json"
+
+# Каталог изменений внутри выходной директории: deltas/<время запуска>/<таблица>.<вид>.csv
+DELTA_DIR_NAME = "deltas"
+
+# Временный каталог таблиц, собранных из новых частей
+STAGING_DIR_NAME = ".staging"
+
+# Виды строк в файлах изменений
+DELTA_KINDS = ('inserted', 'updated', 'deleted')
+
+# Таблица публикаций и дочерние таблицы со столбцом ID публикации
+WORK_GROUP = ('works', 'id', [('author_work', 'work_id'), ('work_concept', 'work_id'),
+                              ('work_source', 'work_id'), ('work_citation', 'citing_id')])
+
+# Группы таблиц сущностей: (основная таблица, столбец ключа, [(дочерняя таблица, столбец ключа)])
+def entity_groups():
+    groups = []
+    for spec in process_entities.ENTITY_SPECS:
+        key_column = next(column for column, field, _ in spec.columns if field == spec.key_field)
+        children = [(relation.table, relation.columns[0]) for relation in spec.relations]
+        if spec.closure_table:
+            children.append((spec.closure_table, TABLE_COLUMNS[spec.closure_table][0]))
+        groups.append((spec.table, key_column, children))
+    return groups
+
+def _state_path():
+    return os.path.join(process_works.OUTPUT_DIR, INCREMENTAL_STATE_FILE)
+
+def load_state():
+    path = _state_path()
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def save_state(state):
+    path = _state_path()
+    with open(path + ".tmp", 'w', encoding='utf-8') as f:
+        json.dump(state, f, ensure_ascii=False, indent=2)
+    os.replace(path + ".tmp", path)
+
+# Отпечатки частей works (размер, время изменения, запись манифеста загрузок)
+def part_fingerprints(works_dir, files):
+    manifest = DownloadManifest()
+    return {file_name: file_fingerprint(os.path.join(works_dir, file_name), manifest) for file_name in files}
+
+# Коды ID из столбца существующей таблицы CSV и число строк
+def read_table_ids(path, column):
+    ids = IdSet()
+    rows = 0
+    if not os.path.exists(path):
+        return ids, rows
+    with open(path, newline='', encoding='utf-8') as f:
+        reader = csv.reader(f)
+        index = next(reader).index(column)
+        for row in reader:
+            ids.add(row[index])
+            rows += 1
+    return ids, rows
+
+# Строки новых частей: известные публикации всегда, новые - если проходят admit и пока не исчерпан бюджет
+def budget_lines(lines, existing, budget, counts, admit=None):
+    for line in lines:
+        code = peek_id(line)
+        if code is not None and code not in existing:
+            if admit is not None and not admit(line):
+                counts['rejected'] += 1
+                continue
+            if counts['inserted'] >= budget:
+                counts['over_budget'] += 1
+                continue
+            counts['inserted'] += 1
+        yield line
+
+# Множество кодов из результата difference_codes
+def _id_set(codes):
+    return IdSet.from_sorted(codes if isinstance(codes, array) else array('q', codes.tobytes()))
+
+# Объединение двух множеств кодов
+def _union(left, right):
+    if np is not None:
+        merged = np.union1d(np.asarray(left.codes(), dtype=np.int64), np.asarray(right.codes(), dtype=np.int64))
+        return IdSet.from_sorted(array('q', merged.tobytes()))
+    return IdSet.from_sorted(array('q', sorted(set(left.codes()) | set(right.codes()))))
+
+# Применение строк таблицы из staging к таблице в output (замена строк по ключу)
+def upsert_table(output_dir, staging_dir, delta_dir, table, key_column, keys=None, single=True):
+    """Строки существующей таблицы с ключом из keys (по умолчанию - ключи строк staging)
+    заменяются строками staging, остальные переписываются как есть.
+
+    single=True - одна строка на ключ (таблица сущности): измененная строка
+    попадает в updated. Для дочерних таблиц (связи) строки сравниваются как
+    мультимножества: пропавшие - в deleted, новые - в inserted. Возвращает
+    {вид изменения: число строк}.
+    """
+    columns = TABLE_COLUMNS[table]
+    key_index = columns.index(key_column)
+    staged = {}
+    staged_path = os.path.join(staging_dir, f"{table}.csv")
+    if os.path.exists(staged_path):
+        with open(staged_path, newline='', encoding='utf-8') as f:
+            reader = csv.reader(f)
+            next(reader)
+            for row in reader:
+                staged.setdefault(row[key_index], []).append(tuple(row))
+    keys = set(staged) if keys is None else keys
+
+    table_path = os.path.join(output_dir, f"{table}.csv")
+    old = {}
+    deltas = {kind: CsvTableWriter(os.path.join(delta_dir, f"{table}.{kind}.csv"), columns) for kind in DELTA_KINDS}
+    with CsvTableWriter(table_path + ".tmp", columns) as writer:
+        if os.path.exists(table_path):
+            with open(table_path, newline='', encoding='utf-8') as f:
+                reader = csv.reader(f)
+                next(reader)
+                for row in reader:
+                    if row[key_index] in keys:
+                        old.setdefault(row[key_index], []).append(tuple(row))
+                    else:
+                        writer.write(dict(zip(columns, row)))
+
+        for key, new_rows in staged.items():
+            writer.write_rows(dict(zip(columns, row)) for row in new_rows)
+            old_rows = old.pop(key, [])
+            if single:
+                if not old_rows:
+                    deltas['inserted'].write_rows(dict(zip(columns, row)) for row in new_rows)
+                elif old_rows != new_rows:
+                    deltas['updated'].write_rows(dict(zip(columns, row)) for row in new_rows)
+            else:
+                removed = Counter(old_rows) - Counter(new_rows)
+                added = Counter(new_rows) - Counter(old_rows)
+                deltas['deleted'].write_rows(dict(zip(columns, row)) for row in removed.elements())
+                deltas['inserted'].write_rows(dict(zip(columns, row)) for row in added.elements())
+        # Ключи без строк в staging (например, у обновленной публикации больше нет ссылок)
+        for old_rows in old.values():
+            deltas['deleted'].write_rows(dict(zip(columns, row)) for row in old_rows)
+
+    os.replace(table_path + ".tmp", table_path)
+    for writer in deltas.values():
+        writer.close()
+    stats = {kind: deltas[kind].rows for kind in DELTA_KINDS}
+    logger.info(f"{table}: добавлено {stats['inserted']}, изменено {stats['updated']}, удалено {stats['deleted']}")
+    return stats
+
+# Применение группы таблиц: основная таблица и дочерние таблицы с тем же набором ключей
+def upsert_group(output_dir, staging_dir, delta_dir, group):
+    table, key_column, children = group
+    keys = set()
+    staged_path = os.path.join(staging_dir, f"{table}.csv")
+    if os.path.exists(staged_path):
+        with open(staged_path, newline='', encoding='utf-8') as f:
+            reader = csv.reader(f)
+            key_index = next(reader).index(key_column)
+            keys = {row[key_index] for row in reader}
+    stats = {table: upsert_table(output_dir, staging_dir, delta_dir, table, key_column, keys)}
+    for child, child_key in children:
+        stats[child] = upsert_table(output_dir, staging_dir, delta_dir, child, child_key, keys, single=False)
+    return stats
+
+# Полная сборка и запись состояния (первый запуск инкрементального режима)
+def full_build(works_dir, files):
+    logger.info("Состояние инкрементального режима не найдено: полная обработка всех частей")
+    consumed = []
+    process_works.process_works(consumed=consumed)
+    process_entities.process_entities()
+    # Части, не дочитанные из-за --max-works, считаются новыми в следующем запуске
+    parts = [file_name for file_name in files if file_name in set(consumed)]
+    if len(parts) < len(files):
+        logger.info(f"Частей works, не прочитанных до конца: {len(files) - len(parts)}")
+    state = {'parts': part_fingerprints(works_dir, parts), 'runs': []}
+    state['runs'].append({'time': time.strftime('%Y-%m-%d %H:%M:%S'), 'parts': parts, 'full': True})
+    save_state(state)
+
+# Отбор новых публикаций по --filter и --sample-rate (None - брать все)
+def new_work_admission():
+    """Известные публикации обновляются всегда, поэтому отбор и выборка
+    применяются только к новым. Резервуар и слои требуют прохода по всем
+    частям и к новым публикациям не применяются.
+    """
+    checks = []
+    work_filter = work_filters.compile_filter()
+    if work_filter is not None:
+        checks.append(work_filter.accept)
+    if work_sample.sampling_enabled():
+        if work_sample.needs_plan():
+            logger.warning("Резервуарная выборка и выборка по слоям не применяются к новым публикациям")
+        else:
+            checks.append(work_sample.build_sampler(None, process_works.MAX_WORKS).keep)
+    if not checks:
+        return None
+
+    # Некорректные строки передаются дальше, ошибку запишет разбор
+    def admit(line):
+        try:
+            return all(check(line) for check in checks)
+        except Exception:
+            return True
+    return admit
+
+# Разбор новых частей works в staging
+def stage_works(works_dir, new_files, staging_dir):
+    """Возвращает множества ID сущностей из разобранных публикаций и счетчики бюджета.
+
+    Отбор, выборка и подмножество по цитированиям на время разбора
+    выключаются: новые публикации проходят new_work_admission, а обновления
+    известных применяются без условий.
+    """
+    existing, existing_rows = read_table_ids(os.path.join(process_works.OUTPUT_DIR, "works.csv"), 'id')
+    budget = max(0, process_works.MAX_WORKS - existing_rows)
+    counts = {'inserted': 0, 'over_budget': 0, 'rejected': 0}
+    logger.info(f"Публикаций в output: {existing_rows}, можно добавить новых: {budget}")
+    admit = new_work_admission()
+
+    # Из новых частей берется только самая новая версия каждой публикации
+    skip = superseded_lines(process_works.DATA_DIR, "works", new_files)
+    plan = {file_name: skip_lines(iter_lines(os.path.join(works_dir, file_name)), skip.get(file_name, ()))
+            for file_name in new_files}
+    sources = ((file_name, budget_lines(lines, existing, budget, counts, admit), None) for file_name, lines in plan.items())
+
+    saved = (process_works.OUTPUT_DIR, process_works.MAX_WORKS, work_filters.WORK_FILTER, work_sample.SAMPLE_RATE,
+             work_sample.SAMPLE_RESERVOIR, citation_subset.CITATION_HOPS)
+    process_works.OUTPUT_DIR = staging_dir
+    process_works.MAX_WORKS = sys.maxsize
+    work_filters.WORK_FILTER = None
+    work_sample.SAMPLE_RATE = None
+    work_sample.SAMPLE_RESERVOIR = False
+    citation_subset.CITATION_HOPS = 0
+    try:
+        staged_ids = process_works.process_works(sources=sources, deduplicated=True)
+    finally:
+        (process_works.OUTPUT_DIR, process_works.MAX_WORKS, work_filters.WORK_FILTER, work_sample.SAMPLE_RATE,
+         work_sample.SAMPLE_RESERVOIR, citation_subset.CITATION_HOPS) = saved
+    if counts['rejected']:
+        logger.info(f"Новых публикаций не прошло отбор или выборку: {counts['rejected']}")
+    if counts['over_budget']:
+        logger.info(f"Новых публикаций сверх --max-works пропущено: {counts['over_budget']}")
+    return staged_ids, counts
+
+# Поиск в дампах сущностей только новых ID
+def stage_entities(staged_ids, staging_dir):
+    """Возвращает объединенные множества ID (для entity_ids.bin) и отчет о ненайденных ID."""
+    existing_path = os.path.join(process_works.OUTPUT_DIR, ENTITY_IDS_FILE)
+    existing = load_entity_ids_file(existing_path) if os.path.exists(existing_path) else None
+    union_ids = {}
+    new_ids = {}
+    for key, ids in staged_ids.items():
+        if key == 'publisher_names':
+            old = existing['publisher_names'] if existing else set()
+            new_ids[key] = ids - old
+            union_ids[key] = old | ids
+        else:
+            old = existing[key] if existing else IdSet()
+            new_ids[key] = _id_set(difference_codes(ids, old)) if len(ids) else IdSet()
+            union_ids[key] = _union(old, ids)
+    logger.info("Новые ID сущностей: " + ", ".join(f"{key}={len(ids)}" for key, ids in new_ids.items()))
+
+    # Запрашиваются только новые ID, а связи фильтруются по всем известным ID
+    reports = {}
+    for spec in process_entities.ENTITY_SPECS:
+        entity_ids = dict(union_ids, **{spec.ids_key: new_ids[spec.ids_key]})
+        remaining = run_entity_scan(spec, entity_ids, process_entities.DATA_DIR, staging_dir,
+                                    limit=process_entities.entity_limit(spec), use_index=process_entities.USE_ENTITY_INDEX)
+        reports[spec.name] = remaining.report()
+    return union_ids, reports
+
+# Инкрементальная обработка новых частей works
+def run_incremental():
+    """Первый запуск выполняет полную обработку и записывает состояние. В
+    следующих запусках разбираются только новые или измененные части works,
+    их строки применяются к таблицам output/ как замена по ключу, а в дампах
+    сущностей ищутся только новые ID. Изменения каждой таблицы сохраняются в
+    output/deltas/<время>/<таблица>.{inserted,updated,deleted}.csv.
+    """
+    start_time = time.time()
+    output_dir = process_works.OUTPUT_DIR
+    if table_writers.OUTPUT_FORMAT != "csv":
+        logger.error("Инкрементальный режим поддерживает только --output-format csv")
+        return None
+    works_dir = os.path.join(process_works.DATA_DIR, "works")
+    if not os.path.exists(works_dir):
+        logger.error(f"Директория {works_dir} не найдена. Убедитесь, что данные были загружены.")
+        return None
+    files = process_works.list_work_files(works_dir)
+
+    state = load_state()
+    if state is None:
+        full_build(works_dir, files)
+        return None
+
+    fingerprints = part_fingerprints(works_dir, files)
+    new_files = [file_name for file_name in files if state['parts'].get(file_name) != fingerprints[file_name]]
+    if not new_files:
+        logger.info("Новых частей works нет, output/ не изменен")
+        return None
+    logger.info(f"Новые или измененные части works: {', '.join(new_files)}")
+
+    run_name = time.strftime('%Y%m%d-%H%M%S')
+    delta_dir = os.path.join(output_dir, DELTA_DIR_NAME, run_name)
+    staging_dir = os.path.join(output_dir, STAGING_DIR_NAME)
+    shutil.rmtree(staging_dir, ignore_errors=True)
+    os.makedirs(delta_dir, exist_ok=True)
+    os.makedirs(staging_dir)
+    try:
+        staged_ids, counts = stage_works(works_dir, new_files, staging_dir)
+        union_ids, reports = stage_entities(staged_ids, staging_dir)
+
+        stats = upsert_group(output_dir, staging_dir, delta_dir, WORK_GROUP)
+        for group in entity_groups():
+            stats.update(upsert_group(output_dir, staging_dir, delta_dir, group))
+
+        save_entity_ids(os.path.join(output_dir, ENTITY_IDS_FILE),
+                        {key: ids for key, ids in union_ids.items() if key != 'publisher_names'},
+                        union_ids['publisher_names'])
+        with open(os.path.join(delta_dir, process_entities.MISSING_ENTITIES_FILE), 'w', encoding='utf-8') as f:
+            json.dump(reports, f, ensure_ascii=False, indent=2)
+    finally:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+
+    for file_name in new_files:
+        state['parts'][file_name] = fingerprints[file_name]
+    run = {'time': time.strftime('%Y-%m-%d %H:%M:%S'), 'parts': new_files, 'delta_dir': os.path.join(DELTA_DIR_NAME, run_name),
+           'new_works': counts['inserted'], 'over_budget': counts['over_budget'], 'rejected': counts['rejected'],
+           'tables': stats}
+    state['runs'].append(run)
+    save_state(state)
+    logger.info(f"Изменения сохранены в {delta_dir}")
+    logger.info(f"Инкрементальная обработка завершена за {time.time() - start_time:.2f} секунд")
+    return run
@@ -0,0 +1,132 @@
+import os
+import gzip
+import zlib
+import shutil
+import subprocess
+
+# Порядок выбора распаковщика .gz: первый доступный из списка
+GZIP_BACKEND_PRIORITY = ("isal", "zlib-ng", "pigz", "gzip")
+
+# Явный выбор распаковщика через переменную окружения (isal, zlib-ng, pigz или gzip)
+GZIP_BACKEND = os.environ.get("SEMOPENALEX_GZIP_BACKEND")
+
+# Размер блока распакованных данных, который делится на строки за один раз
+READ_BUFFER_SIZE = 4 * 1024 * 1024
+
+# Открытие .gz-файла на чтение указанным распаковщиком (None, если он не установлен)
+def _open_with(name, path):
+    if name == "isal":
+        try:
+            from isal import igzip_threaded
+        except ImportError:
+            return None
+        # Распаковка ISA-L в отдельном потоке, параллельно с разбором строк
+        return igzip_threaded.open(path, 'rb', threads=1)
+    if name == "zlib-ng":
+        try:
+            from zlib_ng import gzip_ng
+        except ImportError:
+            return None
+        return gzip_ng.open(path, 'rb')
+    if name == "pigz":
+        pigz = shutil.which("pigz")
+        if pigz is None:
+            return None
+        return _PigzReader(pigz, path)
+    if name == "gzip":
+        return gzip.open(path, 'rb')
+    raise ValueError(f"Неизвестный распаковщик gzip: {name}")
+
+# Чтение вывода `pigz -dc` как файла
+class _PigzReader:
+    def __init__(self, pigz, path):
+        self.path = path
+        self.eof = False
+        self.process = subprocess.Popen([pigz, "-dc", path], stdout=subprocess.PIPE, bufsize=READ_BUFFER_SIZE)
+
+    def read(self, size=-1):
+        data = self.process.stdout.read(size)
+        if not data:
+            self.eof = True
+        return data
+
+    def close(self):
+        self.process.stdout.close()
+        if not self.eof:
+            # Файл дочитан не до конца: останавливаем распаковку
+            self.process.terminate()
+        returncode = self.process.wait()
+        if self.eof and returncode != 0:
+            raise OSError(f"pigz завершился с кодом {returncode} для {self.path}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+# Название распаковщика, который будет использован для чтения
+def get_gzip_backend():
+    names = [GZIP_BACKEND] if GZIP_BACKEND else GZIP_BACKEND_PRIORITY
+    for name in names:
+        if name == "isal" and _module_available("isal"):
+            return name
+        if name == "zlib-ng" and _module_available("zlib_ng"):
+            return name
+        if name == "pigz" and shutil.which("pigz"):
+            return name
+        if name == "gzip":
+            return name
+    raise ImportError(f"Распаковщик gzip '{GZIP_BACKEND}' не установлен")
+
+def _module_available(module):
+    try:
+        __import__(module)
+        return True
+    except ImportError:
+        return False
+
+# Открытие .jsonl.gz на чтение в бинарном режиме самым быстрым доступным распаковщиком
+def open_gzip(path, backend=None):
+    return _open_with(backend or get_gzip_backend(), path)
+
+# Объект потоковой распаковки gzip (для данных из сети)
+def decompressobj():
+    backend = get_gzip_backend()
+    if backend == "isal":
+        from isal import isal_zlib
+        return isal_zlib.decompressobj(wbits=31)
+    if backend == "zlib-ng":
+        from zlib_ng import zlib_ng
+        return zlib_ng.decompressobj(wbits=31)
+    return zlib.decompressobj(wbits=31)
+
+# Построчное чтение .jsonl.gz: распакованные данные читаются крупными блоками и делятся на строки
+def iter_lines(path, buffer_size=READ_BUFFER_SIZE, backend=None):
+    """Возвращает непустые строки файла в виде bytes (без завершающего перевода строки)."""
+    with open_gzip(path, backend=backend) as f:
+        pending = b''
+        while True:
+            block = f.read(buffer_size)
+            if not block:
+                break
+            lines = (pending + block).split(b'\n')
+            pending = lines.pop()
+            for line in lines:
+                if line:
+                    yield line
+        if pending.strip():
+            yield pending
+
+# Строки без позиций из skip (номера непустых строк файла по возрастанию, как их нумерует iter_lines)
+def skip_lines(lines, skip):
+    skip = iter(skip)
+    next_skip = next(skip, None)
+    if next_skip is None:
+        yield from lines
+        return
+    for position, line in enumerate(lines):
+        if position == next_skip:
+            next_skip = next(skip, None)
+            continue
+        yield line
@@ -0,0 +1,56 @@
+import os
+import json
+
+# Порядок выбора декодера JSON: первый доступный из списка
+BACKEND_PRIORITY = ("orjson", "msgspec", "json")
+
+# Явный выбор декодера через переменную окружения (orjson, msgspec или json)
+JSON_BACKEND = os.environ.get("SEMOPENALEX_JSON_BACKEND")
+
+# Создание функции декодирования для указанного декодера (None, если он не установлен)
+def _make_decoder(name):
+    if name == "orjson":
+        try:
+            import orjson
+        except ImportError:
+            return None
+        return orjson.loads
+    if name == "msgspec":
+        try:
+            import msgspec
+        except ImportError:
+            return None
+        return msgspec.json.Decoder().decode
+    if name == "json":
+        return json.loads
+    raise ValueError(f"Неизвестный декодер JSON: {name}")
+
+# Список установленных декодеров
+def available_backends():
+    return [name for name in BACKEND_PRIORITY if _make_decoder(name) is not None]
+
+# Функция декодирования строки JSON (bytes или str) выбранным декодером
+def get_decoder(name=None):
+    """Возвращает (имя декодера, функция loads).
+
+    Быстрые декодеры строже stdlib (например, к одиночным суррогатам в строках),
+    поэтому при ошибке строка повторно разбирается через json.loads.
+    """
+    names = [name] if name else BACKEND_PRIORITY
+    for backend in names:
+        fast_loads = _make_decoder(backend)
+        if fast_loads is None:
+            continue
+        if fast_loads is json.loads:
+            return backend, json.loads
+
+        def loads(line, _fast_loads=fast_loads):
+            try:
+                return _fast_loads(line)
+            except Exception:
+                return json.loads(line)
+
+        return backend, loads
+    raise ImportError(f"Декодер JSON '{name}' не установлен")
+
+BACKEND, loads = get_decoder(JSON_BACKEND)
@@ -6,6 +6,8 @@ from download_data import download_data
 from process_works import process_works
 from process_entities import process_entities
 from check_dataset import check_dataset
+from plan_dataset import plan_dataset, planned_work_parts
+from stream_works import stream_works
 
 # Настройка логирования
 logging.basicConfig(
@@ -40,7 +42,41 @@ def main():
     parser.add_argument('--skip-entities', action='store_true', help='Пропустить обработку связанных сущностей')
     parser.add_argument('--skip-check', action='store_true', help='Пропустить проверку датасета')
     parser.add_argument('--max-works', type=int, default=100000, help='Максимальное количество публикаций для обработки')
+    parser.add_argument('--workers', type=int, default=1, help='Количество процессов для разбора файлов works')
+    parser.add_argument('--download-workers', type=int, default=8, help='Количество параллельных потоков загрузки')
+    parser.add_argument('--target-gb', type=float, default=None, help='Целевой объем датасета в ГБ: подобрать части works и --max-works до загрузки')
+    parser.add_argument('--stream', action='store_true', help='Разбирать works во время загрузки, без сохранения на диск')
+    parser.add_argument('--stream-tee', action='store_true', help='В потоковом режиме дополнительно сохранять сжатые части works на диск')
+    parser.add_argument('--output-format', choices=['csv', 'parquet'], default='csv', help='Формат выходных таблиц')
+    parser.add_argument('--row-group-size', type=int, default=100000, help='Количество строк в группе строк Parquet')
+    parser.add_argument('--partition-by-year', action='store_true', help='Разбить works и связи публикаций на каталоги по году (только parquet)')
+    parser.add_argument('--roaring-ids', action='store_true', help='Сжимать файл ID связанных сущностей roaring-битовыми картами (нужен pyroaring)')
+    parser.add_argument('--entity-workers', type=int, default=1, help='Количество процессов для обработки связанных сущностей')
+    parser.add_argument('--entity-index', action='store_true', help='Читать сущности по индексу data/index вместо полного чтения частей (индекс строится при первом запуске)')
+    parser.add_argument('--incremental', action='store_true', help='Обработать только новые части works и применить их к output/ с файлами изменений (только csv)')
+    parser.add_argument('--dedup-works', action='store_true', help='Оставлять только самую новую версию каждой публикации из всех частей и убирать повторы связей')
+    parser.add_argument('--citation-hops', type=int, default=0, help='Расширить выбранные публикации на K шагов по цитированиям (бюджет - --max-works)')
+    parser.add_argument('--citation-direction', choices=['references', 'cited_by', 'both'], default='references', help='Направление расширения по цитированиям')
+    parser.add_argument('--citation-seeds', type=int, default=None, help='Количество исходных публикаций для --citation-hops (по умолчанию 10%% от --max-works)')
+    parser.add_argument('--filter', default=None, help="Отбирать публикации по выражению, например \"publication_year >= 2020 and type == 'article'\"")
+    sample = parser.add_mutually_exclusive_group()
+    sample.add_argument('--sample-rate', type=float, default=None, help='Брать долю публикаций по хешу ID (например, 0.01) вместо первых --max-works')
+    sample.add_argument('--sample-reservoir', action='store_true', help='Брать ровно --max-works публикаций с наименьшими хешами ID из всех частей')
+    parser.add_argument('--sample-seed', type=int, default=0, help='Зерно хеша выборки: одно зерно дает одну и ту же выборку')
+    parser.add_argument('--sample-stratify', choices=['publication_year', 'type'], default=None, help='Выборка по слоям: доля каждого года или типа как во всех частях')
+    parser.add_argument('--resume', action='store_true', help='Продолжить прерванную обработку works и сущностей с последней контрольной точки (только csv)')
+    parser.add_argument('--checkpoint-interval', type=int, default=300, help='Интервал между контрольными точками в секундах (0 - не сохранять)')
+    parser.add_argument('--no-manifest', action='store_true', help='Искать части перебором HEAD-запросами вместо манифеста OpenAlex')
     args = parser.parse_args()
+    if args.sample_rate is not None and not 0 < args.sample_rate <= 1:
+        parser.error("--sample-rate должен быть в интервале (0, 1]")
+    if args.filter:
+        # Выражение проверяется сразу, до загрузки и разбора
+        import work_filter
+        try:
+            work_filter.compile_filter(args.filter)
+        except ValueError as e:
+            parser.error(str(e))
     
     start_time = time.time()
     logger.info("Начало создания датасета SemOpenAlex")
@@ -48,11 +84,39 @@ def main():
     # Определяем, интерактивный режим или нет
     interactive_mode = not args.non_interactive
     
+    # Формат выходных таблиц для шагов 2 и 3
+    import table_writers
+    table_writers.OUTPUT_FORMAT = args.output_format
+    table_writers.PARQUET_ROW_GROUP_SIZE = args.row_group_size
+    table_writers.PARTITION_BY_YEAR = args.partition_by_year
+    if args.partition_by_year and args.output_format != 'parquet':
+        logger.warning("--partition-by-year действует только с --output-format parquet")
+    
+    # Контрольные точки шагов 2 и 3 и продолжение после прерывания
+    import checkpoint
+    checkpoint.RESUME = args.resume
+    checkpoint.CHECKPOINT_SECONDS = args.checkpoint_interval
+    if args.resume and args.output_format != 'csv':
+        logger.warning("--resume поддерживается только с --output-format csv, обработка начнется заново")
+    if args.resume and args.stream and not args.skip_works:
+        logger.warning("Потоковый разбор works не продолжается с контрольной точки, публикации будут обработаны заново")
+    
+    # Планирование объема: выбор частей works и --max-works под целевой размер
+    plan = None
+    if args.target_gb:
+        logger.info(f"Планирование датасета объемом {args.target_gb} ГБ")
+        plan = plan_dataset(args.target_gb)
+        if plan:
+            args.max_works = plan['target']['max_works']
+            logger.info(f"По плану будет обработано до {args.max_works} публикаций")
+    
     # Шаг 1: Загрузка данных из OpenAlex S3
     if not args.skip_download:
         if not interactive_mode or get_user_confirmation("Загрузка данных из OpenAlex S3") is True:
             logger.info("Шаг 1: Загрузка данных из OpenAlex S3")
-            download_data()
+            # В потоковом режиме works загружаются на шаге 2 одновременно с разбором
+            download_data(workers=args.download_workers, use_manifest=not args.no_manifest, plan=plan,
+                          exclude=('works',) if args.stream else ())
             logger.info("Шаг 1 завершен: Данные загружены из OpenAlex S3")
         else:
             logger.info("Шаг 1: Загрузка данных пропущена по запросу пользователя")
@@ -66,7 +130,37 @@ def main():
             # Изменение максимального количества публикаций
             import process_works
             process_works.MAX_WORKS = args.max_works
-            process_works.process_works()
+            process_works.WORKERS = args.workers
+            process_works.DEDUP_WORKS = args.dedup_works
+            if plan:
+                # Обрабатываются только части, выбранные планом объема
+                process_works.WORK_PARTS = planned_work_parts(plan)
+            import entity_ids_file
+            entity_ids_file.ENTITY_IDS_ROARING = args.roaring_ids
+            import citation_subset
+            citation_subset.CITATION_HOPS = args.citation_hops
+            citation_subset.CITATION_DIRECTION = args.citation_direction
+            citation_subset.SEED_WORKS = args.citation_seeds
+            import work_filter
+            work_filter.WORK_FILTER = args.filter
+            import work_sample
+            work_sample.SAMPLE_RATE = args.sample_rate
+            work_sample.SAMPLE_RESERVOIR = args.sample_reservoir
+            work_sample.SAMPLE_SEED = args.sample_seed
+            work_sample.SAMPLE_STRATIFY = args.sample_stratify
+            if args.sample_stratify and not work_sample.sampling_enabled():
+                logger.warning("--sample-stratify действует только с --sample-rate или --sample-reservoir")
+            if args.incremental:
+                # Шаги 2 и 3 для новых частей: публикации, новые ID сущностей и файлы изменений
+                import incremental
+                import process_entities
+                process_entities.USE_ENTITY_INDEX = args.entity_index
+                process_entities.ENTITY_WORKERS = args.entity_workers
+                incremental.run_incremental()
+            elif args.stream:
+                stream_works(tee=args.stream_tee)
+            else:
+                process_works.process_works()
             logger.info("Шаг 2 завершен: Публикации обработаны")
         else:
             logger.info("Шаг 2: Обработка публикаций пропущена по запросу пользователя")
@@ -74,10 +168,15 @@ def main():
         logger.info("Шаг 2: Обработка публикаций пропущена (--skip-works)")
     
     # Шаг 3: Обработка связанных сущностей
-    if not args.skip_entities:
+    if args.incremental and not args.skip_works:
+        logger.info("Шаг 3: Связанные сущности обработаны в инкрементальном режиме на шаге 2")
+    elif not args.skip_entities:
         if not interactive_mode or get_user_confirmation("Обработка связанных сущностей") is True:
             logger.info("Шаг 3: Обработка связанных сущностей")
-            process_entities()
+            import process_entities
+            process_entities.USE_ENTITY_INDEX = args.entity_index
+            process_entities.ENTITY_WORKERS = args.entity_workers
+            process_entities.process_entities()
             logger.info("Шаг 3 завершен: Связанные сущности обработаны")
         else:
             logger.info("Шаг 3: Обработка связанных сущностей пропущена по запросу пользователя")
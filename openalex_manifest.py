@@ -0,0 +1,106 @@
+import os
+import re
+import json
+import time
+import logging
+import requests
+
+logger = logging.getLogger("manifest")
+
+# Локальный кэш манифестов OpenAlex и время его жизни
+MANIFEST_CACHE_DIR = "data/manifests"
+MANIFEST_TTL_SECONDS = 24 * 3600
+
+# План загрузки, общий для загрузчика и последующих шагов обработки
+DOWNLOAD_PLAN_PATH = "data/download_plan.json"
+
+# Путь части в манифесте: .../<entity>/updated_date=YYYY-MM-DD/part_NNN.gz
+PART_URL_PATTERN = re.compile(r"/(updated_date=[^/]+)/part_(\d+)\.gz$")
+
+# Преобразование s3://openalex/data/... в HTTP-адрес относительно base_url
+def s3_url_to_http(url, base_url):
+    if url.startswith("s3://"):
+        path = url.split("/data/", 1)[1]
+        return base_url + path
+    return url
+
+# Загрузка манифеста сущности (с кэшированием на диске)
+def fetch_entity_manifest(entity, base_url, session=None, ttl=MANIFEST_TTL_SECONDS):
+    """Возвращает манифест сущности OpenAlex или None, если он недоступен."""
+    os.makedirs(MANIFEST_CACHE_DIR, exist_ok=True)
+    cache_path = os.path.join(MANIFEST_CACHE_DIR, f"{entity}.json")
+
+    cached = None
+    if os.path.exists(cache_path):
+        try:
+            with open(cache_path, "r") as f:
+                cached = json.load(f)
+        except Exception as e:
+            logger.warning(f"Не удалось прочитать кэш манифеста {cache_path}: {str(e)}")
+        if cached is not None and time.time() - os.path.getmtime(cache_path) < ttl:
+            logger.info(f"Манифест '{entity}' взят из кэша {cache_path}")
+            return cached
+
+    http = session or requests
+    url = f"{base_url}{entity}/manifest"
+    try:
+        response = http.get(url, timeout=30)
+        response.raise_for_status()
+        manifest = response.json()
+    except Exception as e:
+        if cached is not None:
+            logger.warning(f"Не удалось обновить манифест {url}: {str(e)}. Используется устаревший кэш")
+            return cached
+        logger.warning(f"Манифест {url} недоступен: {str(e)}")
+        return None
+
+    tmp_path = cache_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, cache_path)
+    logger.info(f"Манифест '{entity}' загружен: {len(manifest.get('entries', []))} частей")
+    return manifest
+
+# Разбор записей манифеста в список частей с датой, номером и размером
+def parse_manifest_entries(manifest, base_url):
+    parts = []
+    for entry in manifest.get("entries", []):
+        match = PART_URL_PATTERN.search(entry.get("url", ""))
+        if not match:
+            continue
+        meta = entry.get("meta", {})
+        parts.append({
+            'date': match.group(1),
+            'part': int(match.group(2)),
+            'url': s3_url_to_http(entry["url"], base_url),
+            'content_length': meta.get("content_length"),
+            'record_count': meta.get("record_count")
+        })
+    return sorted(parts, key=lambda p: (p['date'], p['part']))
+
+# Сохранение плана загрузки
+def save_download_plan(plan, path=DOWNLOAD_PLAN_PATH):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(plan, f, indent=2)
+    os.replace(tmp_path, path)
+    logger.info(f"План загрузки сохранен в {path}")
+
+# Загрузка плана загрузки (None, если план еще не построен)
+def load_download_plan(path=DOWNLOAD_PLAN_PATH):
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except Exception as e:
+        logger.warning(f"Не удалось прочитать план загрузки {path}: {str(e)}")
+        return None
+
+# Части сущности из плана, проиндексированные по имени локального файла
+def get_plan_entries(entity, plan=None):
+    plan = plan if plan is not None else load_download_plan()
+    if not plan:
+        return {}
+    return {os.path.basename(item['output_path']): item for item in plan.get('entities', {}).get(entity, [])}
@@ -0,0 +1,156 @@
+import os
+import io
+import csv
+import math
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from download_data import ENTITIES, DOWNLOAD_WORKERS, create_session, build_download_plan
+from openalex_manifest import save_download_plan
+from process_works import extract_work, WORK_TABLES
+from works_view import decode_work
+from input_reader import iter_lines, decompressobj
+from table_writers import TABLE_COLUMNS
+
+logger = logging.getLogger("planner")
+
+# Целевой объем датасета по умолчанию (ГБ)
+DEFAULT_TARGET_GB = 10
+
+# Количество первых записей каждой части, по которым оценивается объем CSV
+SAMPLE_RECORDS = 1000
+
+# Средний размер строки CSV связанных сущностей в байтах (по ранее собранным датасетам)
+AVG_ENTITY_ROW_BYTES = {
+    'author_ids': 60 + 25,       # authors.csv + author_institution.csv
+    'institution_ids': 80,
+    'concept_ids': 60 + 20 + 40, # concepts.csv + concept_ancestor.csv + concept_closure.csv
+    'source_ids': 70 + 25,       # sources.csv + source_publisher.csv
+    'publisher_names': 50
+}
+
+# Размер строки CSV в байтах (UTF-8, как при записи выходных файлов)
+def csv_row_bytes(row, columns):
+    buffer = io.StringIO()
+    csv.writer(buffer).writerow(['' if row.get(c) is None else row.get(c) for c in columns])
+    return len(buffer.getvalue().encode('utf-8'))
+
+# Первые n строк части: из локального файла, если он уже загружен, иначе из начала HTTP-потока
+def read_part_head(item, n, session):
+    lines = []
+    if os.path.exists(item['output_path']):
+        for line in iter_lines(item['output_path']):
+            lines.append(line)
+            if len(lines) >= n:
+                break
+        return lines
+
+    decompressor = decompressobj()
+    pending = b''
+    response = session.get(item['url'], stream=True, timeout=60)
+    try:
+        response.raise_for_status()
+        for chunk in response.iter_content(chunk_size=64 * 1024):
+            pending += decompressor.decompress(chunk)
+            *complete, pending = pending.split(b'\n')
+            lines.extend(line for line in complete if line)
+            if len(lines) >= n:
+                break
+    finally:
+        # Закрываем соединение, не дочитывая файл до конца
+        response.close()
+    return lines[:n]
+
+# Оценка среднего объема CSV на одну публикацию по выборке записей части
+def sample_part(item, n, session):
+    table_bytes = {table: 0 for table in WORK_TABLES}
+    entity_ids = {key: set() for key in AVG_ENTITY_ROW_BYTES}
+    sampled = 0
+    for line in read_part_head(item, n, session):
+        try:
+            record = extract_work(decode_work(line))
+        except Exception:
+            continue
+        if record is None:
+            continue
+        sampled += 1
+        table_bytes['works'] += csv_row_bytes(record['work'], TABLE_COLUMNS['works'])
+        for table in ('author_work', 'work_concept', 'work_source', 'work_citation'):
+            for row in record[table]:
+                table_bytes[table] += csv_row_bytes(row, TABLE_COLUMNS[table])
+        for key in entity_ids:
+            entity_ids[key].update(record[key])
+
+    if not sampled:
+        return None
+    # Сущности оцениваются линейно по доле уникальных ID в выборке: это верхняя
+    # оценка, так как авторы и источники повторяются между публикациями
+    entity_bytes = sum(len(ids) * AVG_ENTITY_ROW_BYTES[key] for key, ids in entity_ids.items())
+    return {
+        'sampled_records': sampled,
+        'bytes_per_work': (sum(table_bytes.values()) + entity_bytes) / sampled,
+        'table_bytes_per_work': {table: size / sampled for table, size in table_bytes.items()}
+    }
+
+# Основная функция планирования объема датасета
+def plan_dataset(target_gb, sample_records=SAMPLE_RECORDS, save=True):
+    """Подбирает части works и значение --max-works, дающие CSV объемом около target_gb.
+
+    Возвращает словарь с планом загрузки, значением max_works и оценкой объема,
+    либо None, если манифест works недоступен. Выбранные части загружает
+    download_data, а обрабатывает process_works (см. planned_work_parts).
+    """
+    target_bytes = target_gb * 1024 ** 3
+    with create_session() as session:
+        # Кандидаты: все части works за VALID_DATES, без лимита частей на дату
+        plan = build_download_plan(session=session, entities=dict(ENTITIES, works=None))
+        candidates = sorted(plan['entities'].get('works', []), key=lambda item: os.path.basename(item['output_path']))
+        if not candidates:
+            logger.error("Манифест works недоступен: планирование объема невозможно")
+            return None
+
+        logger.info(f"Оценка объема по первым {sample_records} записям {len(candidates)} частей works")
+        with ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS) as executor:
+            samples = list(executor.map(lambda item: sample_part(item, sample_records, session), candidates))
+
+    selected = []
+    max_works = 0
+    estimated_bytes = 0.0
+    for item, sample in zip(candidates, samples):
+        if sample is None or not item.get('record_count'):
+            logger.warning(f"Не удалось оценить часть {item['filename']}, она пропущена")
+            continue
+        item['estimated_bytes_per_work'] = sample['bytes_per_work']
+        selected.append(item)
+
+        part_bytes = sample['bytes_per_work'] * item['record_count']
+        if estimated_bytes + part_bytes >= target_bytes:
+            # Последнюю часть используем только до достижения целевого объема
+            needed = math.ceil((target_bytes - estimated_bytes) / sample['bytes_per_work'])
+            max_works += needed
+            estimated_bytes += needed * sample['bytes_per_work']
+            break
+        max_works += item['record_count']
+        estimated_bytes += part_bytes
+    else:
+        logger.warning(f"Доступных частей works недостаточно для {target_gb} ГБ: оценка {estimated_bytes / 1024 ** 3:.2f} ГБ")
+
+    plan['entities']['works'] = selected
+    plan['target'] = {
+        'target_gb': target_gb,
+        'max_works': max_works,
+        'estimated_gb': estimated_bytes / 1024 ** 3,
+        'sample_records': sample_records
+    }
+    if save:
+        save_download_plan(plan)
+
+    logger.info(f"План объема: {len(selected)} частей works, --max-works {max_works}, оценка {estimated_bytes / 1024 ** 3:.2f} ГБ")
+    return plan
+
+# Имена частей works, выбранных планом (для process_works.WORK_PARTS)
+def planned_work_parts(plan):
+    return [os.path.basename(item['output_path']) for item in plan['entities'].get('works', [])]
+
+if __name__ == "__main__":
+    plan_dataset(DEFAULT_TARGET_GB)
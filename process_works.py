@@ -1,11 +1,24 @@
 import os
-import json
-import gzip
 import logging
-import pandas as pd
+import shutil
+from array import array
 from tqdm import tqdm
 import time
+from itertools import islice
+from multiprocessing import Pool
 from collections import defaultdict, Counter
+from openalex_manifest import get_plan_entries
+from json_decoder import BACKEND as JSON_BACKEND
+from works_view import decode_work, is_mapping, view_enabled
+from input_reader import iter_lines, skip_lines, get_gzip_backend
+from table_writers import open_table_writer, CsvTableWriter, TABLE_COLUMNS
+from id_codec import IdSet, encode_id
+from entity_index import open_superseded_index
+from entity_ids_file import save_entity_ids, load_entity_ids_file, ENTITY_IDS_FILE, LEGACY_ENTITY_IDS_FILE
+from checkpoint import Checkpoint, clear_checkpoints
+import citation_subset
+import work_sample
+import work_filter as work_filters
 
 # Настройка логирования
 logging.basicConfig(
@@ -25,39 +38,172 @@ OUTPUT_DIR = "output"
 # Максимальное количество публикаций для обработки
 MAX_WORKS = 100_000
 
+# Количество процессов для разбора файлов works (1 - последовательная обработка)
+WORKERS = 1
+
+# Оставлять только самую новую версию каждой публикации из всех частей и убирать повторы связей
+DEDUP_WORKS = False
+
+# Части works, выбранные планом объема (--target-gb); None - все локальные части
+WORK_PARTS = None
+
+# Выходные таблицы и множества ID связанных сущностей, которые формирует extract_work
+WORK_TABLES = ('works', 'author_work', 'work_concept', 'work_source', 'work_citation')
+ENTITY_ID_KEYS = ('author_ids', 'concept_ids', 'institution_ids', 'source_ids', 'publisher_names')
+
+# Колонки, по которым строки связей считаются повторами внутри одной публикации
+RELATION_KEYS = {'author_work': 'author_id', 'work_concept': 'concept_id', 'work_source': 'source_id',
+                 'work_citation': 'cited_id'}
+
 # Создание директории для выходных файлов
 def create_output_directory():
     os.makedirs(OUTPUT_DIR, exist_ok=True)
     logger.info(f"Создана директория для выходных файлов: {OUTPUT_DIR}")
 
-# Функция для обработки публикаций (works)
-def process_works():
-    create_output_directory()
+# Список файлов works в порядке обработки (только WORK_PARTS, если они заданы)
+def list_work_files(works_dir):
+    # Ищем файлы с паттерном updated_date_YYYY-MM-DD.jsonl.gz
+    work_files = sorted([f for f in os.listdir(works_dir) if f.startswith("updated_date_") and f.endswith(".jsonl.gz")])
     
-    # Множества для хранения ID связанных сущностей
-    author_ids = set()
-    concept_ids = set()
-    institution_ids = set()
-    source_ids = set()
-    publisher_names = set()
+    if not work_files:
+        # Если файлы с новым паттерном не найдены, попробуем старый паттерн
+        work_files = sorted([f for f in os.listdir(works_dir) if f.startswith("part_") and f.endswith(".jsonl.gz")])
     
-    # Словари для хранения связей
-    author_work_relations = []
-    work_concept_relations = []
-    work_source_relations = []
-    work_citation_relations = []
+    if WORK_PARTS is not None:
+        planned = set(WORK_PARTS)
+        work_files = [f for f in work_files if f in planned]
+    return work_files
+
+# Извлечение строк всех выходных таблиц и ID связанных сущностей из одной публикации
+def extract_work(work, dedup=False):
+    """Возвращает словарь со строкой works, строками связей и ID сущностей или None, если у публикации нет ID.
+
+    work - словарь или WorkView из works_view.py. dedup=True - повторы
+    связей (один автор дважды, повтор в referenced_works) записываются один раз.
+    """
+    work_id = work.get('id')
+    if not work_id:
+        return None
     
-    # Список для хранения данных о публикациях
-    works_data = []
+    record = {
+        'work': {
+            'id': work_id,
+            'title': work.get('title', ''),
+            'publication_year': work.get('publication_year'),
+            'doi': work.get('doi', ''),
+            'cited_by_count': work.get('cited_by_count', 0),
+            'type': work.get('type')
+        },
+        'author_work': [],
+        'work_concept': [],
+        'work_source': [],
+        'work_citation': [],
+        'author_ids': [],
+        'institution_ids': [],
+        'concept_ids': [],
+        'source_ids': [],
+        'publisher_names': []
+    }
     
-    # Счетчики
-    processed_works = 0
-    filtered_works = 0
-    start_time = time.time()
+    # Обработка source (источника)
+    # Проверяем оба возможных места для source_id
+    host_venue = work.get('host_venue', {})
+    primary_location = work.get('primary_location', {})
+    record['host_venue'] = host_venue
     
-    # Счетчик типов публикаций
-    type_counter = Counter()
+    # Получаем source_id из host_venue или primary_location.source
+    source_id = None
+    publisher = None
+    
+    # Проверяем host_venue
+    if host_venue and is_mapping(host_venue):
+        source_id = host_venue.get('id')
+        publisher = host_venue.get('publisher')
+    
+    # Если не нашли в host_venue, проверяем primary_location.source
+    if not source_id and primary_location and is_mapping(primary_location):
+        source = primary_location.get('source', {})
+        if source and is_mapping(source):
+            source_id = source.get('id')
+            publisher = source.get('publisher')
+    
+    # Если нашли source_id, добавляем связь
+    if source_id:
+        record['source_ids'].append(source_id)
+        record['work_source'].append({
+            'work_id': work_id,
+            'source_id': source_id
+        })
+        
+        # Добавляем издателя, если он есть
+        if publisher:
+            record['publisher_names'].append(publisher)
+    
+    # Обработка авторов
+    authorships = work.get('authorships', [])
+    for authorship in authorships:
+        author = authorship.get('author', {})
+        author_id = author.get('id')
+        if author_id:
+            record['author_ids'].append(author_id)
+            record['author_work'].append({
+                'author_id': author_id,
+                'work_id': work_id
+            })
+            
+            # Извлечение организаций
+            institutions = authorship.get('institutions', [])
+            for institution in institutions:
+                institution_id = institution.get('id')
+                if institution_id:
+                    record['institution_ids'].append(institution_id)
+    
+    # Обработка концепций
+    concepts = work.get('concepts', [])
+    for concept in concepts:
+        concept_id = concept.get('id')
+        if concept_id:
+            record['concept_ids'].append(concept_id)
+            record['work_concept'].append({
+                'work_id': work_id,
+                'concept_id': concept_id,
+                'score': concept.get('score', 0)
+            })
+    
+    # Обработка цитирований
+    referenced_works = work.get('referenced_works', [])
+    for cited_id in referenced_works:
+        if cited_id:
+            record['work_citation'].append({
+                'citing_id': work_id,
+                'cited_id': cited_id
+            })
     
+    if dedup:
+        dedup_relations(record)
+    
+    return record
+
+# Удаление повторов строк связей внутри публикации (остается первая строка)
+def dedup_relations(record):
+    for table, key in RELATION_KEYS.items():
+        rows = record[table]
+        if len(rows) > 1:
+            seen = set()
+            record[table] = [row for row in rows if not (row[key] in seen or seen.add(row[key]))]
+
+# Запись строк публикации в таблицы (год - для разбиения Parquet по годам) и добавление ID сущностей
+def write_work(record, writers, id_sets):
+    year = record['work']['publication_year']
+    writers['works'].write(record['work'], partition=year)
+    for table in WORK_TABLES[1:]:
+        writers[table].write_rows(record[table], partition=year)
+    for key in ENTITY_ID_KEYS:
+        id_sets[key].update(record[key])
+
+# Источники записей works из локальных файлов: (имя файла, строки, ожидаемое число записей)
+def iter_local_work_sources(skip=None):
+    """skip - номера строк устаревших версий каждого файла (open_superseded_index), они пропускаются."""
     # Обработка файлов works
     works_dir = os.path.join(DATA_DIR, "works")
     
@@ -66,80 +212,356 @@ def process_works():
         logger.error(f"Директория {works_dir} не найдена. Убедитесь, что данные были загружены.")
         return None
     
-    # Ищем файлы с паттерном updated_date_YYYY-MM-DD.jsonl.gz
-    work_files = sorted([f for f in os.listdir(works_dir) if f.startswith("updated_date_") and f.endswith(".jsonl.gz")])
-    
-    if not work_files:
-        # Если файлы с новым паттерном не найдены, попробуем старый паттерн
-        work_files = sorted([f for f in os.listdir(works_dir) if f.startswith("part_") and f.endswith(".jsonl.gz")])
-    
-    logger.info(f"Начало обработки публикаций (works)")
+    work_files = list_work_files(works_dir)
     logger.info(f"Найдено {len(work_files)} файлов works для обработки: {', '.join(work_files)}")
     
+    # Ожидаемое количество записей в каждом файле берем из плана загрузки
+    plan_entries = get_plan_entries("works")
+    missing_planned = sorted(set(plan_entries) - set(work_files))
+    if missing_planned:
+        logger.warning(f"Файлы из плана загрузки не найдены локально: {', '.join(missing_planned)}")
+    
+    return _read_local_work_files(works_dir, work_files, plan_entries, skip or {})
+
+def _read_local_work_files(works_dir, work_files, plan_entries, skip):
     for work_file in work_files:
         file_path = os.path.join(works_dir, work_file)
         logger.info(f"Обработка файла: {file_path}")
         
-        with gzip.open(file_path, 'rt', encoding='utf-8') as f:
-            for line in tqdm(f, desc=f"Обработка {work_file}"):
+        yield work_file, skip_lines(iter_lines(file_path), skip.get(work_file, ())), plan_entries.get(work_file, {}).get('record_count')
+
+# Разбор одного файла works в процессе пула
+def parse_work_file(args):
+    """Записывает частичные таблицы файла (CSV без заголовка) и возвращает границы публикаций.
+
+    bounds[table][i] - смещение в байтах в частичном файле таблицы после i-й
+    публикации, а first_seen[key][id] - номер публикации, в которой ID
+    встретился впервые. Это позволяет при слиянии взять ровно первые k
+    публикаций файла. start - число строк, прочитанных до контрольной точки,
+    sampler - work_sample.WorkSampler (None - без выборки), expression -
+    выражение отбора (компилируется в процессе). filter_marks - счетчики
+    отбора после каждой публикации, чтобы при слиянии учесть только взятые.
+    """
+    file_path, limit, partial_dir, skip, dedup, start, sampler, expression = args
+    os.makedirs(partial_dir, exist_ok=True)
+    # Частичные результаты всегда пишутся в CSV: так их можно слить по смещениям в байтах
+    writers = {table: CsvTableWriter(os.path.join(partial_dir, f"{table}.csv"), TABLE_COLUMNS[table], header=False)
+               for table in WORK_TABLES}
+    bounds = {table: array('q') for table in WORK_TABLES}
+    rows = {table: array('q') for table in WORK_TABLES}
+    first_seen = {key: {} for key in ENTITY_ID_KEYS}
+    types = []
+    years = []
+    work_filter = work_filters.WorkFilter(expression) if expression else None
+    filter_marks = array('q')
+    
+    lines = islice(skip_lines(iter_lines(file_path), skip), start, None)
+    if sampler is not None:
+        lines = sampler.lines(lines)
+    if work_filter is not None:
+        lines = work_filter.lines(lines)
+    
+    try:
+        for line in lines:
+            try:
+                record = extract_work(decode_work(line), dedup=dedup)
+            except Exception as e:
+                logger.error(f"Ошибка при обработке записи: {str(e)}")
+                continue
+            if record is None:
+                continue
+            
+            index = len(types)
+            types.append(record['work']['type'])
+            years.append(record['work']['publication_year'])
+            writers['works'].write(record['work'])
+            for table in WORK_TABLES[1:]:
+                writers[table].write_rows(record[table])
+            for table in WORK_TABLES:
+                bounds[table].append(writers[table].tell())
+                rows[table].append(writers[table].rows)
+            for key in ENTITY_ID_KEYS:
+                # ID передаются в основной процесс кодами id_codec (имена издателей - строками)
+                encode = encode_id if key != 'publisher_names' else None
+                for entity_id in record[key]:
+                    first_seen[key].setdefault(encode(entity_id) if encode else entity_id, index)
+            if work_filter is not None:
+                filter_marks.extend(work_filter.counts())
+            
+            # Следующая строка не читается: счетчики отбора заканчиваются на последней публикации
+            if len(types) >= limit:
+                break
+    finally:
+        for writer in writers.values():
+            writer.close()
+    
+    return {'file': os.path.basename(file_path), 'dir': partial_dir, 'bounds': bounds, 'rows': rows,
+            'first_seen': first_seen, 'types': types, 'years': years,
+            'filter_counts': work_filter.counts() if work_filter is not None else None, 'filter_marks': filter_marks}
+
+# Год публикации для каждой строки первых k публикаций частичного файла
+def _row_partitions(rows, years, k):
+    previous = 0
+    for index in range(k):
+        for _ in range(rows[index] - previous):
+            yield years[index]
+        previous = rows[index]
+
+# Счетчики отбора первых k публикаций частичного результата
+def _partial_filter_counts(partial, k, stopped):
+    """stopped - на k-й публикации достигнут MAX_WORKS: последовательная
+    обработка не читала бы строки файла после нее.
+    """
+    if k == len(partial['types']) and not stopped:
+        return partial['filter_counts']
+    width = len(partial['filter_counts'])
+    return partial['filter_marks'][(k - 1) * width:k * width]
+
+# Счетчики обработки публикаций для контрольной точки (типы - парами, среди них есть None)
+def _checkpoint_counters(processed_works, filtered_works, type_counter, work_filter=None):
+    return {'processed': processed_works, 'filtered': filtered_works, 'types': list(type_counter.items()),
+            'filter': work_filter.counts() if work_filter is not None else None}
+
+# Параллельный разбор локальных файлов works с детерминированным слиянием
+def collect_works_parallel(workers, writers, id_sets, type_counter, skip=None, checkpoint=None, taken=0, sampler=None,
+                           work_filter=None, consumed=None):
+    """Разбирает файлы works в пуле процессов и дописывает результаты в writers и id_sets.
+
+    Частичные результаты сливаются строго в порядке файлов, и из каждого файла
+    берется столько публикаций, сколько осталось до MAX_WORKS, поэтому результат
+    совпадает с последовательной обработкой. checkpoint - контрольная точка:
+    файлы до нее не разбираются, а после слияния файла сохраняется новая
+    (taken - публикаций, взятых до нее). sampler - выборка публикаций,
+    одинаковая во всех процессах; work_filter - отбор, его выражение
+    компилируется в каждом процессе, а счетчики складываются по взятым
+    публикациям. В consumed добавляются файлы, взятые целиком. Возвращает
+    число взятых публикаций.
+    """
+    consumed = consumed if consumed is not None else []
+    works_dir = os.path.join(DATA_DIR, "works")
+    work_files = list_work_files(works_dir)
+    
+    partials_root = os.path.join(OUTPUT_DIR, ".partials")
+    skip = skip or {}
+    tasks = []
+    for work_file in work_files:
+        start = checkpoint.start_line(work_file) if checkpoint is not None else 0
+        if start is not None:
+            tasks.append((os.path.join(works_dir, work_file), MAX_WORKS, os.path.join(partials_root, work_file),
+                          skip.get(work_file, ()), DEDUP_WORKS, start, sampler,
+                          work_filter.expression if work_filter is not None else None))
+        else:
+            consumed.append(work_file)
+    logger.info(f"Параллельная обработка {len(tasks)} файлов works в {workers} процессах")
+    try:
+        with Pool(processes=workers) as pool:
+            for partial in tqdm(pool.imap(parse_work_file, tasks), total=len(tasks), desc="Обработка файлов works"):
+                k = min(len(partial['types']), MAX_WORKS - taken)
+                for table in WORK_TABLES:
+                    end = partial['bounds'][table][k - 1] if k else 0
+                    end_rows = partial['rows'][table][k - 1] if k else 0
+                    partitions = _row_partitions(partial['rows'][table], partial['years'], k)
+                    writers[table].copy_from(os.path.join(partial['dir'], f"{table}.csv"), end, end_rows, partitions)
+                for key in ENTITY_ID_KEYS:
+                    id_sets[key].update(entity_id for entity_id, index in partial['first_seen'][key].items() if index < k)
+                type_counter.update(partial['types'][:k])
+                if work_filter is not None:
+                    work_filter.add_counts(_partial_filter_counts(partial, k, taken + k >= MAX_WORKS))
+                taken += k
+                shutil.rmtree(partial['dir'], ignore_errors=True)
+                logger.info(f"Файл {partial['file']}: взято {k} публикаций")
+                
+                if taken >= MAX_WORKS:
+                    logger.info(f"Достигнут лимит публикаций: {MAX_WORKS}")
+                    # Выход из with завершает процессы, разбирающие оставшиеся файлы
+                    break
+                
+                consumed.append(partial['file'])
+                if checkpoint is not None:
+                    checkpoint.file_done(partial['file'])
+                    if checkpoint.due():
+                        checkpoint.save(writers, id_sets, _checkpoint_counters(taken, taken, type_counter, work_filter))
+    finally:
+        shutil.rmtree(partials_root, ignore_errors=True)
+    return taken
+
+# Функция для обработки публикаций (works)
+def process_works(sources=None, workers=None, deduplicated=False, consumed=None):
+    """Обрабатывает публикации из локальных файлов или из переданных источников.
+
+    sources - итерируемый объект с кортежами (имя, строки JSON, ожидаемое число записей),
+    например потоковая загрузка из stream_works.py. workers > 1 включает
+    параллельный разбор локальных файлов. deduplicated=True - в sources уже
+    нет устаревших версий публикаций (инкрементальный режим). consumed - список,
+    в который добавляются имена файлов, прочитанных до конца (не остановленных MAX_WORKS).
+    """
+    consumed = consumed if consumed is not None else []
+    workers = workers or WORKERS
+    create_output_directory()
+    
+    # Контрольные точки и продолжение после прерывания - только для локальных файлов works
+    checkpoint = None
+    if sources is None:
+        works_dir = os.path.join(DATA_DIR, "works")
+        checkpoint = Checkpoint(OUTPUT_DIR, 'works', {
+            'max_works': MAX_WORKS,
+            'dedup': DEDUP_WORKS,
+            'citation': [citation_subset.CITATION_HOPS, citation_subset.CITATION_DIRECTION, citation_subset.SEED_WORKS],
+            'sample': work_sample.sample_settings(),
+            'filter': work_filters.WORK_FILTER,
+            'files': list_work_files(works_dir) if os.path.exists(works_dir) else []
+        })
+        if checkpoint.completed():
+            logger.info("Публикации обработаны до прерывания, обработка пропущена")
+            consumed.extend((checkpoint.report() or {}).get('consumed', []))
+            return load_entity_ids_file(os.path.join(OUTPUT_DIR, ENTITY_IDS_FILE))
+    if checkpoint is None or not checkpoint.resumed:
+        # Контрольные точки прошлых запусков (в том числе сущностей) больше не действуют
+        clear_checkpoints(OUTPUT_DIR)
+    
+    # Множества для хранения ID связанных сущностей (компактные коды id_codec)
+    author_ids = IdSet()
+    concept_ids = IdSet()
+    institution_ids = IdSet()
+    source_ids = IdSet()
+    publisher_names = set()
+    id_sets = {
+        'author_ids': author_ids,
+        'concept_ids': concept_ids,
+        'institution_ids': institution_ids,
+        'source_ids': source_ids,
+        'publisher_names': publisher_names
+    }
+    
+    # Счетчики
+    processed_works = 0
+    filtered_works = 0
+    start_time = time.time()
+    
+    # Счетчик типов публикаций
+    type_counter = Counter()
+    
+    logger.info(f"Начало обработки публикаций (works)")
+    logger.info(f"Декодер JSON: {JSON_BACKEND}, проекция works: {'msgspec' if view_enabled() else 'нет'}, распаковщик gzip: {get_gzip_backend()}")
+    
+    # Подмножество, замкнутое по цитированиям, собирается несколькими проходами по локальным файлам
+    subset = citation_subset.CITATION_HOPS > 0
+    if subset and sources is not None:
+        logger.warning("Подмножество по цитированиям строится только из локальных файлов works, --citation-hops пропущен")
+        subset = False
+    local = sources is None
+    parallel = local and workers > 1 and not subset
+    
+    # Устаревшие версии публикаций (есть более новая в следующих частях) пропускаются
+    skip = None
+    if DEDUP_WORKS:
+        if sources is None:
+            works_dir = os.path.join(DATA_DIR, "works")
+            if os.path.exists(works_dir):
+                skip = open_superseded_index(DATA_DIR, "works", list_work_files(works_dir))
+                logger.info(f"Устаревших версий публикаций будет пропущено: {sum(len(lines) for lines in skip.values())}")
+        elif not deduplicated:
+            logger.warning("Удаление повторов публикаций между частями работает только с локальными файлами works")
+    if sources is None:
+        sources = iter_local_work_sources(skip)
+        if sources is None:
+            return None
+    
+    # Отбор публикаций по выражению --filter: проверяется до полного разбора записи
+    work_filter = work_filters.compile_filter()
+    if work_filter is not None:
+        if subset:
+            logger.warning("Отбор --filter не сочетается с подмножеством по цитированиям и пропущен")
+            work_filter = None
+        else:
+            logger.info(f"Отбор публикаций: {work_filter.expression} (поля: {', '.join(work_filter.fields)})")
+    
+    # Выборка публикаций по хешу ID вместо первых MAX_WORKS в порядке файлов
+    sampler = None
+    if work_sample.sampling_enabled():
+        if subset:
+            logger.warning("Выборка публикаций не сочетается с подмножеством по цитированиям и пропущена")
+        elif local and work_sample.needs_plan():
+            # Выборка делается среди публикаций, прошедших отбор (отдельные счетчики отбора)
+            plan_filter = work_filters.compile_filter()
+            plan_sources = iter_local_work_sources(skip)
+            if plan_filter is not None:
+                plan_sources = ((name, plan_filter.lines(lines), None) for name, lines, _ in plan_sources)
+            sampler = work_sample.build_sampler(plan_sources, MAX_WORKS)
+        elif work_sample.needs_plan():
+            logger.warning("Резервуарная выборка и выборка по слоям работают только с локальными файлами works и пропущены")
+        else:
+            sampler = work_sample.build_sampler(None, MAX_WORKS)
+    
+    # Продолжение с контрольной точки: множества ID и счетчики на момент ее сохранения
+    if checkpoint is not None and checkpoint.resumed:
+        id_sets.update(checkpoint.id_sets())
+        counters = checkpoint.counters()
+        processed_works, filtered_works = counters['processed'], counters['filtered']
+        type_counter.update(dict(counters['types']))
+        if work_filter is not None and counters.get('filter'):
+            work_filter.add_counts(counters['filter'])
+    
+    # Публикации и связи записываются на диск по мере разбора
+    if checkpoint is not None:
+        writers = checkpoint.open_writers(WORK_TABLES)
+    else:
+        writers = {table: open_table_writer(OUTPUT_DIR, table) for table in WORK_TABLES}
+    try:
+        if parallel:
+            filtered_works = collect_works_parallel(workers, writers, id_sets, type_counter, skip,
+                                                    checkpoint, filtered_works, sampler, work_filter, consumed)
+            processed_works = filtered_works
+            sources = ()
+        elif subset:
+            # Публикация записывается так же, как при обычном разборе, но ссылки
+            # откладываются: в work_citation попадают только ссылки внутри подмножества
+            def take(work):
+                record = extract_work(work, dedup=DEDUP_WORKS)
+                if record is None:
+                    return None
+                type_counter[work.get('type')] += 1
+                write_work(dict(record, work_citation=[]), writers, id_sets)
+                return record
+            
+            filtered_works = citation_subset.build_citation_subset(
+                DATA_DIR, OUTPUT_DIR, list_work_files(os.path.join(DATA_DIR, "works")), MAX_WORKS, take,
+                writers['work_citation'], skip)
+            # Подмножество выбирается среди всех локальных частей
+            consumed.extend(list_work_files(os.path.join(DATA_DIR, "works")))
+            processed_works = filtered_works
+            sources = ()
+        
+        for work_file, lines, expected_records in sources:
+            if checkpoint is not None:
+                lines = checkpoint.lines(work_file, lines)
+                if lines is None:
+                    consumed.append(work_file)
+                    continue
+            # Решение о выборке и отборе принимается до разбора JSON; число записей файла уже не известно
+            if sampler is not None:
+                lines = sampler.lines(lines)
+                expected_records = None
+            if work_filter is not None:
+                lines = work_filter.lines(lines)
+                expected_records = None
+            for line in tqdm(lines, desc=f"Обработка {work_file}", total=expected_records):
                 try:
-                    work = json.loads(line)
+                    work = decode_work(line)
                     
                     # Удаляем фильтрацию по году публикации и типу
                     # Просто берем все публикации
-                    
-                    work_id = work.get('id')
-                    if not work_id:
+                    record = extract_work(work, dedup=DEDUP_WORKS)
+                    if record is None:
                         continue
+                    work_id = record['work']['id']
+                    host_venue = record['host_venue']
                     
                     # Увеличиваем счетчик типа публикации
                     type_counter[work.get('type')] += 1
                     
-                    # Извлечение данных о публикации
-                    work_data = {
-                        'id': work_id,
-                        'title': work.get('title', ''),
-                        'publication_year': work.get('publication_year'),
-                        'doi': work.get('doi', ''),
-                        'cited_by_count': work.get('cited_by_count', 0),
-                        'type': work.get('type')
-                    }
-                    
-                    # Добавление данных о публикации
-                    works_data.append(work_data)
-                    
-                    # Обработка source (источника)
-                    # Проверяем оба возможных места для source_id
-                    host_venue = work.get('host_venue', {})
-                    primary_location = work.get('primary_location', {})
-                    
-                    # Получаем source_id из host_venue или primary_location.source
-                    source_id = None
-                    publisher = None
-                    
-                    # Проверяем host_venue
-                    if host_venue and isinstance(host_venue, dict):
-                        source_id = host_venue.get('id')
-                        publisher = host_venue.get('publisher')
-                    
-                    # Если не нашли в host_venue, проверяем primary_location.source
-                    if not source_id and primary_location and isinstance(primary_location, dict):
-                        source = primary_location.get('source', {})
-                        if source and isinstance(source, dict):
-                            source_id = source.get('id')
-                            publisher = source.get('publisher')
-                    
-                    # Если нашли source_id, добавляем связь
-                    if source_id:
-                        source_ids.add(source_id)
-                        work_source_relations.append({
-                            'work_id': work_id,
-                            'source_id': source_id
-                        })
-                        
-                        # Добавляем издателя, если он есть
-                        if publisher:
-                            publisher_names.add(publisher)
+                    # Запись данных о публикации и связей, добавление ID связанных сущностей
+                    write_work(record, writers, id_sets)
                     
                     # Отладочная информация для первых 10 публикаций
                     if filtered_works < 10:
@@ -150,51 +572,11 @@ def process_works():
                     if filtered_works % 1000 == 0:
                         if host_venue is None:
                             logger.info(f"host_venue is None для публикации {work_id}")
-                        elif not isinstance(host_venue, dict):
+                        elif not is_mapping(host_venue):
                             logger.info(f"host_venue не является словарем для публикации {work_id}, тип: {type(host_venue)}")
                         elif not host_venue:
                             logger.info(f"host_venue - пустой словарь для публикации {work_id}")
                     
-                    # Обработка авторов
-                    authorships = work.get('authorships', [])
-                    for authorship in authorships:
-                        author = authorship.get('author', {})
-                        author_id = author.get('id')
-                        if author_id:
-                            author_ids.add(author_id)
-                            author_work_relations.append({
-                                'author_id': author_id,
-                                'work_id': work_id
-                            })
-                            
-                            # Извлечение организаций
-                            institutions = authorship.get('institutions', [])
-                            for institution in institutions:
-                                institution_id = institution.get('id')
-                                if institution_id:
-                                    institution_ids.add(institution_id)
-                    
-                    # Обработка концепций
-                    concepts = work.get('concepts', [])
-                    for concept in concepts:
-                        concept_id = concept.get('id')
-                        if concept_id:
-                            concept_ids.add(concept_id)
-                            work_concept_relations.append({
-                                'work_id': work_id,
-                                'concept_id': concept_id,
-                                'score': concept.get('score', 0)
-                            })
-                    
-                    # Обработка цитирований
-                    referenced_works = work.get('referenced_works', [])
-                    for cited_id in referenced_works:
-                        if cited_id:
-                            work_citation_relations.append({
-                                'citing_id': work_id,
-                                'cited_id': cited_id
-                            })
-                    
                     filtered_works += 1
                     
                     # Проверка достижения лимита
@@ -208,36 +590,30 @@ def process_works():
                     logger.error(f"Ошибка при обработке записи: {str(e)}")
                     continue
                 
-        if filtered_works >= MAX_WORKS:
-            break
-    
-    # Сохранение данных о публикациях
-    works_df = pd.DataFrame(works_data)
-    works_df.to_csv(os.path.join(OUTPUT_DIR, "works.csv"), index=False)
-    logger.info(f"Сохранено {len(works_df)} публикаций в works.csv")
-    
-    # Сохранение связей
-    pd.DataFrame(author_work_relations).to_csv(os.path.join(OUTPUT_DIR, "author_work.csv"), index=False)
-    logger.info(f"Сохранено {len(author_work_relations)} связей автор-публикация")
-    
-    pd.DataFrame(work_concept_relations).to_csv(os.path.join(OUTPUT_DIR, "work_concept.csv"), index=False)
-    logger.info(f"Сохранено {len(work_concept_relations)} связей публикация-концепция")
-    
-    pd.DataFrame(work_source_relations).to_csv(os.path.join(OUTPUT_DIR, "work_source.csv"), index=False)
-    logger.info(f"Сохранено {len(work_source_relations)} связей публикация-источник")
+                # Контрольная точка: позиция в файле, размеры таблиц, множества ID и счетчики
+                if checkpoint is not None and checkpoint.due():
+                    checkpoint.save(writers, id_sets, _checkpoint_counters(processed_works, filtered_works, type_counter,
+                                                                           work_filter))
+                
+            if filtered_works >= MAX_WORKS:
+                break
+            consumed.append(work_file)
+    finally:
+        for writer in writers.values():
+            writer.close()
     
-    pd.DataFrame(work_citation_relations).to_csv(os.path.join(OUTPUT_DIR, "work_citation.csv"), index=False)
-    logger.info(f"Сохранено {len(work_citation_relations)} связей цитирования")
+    logger.info(f"Сохранено {writers['works'].rows} публикаций в {os.path.basename(writers['works'].path)}")
+    logger.info(f"Сохранено {writers['author_work'].rows} связей автор-публикация")
+    logger.info(f"Сохранено {writers['work_concept'].rows} связей публикация-концепция")
+    logger.info(f"Сохранено {writers['work_source'].rows} связей публикация-источник")
+    logger.info(f"Сохранено {writers['work_citation'].rows} связей цитирования")
     
-    # Сохранение множеств ID для последующей обработки
-    with open(os.path.join(OUTPUT_DIR, "entity_ids.json"), "w") as f:
-        json.dump({
-            "author_ids": list(author_ids),
-            "concept_ids": list(concept_ids),
-            "institution_ids": list(institution_ids),
-            "source_ids": list(source_ids),
-            "publisher_names": list(publisher_names)
-        }, f)
+    # Сохранение множеств ID для последующей обработки (двоичный файл, см. entity_ids_file.py)
+    save_entity_ids(os.path.join(OUTPUT_DIR, ENTITY_IDS_FILE), id_sets, id_sets['publisher_names'])
+    # JSON прошлых запусков больше не актуален
+    legacy_path = os.path.join(OUTPUT_DIR, LEGACY_ENTITY_IDS_FILE)
+    if os.path.exists(legacy_path):
+        os.remove(legacy_path)
     
     # Статистика
     end_time = time.time()
@@ -248,13 +624,19 @@ def process_works():
     logger.info(f"Типы публикаций: {dict(type_counter)}")
     logger.info(f"Время обработки: {processing_time:.2f} секунд")
     
-    return {
-        "author_ids": author_ids,
-        "concept_ids": concept_ids,
-        "institution_ids": institution_ids,
-        "source_ids": source_ids,
-        "publisher_names": publisher_names
-    }
+    if work_filter is not None:
+        work_filters.save_filter_report(OUTPUT_DIR, work_filter)
+    
+    if sampler is not None:
+        if filtered_works >= MAX_WORKS and not work_sample.SAMPLE_RESERVOIR:
+            logger.warning(f"Выборка остановлена лимитом --max-works ({MAX_WORKS}): последние части представлены не полностью")
+        work_sample.save_sample_report(OUTPUT_DIR, sampler, filtered_works)
+    
+    if checkpoint is not None:
+        checkpoint.complete(dict(_checkpoint_counters(processed_works, filtered_works, type_counter, work_filter),
+                                 consumed=consumed))
+    
+    return id_sets
 
 if __name__ == "__main__":
     process_works() 
\ No newline at end of file
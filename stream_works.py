@@ -0,0 +1,187 @@
+import os
+import queue
+import hashlib
+import logging
+import threading
+
+import download_data
+from download_data import create_session, get_host_semaphore, DownloadManifest
+from openalex_manifest import load_download_plan
+from input_reader import decompressobj
+from process_works import process_works
+
+logger = logging.getLogger("stream")
+
+# Емкость очереди между загрузкой и разбором (в пакетах строк)
+STREAM_QUEUE_SIZE = 64
+
+# Количество строк в одном пакете очереди
+STREAM_BATCH_LINES = 1000
+
+# Размер блока при чтении HTTP-потока
+STREAM_CHUNK_SIZE = 1024 * 1024
+
+# Маркеры событий в очереди
+_PART_START = 'start'
+_PART_LINES = 'lines'
+_PART_END = 'end'
+_STREAM_ERROR = 'error'
+_STREAM_DONE = 'done'
+
+# Части works для потоковой обработки: из сохраненного плана или из нового плана по манифесту
+def get_stream_items():
+    plan = load_download_plan()
+    if not plan or not plan.get('entities', {}).get('works'):
+        plan = download_data.build_download_plan()
+    items = plan['entities'].get('works', [])
+    return sorted(items, key=lambda item: os.path.basename(item['output_path']))
+
+# Загрузка одной части с распаковкой на лету и (опционально) копией сжатого файла на диск
+def _stream_part(item, session, out_queue, stop_event, tee, manifest):
+    url = item['url']
+    output_path = item['output_path']
+    part_path = output_path + ".part"
+    decompressor = decompressobj()
+    pending = b''
+    batch = []
+    md5 = hashlib.md5()
+    size = 0
+
+    with get_host_semaphore(url):
+        response = session.get(url, stream=True, timeout=60)
+        try:
+            response.raise_for_status()
+            etag = response.headers.get('ETag')
+            if tee:
+                os.makedirs(os.path.dirname(output_path), exist_ok=True)
+                # Незавершенная копия регистрируется в манифесте, чтобы обычная загрузка могла ее докачать
+                manifest.update(output_path, {'url': url, 'etag': etag, 'content_length': item.get('content_length'), 'complete': False})
+                tee_file = open(part_path, 'wb')
+            else:
+                tee_file = None
+
+            try:
+                for chunk in response.iter_content(chunk_size=STREAM_CHUNK_SIZE):
+                    if stop_event.is_set():
+                        return False
+                    if tee_file:
+                        tee_file.write(chunk)
+                        md5.update(chunk)
+                        size += len(chunk)
+
+                    data = chunk
+                    while data:
+                        pending += decompressor.decompress(data)
+                        # Части могут состоять из нескольких gzip-членов
+                        data = decompressor.unused_data
+                        if decompressor.eof:
+                            decompressor = decompressobj()
+                        else:
+                            data = b''
+
+                    *complete, pending = pending.split(b'\n')
+                    batch.extend(line for line in complete if line)
+                    if len(batch) >= STREAM_BATCH_LINES:
+                        out_queue.put((_PART_LINES, batch))
+                        batch = []
+            finally:
+                if tee_file:
+                    tee_file.close()
+        finally:
+            response.close()
+
+    if pending.strip():
+        batch.append(pending)
+    if batch:
+        out_queue.put((_PART_LINES, batch))
+
+    if tee:
+        # Копия проверяется так же, как при обычной загрузке: испорченная не сохраняется
+        expected_size = item.get('content_length')
+        expected_md5 = download_data.etag_md5(etag)
+        if (expected_size and size != expected_size) or (expected_md5 and md5.hexdigest() != expected_md5):
+            logger.warning(f"Копия {output_path} не совпадает с размером или ETag, она не сохранена")
+            os.remove(part_path)
+            return True
+        os.replace(part_path, output_path)
+        manifest.update(output_path, {'url': url, 'etag': etag, 'content_length': size, 'md5': md5.hexdigest(), 'complete': True})
+    return True
+
+# Поток-загрузчик: последовательно читает все части и передает строки в очередь
+def _producer(items, out_queue, stop_event, tee):
+    session = create_session(pool_size=1)
+    manifest = DownloadManifest() if tee else None
+    try:
+        for item in items:
+            if stop_event.is_set():
+                break
+            out_queue.put((_PART_START, item))
+            if not _stream_part(item, session, out_queue, stop_event, tee, manifest):
+                break
+            out_queue.put((_PART_END, item))
+    except Exception as e:
+        out_queue.put((_STREAM_ERROR, e))
+    finally:
+        session.close()
+        out_queue.put((_STREAM_DONE, None))
+
+# Строки одной части из очереди (до маркера конца части)
+def _part_lines(out_queue, state):
+    while True:
+        kind, payload = out_queue.get()
+        if kind == _PART_LINES:
+            yield from payload
+        elif kind == _STREAM_ERROR:
+            raise payload
+        else:
+            state['last'] = kind
+            return
+
+# Источники для process_works: части works, загружаемые и распаковываемые в фоновом потоке
+def iter_streamed_work_sources(items, tee=False, queue_size=STREAM_QUEUE_SIZE):
+    out_queue = queue.Queue(maxsize=queue_size)
+    stop_event = threading.Event()
+    producer = threading.Thread(target=_producer, args=(items, out_queue, stop_event, tee), daemon=True)
+    producer.start()
+    state = {'last': None}
+    try:
+        while True:
+            kind, payload = out_queue.get()
+            if kind == _STREAM_DONE:
+                break
+            if kind == _STREAM_ERROR:
+                raise payload
+            if kind != _PART_START:
+                continue
+            logger.info(f"Потоковая обработка части: {payload['url']}")
+            lines = _part_lines(out_queue, state)
+            yield os.path.basename(payload['output_path']), lines, payload.get('record_count')
+            # Дочитываем часть, если обработчик остановился раньше ее конца
+            for _ in lines:
+                pass
+            if state['last'] == _STREAM_DONE:
+                break
+    finally:
+        # Останавливаем загрузчик и освобождаем очередь, чтобы он не блокировался на put
+        stop_event.set()
+        while producer.is_alive():
+            try:
+                out_queue.get(timeout=0.1)
+            except queue.Empty:
+                pass
+
+# Основная функция потоковой обработки публикаций
+def stream_works(tee=False):
+    """Разбирает works во время загрузки, без промежуточной записи data/works на диск.
+
+    С tee=True сжатые части дополнительно сохраняются в data/works.
+    """
+    items = get_stream_items()
+    if not items:
+        logger.error("Не найдено частей works для потоковой обработки")
+        return None
+    logger.info(f"Потоковая обработка {len(items)} частей works (копия на диск: {'да' if tee else 'нет'})")
+    return process_works(sources=iter_streamed_work_sources(items, tee=tee))
+
+if __name__ == "__main__":
+    stream_works()
@@ -0,0 +1,283 @@
+import io
+import os
+import csv
+import shutil
+from itertools import islice
+
+# Формат выходных таблиц: csv или parquet
+OUTPUT_FORMAT = "csv"
+
+# Количество строк, накапливаемых в памяти перед записью на диск
+WRITE_BATCH_ROWS = 10_000
+
+# Количество строк в одной группе строк (row group) Parquet
+PARQUET_ROW_GROUP_SIZE = 100_000
+
+# Сжатие Parquet и его уровень (None - уровень по умолчанию)
+PARQUET_COMPRESSION = "zstd"
+PARQUET_COMPRESSION_LEVEL = None
+
+# Разбиение works и связей публикаций на каталоги по году публикации (только для parquet)
+PARTITION_BY_YEAR = False
+
+# Колонка разбиения и таблицы, которые по ней разбиваются
+PARTITION_COLUMN = "publication_year"
+PARTITIONED_TABLES = ('works', 'author_work', 'work_concept', 'work_source', 'work_citation')
+
+# Имя каталога разбиения для публикаций без года (соглашение Hive)
+NULL_PARTITION = "__HIVE_DEFAULT_PARTITION__"
+
+# Схемы выходных таблиц: колонки (в порядке записи) и их типы
+TABLE_SCHEMAS = {
+    'works': [('id', 'string'), ('title', 'string'), ('publication_year', 'int32'), ('doi', 'string'),
+              ('cited_by_count', 'int64'), ('type', 'string')],
+    'author_work': [('author_id', 'string'), ('work_id', 'string')],
+    'work_concept': [('work_id', 'string'), ('concept_id', 'string'), ('score', 'float64')],
+    'work_source': [('work_id', 'string'), ('source_id', 'string')],
+    'work_citation': [('citing_id', 'string'), ('cited_id', 'string')],
+    'authors': [('id', 'string'), ('name', 'string'), ('orcid', 'string'), ('works_count', 'int64'),
+                ('cited_by_count', 'int64')],
+    'author_institution': [('author_id', 'string'), ('institution_id', 'string')],
+    'institutions': [('id', 'string'), ('display_name', 'string'), ('country_code', 'string'), ('type', 'string'),
+                     ('works_count', 'int64'), ('cited_by_count', 'int64')],
+    'concepts': [('id', 'string'), ('display_name', 'string'), ('level', 'int32'), ('works_count', 'int64'),
+                 ('cited_by_count', 'int64')],
+    'concept_ancestor': [('concept_id', 'string'), ('ancestor_id', 'string')],
+    'concept_closure': [('concept_id', 'string'), ('ancestor_id', 'string'), ('depth', 'int32')],
+    'sources': [('id', 'string'), ('display_name', 'string'), ('issn', 'string'), ('works_count', 'int64'),
+                ('cited_by_count', 'int64')],
+    'source_publisher': [('source_id', 'string'), ('publisher_name', 'string')],
+    'publishers': [('name', 'string'), ('works_count', 'int64'), ('cited_by_count', 'int64'),
+                   ('country_codes', 'string')]
+}
+
+# Колонки выходных таблиц (в порядке записи)
+TABLE_COLUMNS = {table: [column for column, _ in schema] for table, schema in TABLE_SCHEMAS.items()}
+
+# Потоковая запись таблицы в CSV пакетами строк
+class CsvTableWriter:
+    """Записывает строки (словари) в CSV по мере поступления.
+
+    В памяти хранится не больше batch_rows строк, поэтому расход памяти не
+    зависит от размера таблицы. tell() возвращает точное смещение в байтах
+    после последней записанной строки. resume=(байты, строки) - продолжение
+    записи с контрольной точки: файл обрезается до этого размера и дописывается.
+    """
+
+    def __init__(self, path, columns, header=True, batch_rows=None, resume=None):
+        self.path = path
+        self.columns = columns
+        self.rows = 0
+        self.bytes_written = 0
+        self._batch_rows = batch_rows or WRITE_BATCH_ROWS
+        self._pending = 0
+        self._buffer = io.StringIO()
+        self._csv = csv.writer(self._buffer, lineterminator='\n')
+        if resume is not None:
+            # Строки, записанные после контрольной точки, отбрасываются
+            self.bytes_written, self.rows = resume
+            self._file = open(path, 'r+b')
+            self._file.truncate(self.bytes_written)
+            self._file.seek(self.bytes_written)
+            return
+        self._file = open(path, 'wb')
+        if header:
+            self._csv.writerow(columns)
+            self.flush()
+
+    # partition не используется: CSV всегда пишется одним файлом
+    def write(self, row, partition=None):
+        self._csv.writerow([row.get(column) for column in self.columns])
+        self.rows += 1
+        self._pending += 1
+        if self._pending >= self._batch_rows:
+            self.flush()
+
+    def write_rows(self, rows, partition=None):
+        for row in rows:
+            self.write(row)
+
+    def flush(self):
+        data = self._buffer.getvalue().encode('utf-8')
+        if data:
+            self._file.write(data)
+            self.bytes_written += len(data)
+            self._buffer.seek(0)
+            self._buffer.truncate()
+        self._pending = 0
+
+    def tell(self):
+        self.flush()
+        return self.bytes_written
+
+    # Сброс записанных строк на диск (для контрольной точки)
+    def sync(self):
+        self.flush()
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    # Дописывание первых length байт готового фрагмента CSV (без заголовка)
+    def copy_from(self, path, length, rows, partitions=None):
+        self.flush()
+        with open(path, 'rb') as src:
+            remaining = length
+            while remaining > 0:
+                block = src.read(min(remaining, 1024 * 1024))
+                if not block:
+                    break
+                self._file.write(block)
+                remaining -= len(block)
+        self.bytes_written += length - remaining
+        self.rows += rows
+
+    def close(self):
+        self.flush()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+# Потоковая запись таблицы в Parquet с типизированной схемой
+class ParquetTableWriter:
+    """Записывает строки (словари) в Parquet группами по row_group_size строк.
+
+    С partition_column таблица записывается каталогом в стиле Hive
+    (<таблица>/publication_year=2020/part-0.parquet), а сама колонка разбиения
+    в файлы не попадает. Суммарно в памяти хранится не больше row_group_size
+    строк: при переполнении сбрасывается самый большой буфер разбиения.
+    Пустые строки записываются как null, как и при чтении CSV.
+    """
+
+    def __init__(self, path, table, row_group_size=None, compression=None, compression_level=None,
+                 partition_column=None):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError("Для --output-format parquet требуется пакет pyarrow (pip install pyarrow)")
+        self._pa = pa
+        self._pq = pq
+        self.path = path
+        self.table = table
+        self.rows = 0
+        self.partition_column = partition_column
+        self.columns = [column for column in TABLE_COLUMNS[table] if column != partition_column]
+        types = dict(TABLE_SCHEMAS[table])
+        self._types = [types[column] for column in self.columns]
+        self.schema = pa.schema([(column, getattr(pa, kind)()) for column, kind in zip(self.columns, self._types)])
+        self._row_group_size = row_group_size or PARQUET_ROW_GROUP_SIZE
+        self._compression = compression or PARQUET_COMPRESSION
+        self._compression_level = compression_level if compression_level is not None else PARQUET_COMPRESSION_LEVEL
+        self._buffers = {}
+        self._writers = {}
+        self._pending = 0
+        if partition_column:
+            os.makedirs(path, exist_ok=True)
+
+    # Путь к файлу разбиения
+    def _partition_path(self, partition):
+        if not self.partition_column:
+            return self.path
+        value = NULL_PARTITION if partition is None else partition
+        directory = os.path.join(self.path, f"{self.partition_column}={value}")
+        os.makedirs(directory, exist_ok=True)
+        return os.path.join(directory, "part-0.parquet")
+
+    def write(self, row, partition=None):
+        self._append([row.get(column) for column in self.columns], partition)
+
+    def write_rows(self, rows, partition=None):
+        for row in rows:
+            self.write(row, partition)
+
+    def _append(self, values, partition):
+        key = partition if self.partition_column else None
+        buffer = self._buffers.get(key)
+        if buffer is None:
+            buffer = self._buffers[key] = [[] for _ in self.columns]
+        for column_values, value in zip(buffer, values):
+            column_values.append(None if value == '' else value)
+        self.rows += 1
+        self._pending += 1
+        if self._pending >= self._row_group_size:
+            self._flush_partition(max(self._buffers, key=lambda k: len(self._buffers[k][0]), default=None))
+
+    def _flush_partition(self, key):
+        buffer = self._buffers.pop(key, None)
+        if not buffer or not buffer[0]:
+            return
+        self._pending -= len(buffer[0])
+        arrays = [self._pa.array(values, type=field.type) for values, field in zip(buffer, self.schema)]
+        batch = self._pa.Table.from_arrays(arrays, schema=self.schema)
+        writer = self._writers.get(key)
+        if writer is None:
+            writer = self._writers[key] = self._pq.ParquetWriter(
+                self._partition_path(key), self.schema,
+                compression=self._compression, compression_level=self._compression_level
+            )
+        writer.write_table(batch, row_group_size=self._row_group_size)
+
+    def flush(self):
+        for key in list(self._buffers):
+            self._flush_partition(key)
+
+    # Дописывание первых rows строк фрагмента CSV (без заголовка), записанного CsvTableWriter
+    def copy_from(self, path, length, rows, partitions=None):
+        """partitions - значения колонки разбиения для каждой строки фрагмента."""
+        convert = [_CSV_CONVERTERS[kind] for kind in self._types]
+        indexes = [TABLE_COLUMNS[self.table].index(column) for column in self.columns]
+        partitions = iter(partitions) if partitions is not None else None
+        with open(path, newline='', encoding='utf-8') as src:
+            for record in islice(csv.reader(src), rows):
+                values = [converter(record[index]) for converter, index in zip(convert, indexes)]
+                self._append(values, next(partitions) if partitions is not None else None)
+
+    def close(self):
+        self.flush()
+        for writer in self._writers.values():
+            writer.close()
+        if not self._writers and not self.partition_column:
+            # Пустая таблица: файл со схемой без строк
+            self._pq.write_table(self.schema.empty_table(), self.path, compression=self._compression)
+        self._writers = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+# Преобразование значений из фрагментов CSV в типы схемы
+_CSV_CONVERTERS = {
+    'string': lambda value: value or None,
+    'int32': lambda value: int(value) if value else None,
+    'int64': lambda value: int(value) if value else None,
+    'float64': lambda value: float(value) if value else None
+}
+
+# Удаление результатов прошлого запуска таблицы во всех форматах
+def _remove_table_outputs(output_dir, table):
+    for name in (f"{table}.csv", f"{table}.parquet"):
+        path = os.path.join(output_dir, name)
+        if os.path.isfile(path):
+            os.remove(path)
+    shutil.rmtree(os.path.join(output_dir, table), ignore_errors=True)
+
+# Открытие писателя таблицы в формате OUTPUT_FORMAT
+def open_table_writer(output_dir, table, header=True, resume=None):
+    """resume=(байты, строки) - дописывание CSV с контрольной точки (см. checkpoint.py)."""
+    if resume is not None:
+        if OUTPUT_FORMAT != "csv":
+            raise ValueError("Продолжение записи с контрольной точки поддерживается только для csv")
+        return CsvTableWriter(os.path.join(output_dir, f"{table}.csv"), TABLE_COLUMNS[table], resume=resume)
+    _remove_table_outputs(output_dir, table)
+    if OUTPUT_FORMAT == "csv":
+        return CsvTableWriter(os.path.join(output_dir, f"{table}.csv"), TABLE_COLUMNS[table], header=header)
+    if OUTPUT_FORMAT == "parquet":
+        if PARTITION_BY_YEAR and table in PARTITIONED_TABLES:
+            return ParquetTableWriter(os.path.join(output_dir, table), table, partition_column=PARTITION_COLUMN)
+        return ParquetTableWriter(os.path.join(output_dir, f"{table}.parquet"), table)
+    raise ValueError(f"Неизвестный формат выходных таблиц: {OUTPUT_FORMAT}")
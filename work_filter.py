@@ -0,0 +1,149 @@
+import os
+import ast
+import json
+import logging
+from typing import Any
+
+from json_decoder import loads
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+logger = logging.getLogger("work_filter")
+
+# Выражение отбора публикаций, например "publication_year >= 2020 and type == 'article'" (None - без отбора)
+WORK_FILTER = None
+
+# Отчет об отборе в выходной директории
+FILTER_REPORT_FILE = "work_filter.json"
+
+# Поля верхнего уровня записи works, доступные в выражении
+FILTER_FIELDS = ('id', 'doi', 'title', 'publication_year', 'publication_date', 'type', 'cited_by_count',
+                 'language', 'is_retracted', 'is_paratext')
+
+# Узлы синтаксического дерева, разрешенные в выражении
+_ALLOWED_NODES = (ast.Expression, ast.BoolOp, ast.And, ast.Or, ast.UnaryOp, ast.Not, ast.USub, ast.Compare,
+                  ast.Eq, ast.NotEq, ast.Lt, ast.LtE, ast.Gt, ast.GtE, ast.In, ast.NotIn, ast.Is, ast.IsNot,
+                  ast.Name, ast.Load, ast.Constant, ast.Tuple, ast.List, ast.Set)
+
+# Проверка выражения: только сравнения полей с константами, and/or/not
+def _validate(tree, expression):
+    for node in ast.walk(tree):
+        if not isinstance(node, _ALLOWED_NODES):
+            raise ValueError(f"Недопустимая конструкция в --filter: {type(node).__name__} ({expression})")
+        if isinstance(node, ast.Name) and node.id not in FILTER_FIELDS:
+            raise ValueError(f"Неизвестное поле в --filter: {node.id}; доступны: {', '.join(FILTER_FIELDS)}")
+
+# Функция условия от используемых полей: lambda publication_year, type: <условие>
+def _compile_condition(node):
+    names = sorted({child.id for child in ast.walk(node) if isinstance(child, ast.Name)})
+    arguments = ast.arguments(posonlyargs=[], args=[ast.arg(arg=name) for name in names], kwonlyargs=[],
+                              kw_defaults=[], defaults=[])
+    function = ast.fix_missing_locations(ast.Expression(ast.Lambda(args=arguments, body=node)))
+    return eval(compile(function, '<filter>', 'eval'), {'__builtins__': {}}), names
+
+# Отбор публикаций по выражению, скомпилированному один раз
+class WorkFilter:
+    """Выражение делится на условия верхнего уровня, соединенные and. Каждое
+    условие компилируется в функцию от своих полей. Поля берутся из проекции,
+    в которой есть только используемые поля (msgspec), до полного разбора
+    записи и извлечения связей. Условия проверяются по порядку, и отказ
+    записывается на первое ложное. Сравнение с отсутствующим значением
+    (None >= 2020) считается ложным.
+    """
+
+    def __init__(self, expression):
+        self.expression = expression
+        try:
+            tree = ast.parse(expression.strip(), mode='eval')
+        except SyntaxError as e:
+            raise ValueError(f"Синтаксическая ошибка в --filter: {e.msg} ({expression})")
+        _validate(tree, expression)
+        body = tree.body
+        nodes = body.values if isinstance(body, ast.BoolOp) and isinstance(body.op, ast.And) else [body]
+        self.conditions = []
+        for node in nodes:
+            function, names = _compile_condition(node)
+            self.conditions.append((ast.unparse(node), function, names))
+        self.fields = sorted({name for _, _, names in self.conditions for name in names})
+        self._decoder = None
+        if msgspec is not None:
+            view = msgspec.defstruct('FilterView', [(name, Any, None) for name in self.fields])
+            self._decoder = msgspec.json.Decoder(view)
+        self.checked = 0
+        self.rejected = {text: 0 for text, _, _ in self.conditions}
+
+    # Значения используемых полей записи (словарь или проекция)
+    def _decode(self, line):
+        if self._decoder is not None:
+            try:
+                view = self._decoder.decode(line)
+                return {name: getattr(view, name) for name in self.fields}
+            except (msgspec.DecodeError, msgspec.ValidationError):
+                pass
+        record = loads(line)
+        return {name: record.get(name) for name in self.fields}
+
+    # Проходит ли запись отбор (иначе отказ засчитывается первому ложному условию)
+    def accept(self, line):
+        values = self._decode(line)
+        self.checked += 1
+        for text, function, names in self.conditions:
+            try:
+                passed = function(*[values[name] for name in names])
+            except TypeError:
+                passed = False
+            if not passed:
+                self.rejected[text] += 1
+                return False
+        return True
+
+    # Строки записей, прошедших отбор (некорректные строки передаются дальше, ошибку запишет разбор)
+    def lines(self, lines):
+        for line in lines:
+            try:
+                passed = self.accept(line)
+            except Exception:
+                passed = True
+            if passed:
+                yield line
+
+    # Счетчики списком: проверено и отклонено каждым условием по порядку
+    def counts(self):
+        return [self.checked] + list(self.rejected.values())
+
+    # Добавление счетчиков другого процесса или контрольной точки (в формате counts())
+    def add_counts(self, counts):
+        self.checked += counts[0]
+        for text, count in zip(self.rejected, counts[1:]):
+            self.rejected[text] += count
+
+    def report(self):
+        rejected = sum(self.rejected.values())
+        return {
+            'expression': self.expression,
+            'fields': self.fields,
+            'checked': self.checked,
+            'passed': self.checked - rejected,
+            'rejected': rejected,
+            'rejected_by_condition': self.rejected
+        }
+
+# Отбор из WORK_FILTER (None, если выражение не задано)
+def compile_filter(expression=None):
+    expression = expression if expression is not None else WORK_FILTER
+    if not expression:
+        return None
+    return WorkFilter(expression)
+
+# Сохранение отчета об отборе и вывод отказов по условиям
+def save_filter_report(output_dir, work_filter):
+    report = work_filter.report()
+    logger.info(f"Отбор '{work_filter.expression}': проверено {report['checked']}, прошло {report['passed']}")
+    for text, count in report['rejected_by_condition'].items():
+        logger.info(f"Отклонено условием {text}: {count}")
+    with open(os.path.join(output_dir, FILTER_REPORT_FILE), 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    logger.info(f"Отчет об отборе сохранен в {FILTER_REPORT_FILE}")
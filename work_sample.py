@@ -0,0 +1,202 @@
+import os
+import json
+import time
+import logging
+from array import array
+from collections import defaultdict
+
+from tqdm import tqdm
+
+from works_view import decode_work_key
+from id_codec import encode_id, peek_id
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+logger = logging.getLogger("work_sample")
+
+# Доля публикаций для выборки по хешу ID (None - выключено)
+SAMPLE_RATE = None
+
+# Выборка ровно MAX_WORKS публикаций с наименьшими хешами ID (аналог резервуарной выборки)
+SAMPLE_RESERVOIR = False
+
+# Зерно хеша: одно и то же зерно дает одну и ту же выборку
+SAMPLE_SEED = 0
+
+# Поле для выборки по слоям: 'publication_year', 'type' или None
+SAMPLE_STRATIFY = None
+
+# Отчет о выборке в выходной директории
+SAMPLE_REPORT_FILE = "work_sample.json"
+
+_MASK64 = (1 << 64) - 1
+
+# Включена ли выборка публикаций
+def sampling_enabled():
+    return SAMPLE_RATE is not None or SAMPLE_RESERVOIR
+
+# Нужен ли предварительный проход по частям (резервуар или слои)
+def needs_plan():
+    return SAMPLE_RESERVOIR or SAMPLE_STRATIFY is not None
+
+# Параметры выборки (для контрольных точек и отчета)
+def sample_settings():
+    if not sampling_enabled():
+        return None
+    return {'rate': SAMPLE_RATE, 'reservoir': SAMPLE_RESERVOIR, 'seed': SAMPLE_SEED, 'stratify': SAMPLE_STRATIFY}
+
+# 64-битный хеш кода ID с зерном (финализатор splitmix64)
+def sample_hash(code, seed):
+    """Взаимно однозначен по коду при фиксированном зерне, поэтому у разных ID
+    разные хеши, а порядок хешей не зависит от порядка записей в частях.
+    """
+    x = (code + seed * 0x9E3779B97F4A7C15) & _MASK64
+    x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & _MASK64
+    x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & _MASK64
+    return x ^ (x >> 31)
+
+# Порог хеша для доли rate (публикация берется, если хеш <= порога)
+def rate_threshold(rate):
+    return int(rate * (1 << 64)) - 1 if rate < 1 else _MASK64
+
+# Значение слоя: год или тип публикации (неизвестные типы значений - строкой)
+def stratum_of(record, field):
+    value = record.get(field)
+    return value if value is None or isinstance(value, (int, str)) else str(value)
+
+# Решение о выборке публикации по строке JSON до полного разбора
+class WorkSampler:
+    """thresholds - {слой: порог хеша} (без слоев - один слой None).
+
+    Код ID читается из начала строки (peek_id), и строки с хешем выше
+    наибольшего порога отбрасываются без разбора JSON. Слой определяется
+    по проекции из трех полей (decode_work_key) только у оставшихся строк.
+    Решение зависит только от ID, зерна и порогов, поэтому совпадает в
+    любом процессе пула и на любом запуске.
+    """
+
+    def __init__(self, seed, thresholds, stratify=None, report=None):
+        self.seed = seed
+        self.thresholds = thresholds
+        self.stratify = stratify
+        self.max_threshold = max(thresholds.values(), default=-1)
+        self.report = report or {}
+
+    # Брать ли публикацию
+    def keep(self, line):
+        code = peek_id(line)
+        record = None
+        if code is None:
+            record = decode_work_key(line)
+            code = encode_id(record.get('id'))
+            if code is None:
+                return False
+        digest = sample_hash(code, self.seed)
+        if digest > self.max_threshold:
+            return False
+        if self.stratify is None:
+            return True
+        if record is None:
+            record = decode_work_key(line)
+        threshold = self.thresholds.get(stratum_of(record, self.stratify))
+        return threshold is not None and digest <= threshold
+
+    # Строки отобранных публикаций (некорректные строки передаются дальше, ошибку запишет разбор)
+    def lines(self, lines):
+        for line in lines:
+            try:
+                keep = self.keep(line)
+            except Exception:
+                keep = True
+            if keep:
+                yield line
+
+# Наименьшие k значений массива хешей: k-е по величине (порог включительно)
+def _kth_smallest(hashes, k):
+    if k <= 0:
+        return None
+    if k >= len(hashes):
+        return _MASK64
+    if np is not None:
+        values = np.frombuffer(hashes, dtype=np.uint64)
+        return int(np.partition(values, k - 1)[k - 1])
+    return sorted(hashes)[k - 1]
+
+# Пропорциональное распределение target по слоям (метод наибольших остатков)
+def _allocate(population, target):
+    total = sum(population.values())
+    if total == 0:
+        return {stratum: 0 for stratum in population}
+    shares = {stratum: target * count / total for stratum, count in population.items()}
+    allocation = {stratum: int(share) for stratum, share in shares.items()}
+    # Остаток раздается слоям с наибольшей дробной частью; при равенстве - по имени слоя
+    order = sorted(population, key=lambda stratum: (-(shares[stratum] - allocation[stratum]), str(stratum)))
+    for stratum in order[:target - sum(allocation.values())]:
+        allocation[stratum] += 1
+    return allocation
+
+# Выборка по доле без слоев или предварительный проход по частям works
+def build_sampler(sources, max_works):
+    """sources - (имя, строки, ожидаемое число записей), как в process_works.
+
+    Без слоев выборка по доле делается за один проход и sources не читаются.
+    Для резервуара и слоев предварительный проход собирает хеши ID
+    (8 байт на публикацию) по слоям. Затем для каждого слоя выбирается число
+    публикаций и порог - хеш последней из них по возрастанию.
+    """
+    if not needs_plan():
+        logger.info(f"Выборка публикаций по хешу ID: доля {SAMPLE_RATE}, зерно {SAMPLE_SEED}")
+        return WorkSampler(SAMPLE_SEED, {None: rate_threshold(SAMPLE_RATE)},
+                           report={'population': None, 'target': None})
+
+    start_time = time.time()
+    hashes = defaultdict(lambda: array('Q'))
+    for file_name, lines, expected_records in sources:
+        for line in tqdm(lines, desc=f"Выборка: {file_name}", total=expected_records):
+            try:
+                code = peek_id(line)
+                record = None
+                if code is None or SAMPLE_STRATIFY is not None:
+                    record = decode_work_key(line)
+                    code = code if code is not None else encode_id(record.get('id'))
+                if code is None:
+                    continue
+                stratum = stratum_of(record, SAMPLE_STRATIFY) if SAMPLE_STRATIFY else None
+                hashes[stratum].append(sample_hash(code, SAMPLE_SEED))
+            except Exception as e:
+                logger.error(f"Ошибка при обработке записи: {str(e)}")
+
+    population = {stratum: len(values) for stratum, values in hashes.items()}
+    total = sum(population.values())
+    if SAMPLE_RESERVOIR:
+        target = _allocate(population, min(max_works, total))
+    else:
+        target = {stratum: round(SAMPLE_RATE * count) for stratum, count in population.items()}
+    thresholds = {}
+    for stratum, values in hashes.items():
+        threshold = _kth_smallest(values, target[stratum])
+        if threshold is not None:
+            thresholds[stratum] = threshold
+
+    mode = 'резервуар' if SAMPLE_RESERVOIR else f"доля {SAMPLE_RATE}"
+    layers = f", слоев по {SAMPLE_STRATIFY}: {len(population)}" if SAMPLE_STRATIFY else ""
+    logger.info(f"Выборка публикаций ({mode}, зерно {SAMPLE_SEED}{layers}): "
+                f"публикаций {total}, будет взято {sum(target.values())}, {time.time() - start_time:.2f} секунд")
+    return WorkSampler(SAMPLE_SEED, thresholds, SAMPLE_STRATIFY,
+                       report={'population': population, 'target': target,
+                               'planning_seconds': round(time.time() - start_time, 2)})
+
+# Сохранение отчета о выборке
+def save_sample_report(output_dir, sampler, selected):
+    report = dict(sample_settings(), selected=selected)
+    for key in ('population', 'target'):
+        values = sampler.report.get(key)
+        report[key] = {str(stratum): count for stratum, count in sorted(values.items(), key=lambda item: str(item[0]))} if values else None
+    if 'planning_seconds' in sampler.report:
+        report['planning_seconds'] = sampler.report['planning_seconds']
+    with open(os.path.join(output_dir, SAMPLE_REPORT_FILE), 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    logger.info(f"Отчет о выборке сохранен в {SAMPLE_REPORT_FILE}")
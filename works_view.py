@@ -0,0 +1,99 @@
+from typing import Any, List, Optional
+
+from json_decoder import loads
+
+# Разбирать works через проекцию (только поля, которые читает process_works)
+USE_WORKS_VIEW = True
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+if msgspec is not None:
+    # Базовый класс представлений: доступ к полям как у словаря, чтобы extract_work работал с обоими
+    class RecordView(msgspec.Struct):
+        def get(self, key, default=None):
+            return getattr(self, key, default)
+
+    class SourceView(RecordView):
+        id: Optional[str] = None
+        publisher: Optional[str] = None
+
+    class LocationView(RecordView):
+        source: Optional[SourceView] = None
+
+    class AuthorView(RecordView):
+        id: Optional[str] = None
+
+    class InstitutionView(RecordView):
+        id: Optional[str] = None
+
+    class AuthorshipView(RecordView):
+        author: Optional[AuthorView] = msgspec.field(default_factory=AuthorView)
+        institutions: Optional[List[InstitutionView]] = msgspec.field(default_factory=list)
+
+    class ConceptView(RecordView):
+        id: Optional[str] = None
+        score: Any = 0
+
+    # Проекция записи works: остальные поля (abstract_inverted_index, locations,
+    # counts_by_year и др.) пропускаются декодером без создания объектов.
+    # Числовые поля - Any, чтобы в CSV попадало то же значение, что и при полном разборе
+    class WorkView(RecordView):
+        id: Optional[str] = None
+        title: Optional[str] = ''
+        publication_year: Any = None
+        doi: Optional[str] = ''
+        cited_by_count: Any = 0
+        type: Optional[str] = None
+        host_venue: Optional[SourceView] = None
+        primary_location: Optional[LocationView] = None
+        authorships: Optional[List[AuthorshipView]] = msgspec.field(default_factory=list)
+        concepts: Optional[List[ConceptView]] = msgspec.field(default_factory=list)
+        referenced_works: Optional[List[Optional[str]]] = msgspec.field(default_factory=list)
+
+    # Поля, по которым публикация отбирается до полного разбора (выборка по слоям)
+    class WorkKeyView(RecordView):
+        id: Optional[str] = None
+        publication_year: Any = None
+        type: Optional[str] = None
+
+    _view_decoder = msgspec.json.Decoder(WorkView)
+    _key_decoder = msgspec.json.Decoder(WorkKeyView)
+    VIEW_TYPES = (RecordView,)
+else:
+    _view_decoder = None
+    _key_decoder = None
+    VIEW_TYPES = ()
+
+# Декодирование строки works: проекция WorkView или полный разбор, если она недоступна
+def decode_work(line):
+    """Возвращает WorkView (или dict при полном разборе); оба поддерживают .get().
+
+    Если запись не подходит под схему проекции (другие типы полей, некорректный
+    UTF-8), она разбирается целиком обычным декодером.
+    """
+    if view_enabled():
+        try:
+            return _view_decoder.decode(line)
+        except (msgspec.DecodeError, msgspec.ValidationError):
+            pass
+    return loads(line)
+
+# Декодирование только ID, года и типа публикации (WorkKeyView или полный разбор)
+def decode_work_key(line):
+    if view_enabled():
+        try:
+            return _key_decoder.decode(line)
+        except (msgspec.DecodeError, msgspec.ValidationError):
+            pass
+    return loads(line)
+
+# Используется ли проекция (установлен msgspec и она не отключена)
+def view_enabled():
+    return _view_decoder is not None and USE_WORKS_VIEW
+
+# Проверка, что значение - словарь или представление записи
+def is_mapping(value):
+    return isinstance(value, dict) or isinstance(value, VIEW_TYPES)